@@ -26,12 +26,28 @@ from slugathon.net import config, Results
 from slugathon.util.Observer import IObserver
 from slugathon.util.Observed import Observed
 from slugathon.game import Action, Game, Phase, Creature
-from slugathon.ai import CleverBot, predictsplits, BotParams
+from slugathon.ai import (CleverBot, ExpectiBot, predictsplits,
+                          BotParams, EngagementOdds)
 from slugathon.data.creaturedata import starting_creature_names
 
 
 TEMPDIR = tempfile.gettempdir()
 
+# name : AI class
+ai_classes = {
+    "CleverBot": CleverBot.CleverBot,
+    "ExpectiBot": ExpectiBot.ExpectiBot,
+}
+
+# Actions after which a search in progress for the same game is useless
+stale_plan_actions = (
+    Action.Concede,
+    Action.BattleOver,
+    Action.Withdraw,
+    Action.EliminatePlayer,
+    Action.GameOver,
+)
+
 
 defer.setDebugging(True)
 
@@ -41,14 +57,15 @@ class AIClient(pb.Referenceable, Observed):
 
     def __init__(self, playername, password, host, port, delay, game_name,
                  log_path, ai_time_limit, player_time_limit, form_game,
-                 min_players, max_players):
+                 min_players, max_players, ai_class="CleverBot",
+                 ponder=True, odds_path=None):
         Observed.__init__(self)
         self.playername = playername
         self.password = password
         self.host = host
         self.port = port
         self.delay = delay
-        self.aiclass = "CleverBot"
+        self.aiclass = ai_class
         self.factory = pb.PBClientFactory()
         self.factory.unsafeTracebacks = True
         self.user = None
@@ -68,8 +85,10 @@ class AIClient(pb.Referenceable, Observed):
             playername = "ai%d" % player_id
             player_info = results.get_player_info(player_id)
         bp = BotParams.BotParams.fromstring(player_info)
-        self.ai = CleverBot.CleverBot(self.playername, ai_time_limit,
-                                      bot_params=bp)
+        self.ai = ai_classes[ai_class](self.playername, ai_time_limit,
+                                       bot_params=bp, ponder=ponder,
+                                       odds=EngagementOdds.open_odds(
+                                           odds_path))
         self.game_name = game_name
         self.ai_time_limit = ai_time_limit
         self.player_time_limit = player_time_limit
@@ -219,6 +238,7 @@ class AIClient(pb.Referenceable, Observed):
                 legion.creatures = Creature.n2c(node.creature_names)
                 for creature in legion.creatures:
                     creature.legion = legion
+        game.reindex_battle_hexes()
 
     def failure(self, error):
         log.err(error)
@@ -276,6 +296,9 @@ class AIClient(pb.Referenceable, Observed):
         # Update the Game first, then act.
         self.notify(action, names)
 
+        if isinstance(action, stale_plan_actions):
+            self.ai.cancel_planning(action.game_name)
+
         if self.paused:
             self.last_actions.append(action)
             return
@@ -695,6 +718,14 @@ def add_arguments(parser):
     parser.add_argument("--form-game", action="store_true", default=False)
     parser.add_argument("--min-players", type=int, default=2)
     parser.add_argument("--max-players", type=int, default=6)
+    parser.add_argument("--ai-class", action="store", type=str,
+                        choices=sorted(ai_classes), default="CleverBot")
+    parser.add_argument("--no-ponder", action="store_false", dest="ponder",
+                        default=True,
+                        help="don't think during other players' turns")
+    parser.add_argument("--odds-path", action="store", type=str,
+                        help="engagement odds table (default: %s, if it "
+                        "exists)" % EngagementOdds.DEFAULT_PATH)
 
 
 def main():
@@ -712,7 +743,10 @@ def main():
                         args.player_time_limit,
                         args.form_game,
                         args.min_players,
-                        args.max_players)
+                        args.max_players,
+                        args.ai_class,
+                        args.ponder,
+                        args.odds_path)
     reactor.callWhenRunning(aiclient.connect)
     reactor.run()
 
@@ -0,0 +1,359 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Monte Carlo playouts of battles, for the AI.
+
+A playout plays a whole battle on a copy of a BattleState with a fast greedy
+policy: each creature moves to the hex nearest the enemy (rangestrikers stop
+at range, and creatures wait a little way from the enemy's entrance until it
+enters), strikes the engaged enemy where its mean hits are worth the most,
+and the dice are rolled.  Averaging many playouts gives rough odds of each
+side winning and the points each can expect to keep, much faster than
+playing real games.
+
+Summoning, reinforcements, carries, and drift damage are ignored.  Playout
+states don't keep their hashes up to date.
+"""
+
+
+import random
+
+from slugathon.ai import hitodds
+from slugathon.ai.BattleState import ATTACKER, DEFENDER
+from slugathon.game import Creature, Phase
+
+
+# The attacker loses if it hasn't won by the end of this battle turn.
+MAX_BATTLE_TURNS = 7
+
+# Winner value for a battle where both legions die
+DRAW = -1
+
+# Check the budget every this many playouts.
+BUDGET_INTERVAL = 8
+
+# Range from the enemy's entrance at which to wait for it to enter
+STANDOFF_RANGE = 4
+
+# Most creature move sets to cache per BattleRollout
+MAX_CACHED_MOVES = 100000
+
+
+class RolloutResults(object):
+
+    """Totals from playouts of one battle."""
+
+    def __init__(self):
+        self.count = 0
+        # side or DRAW : number of playouts
+        self.wins = {DEFENDER: 0, ATTACKER: 0, DRAW: 0}
+        # total points of surviving creatures, by side
+        self.survivor_points = [0, 0]
+
+    def __repr__(self):
+        return ("RolloutResults(%d: defender %d attacker %d draw %d, "
+                "survivor points %.1f %.1f)" % (
+                    self.count, self.wins[DEFENDER], self.wins[ATTACKER],
+                    self.wins[DRAW], self.mean_survivor_points(DEFENDER),
+                    self.mean_survivor_points(ATTACKER)))
+
+    def add(self, winner, defender_points, attacker_points):
+        self.count += 1
+        self.wins[winner] += 1
+        self.survivor_points[DEFENDER] += defender_points
+        self.survivor_points[ATTACKER] += attacker_points
+
+    def win_fraction(self, side):
+        """Return the fraction of playouts won by side, or drawn if side is
+        DRAW."""
+        if not self.count:
+            return 0.0
+        return float(self.wins[side]) / self.count
+
+    def mean_survivor_points(self, side):
+        """Return the mean points of side's surviving creatures."""
+        if not self.count:
+            return 0.0
+        return float(self.survivor_points[side]) / self.count
+
+
+# (mterrain, entry_side) : list of lists of the range between each two hex
+# numbers
+_range_tables = {}
+
+
+def _get_range_table(tables):
+    battlemap = tables.battlemap
+    key = (battlemap.mterrain, battlemap.entry_side)
+    ranges = _range_tables.get(key)
+    if ranges is None:
+        ranges = _range_tables[key] = [
+            [battlemap.range(hexlabel1, hexlabel2, allow_entrance=True)
+             for hexlabel2 in tables.hexlabels]
+            for hexlabel1 in tables.hexlabels]
+    return ranges
+
+
+class BattleRollout(object):
+
+    """Plays out the battle from one BattleState many times.
+
+    Playouts keep an occupant list of the slot in each hex on the board, or
+    -1, and work with hex numbers rather than hexlabels.
+    """
+
+    def __init__(self, state, rand=None):
+        self.root = state
+        if rand is None:
+            rand = random.Random()
+        self.rand = rand
+        self.templates = [Creature.Creature(name) for name in state.names]
+        self.points = [state.powers[slot] * template.skill
+                       for slot, template in enumerate(self.templates)]
+        # Slots in descending order of points, for moving strongest first
+        self.by_points = sorted(xrange(len(state)),
+                                key=lambda slot: -self.points[slot])
+        tables = state.tables
+        self.ranges = _get_range_table(tables)
+        self.entrance = [bool(tables.entrance_mask & (1 << hex1))
+                         for hex1 in xrange(tables.num_hexes)]
+        # (name, hex, occupied, start list) : sorted list of move hexes
+        self._moves = {}
+
+    def rollouts(self, count, budget=None):
+        """Play out the battle up to count times, or until budget runs out,
+        and return the RolloutResults."""
+        results = RolloutResults()
+        for ii in xrange(count):
+            if (budget is not None and ii % BUDGET_INTERVAL == 0 and ii and
+                    budget.time_up()):
+                break
+            self.play(results)
+        if budget is not None:
+            budget.add_nodes(results.count)
+        return results
+
+    def play(self, results=None):
+        """Play out the battle once, add the outcome to results if it's not
+        None, and return the winning side, or DRAW."""
+        state = self.root.copy()
+        occupant = [-1] * state.tables.num_hexes
+        for slot, hex1 in enumerate(state.hexes):
+            if hex1 >= 0 and not self.entrance[hex1]:
+                occupant[hex1] = slot
+        while True:
+            winner = self._winner(state)
+            if winner is not None:
+                break
+            if state.battle_phase == Phase.MANEUVER:
+                self._maneuver(state, occupant)
+                state.battle_phase = Phase.STRIKE
+            else:
+                self._strike(state, occupant)
+                self._end_strike_phase(state, occupant)
+        if results is not None:
+            points = [0, 0]
+            for slot in xrange(len(state)):
+                if state.sides[slot] == winner and not state.dead(slot):
+                    points[winner] += self.points[slot]
+            results.add(winner, points[DEFENDER], points[ATTACKER])
+        return winner
+
+    def _winner(self, state):
+        """Return the winning side, DRAW, or None if the battle isn't
+        over."""
+        alive = [False, False]
+        hits = state.hits
+        powers = state.powers
+        for slot, hex1 in enumerate(state.hexes):
+            if hex1 >= 0 and hits[slot] < powers[slot]:
+                alive[state.sides[slot]] = True
+        if alive[DEFENDER] and alive[ATTACKER]:
+            if state.battle_turn > MAX_BATTLE_TURNS:
+                return DEFENDER
+            return None
+        elif alive[DEFENDER]:
+            return DEFENDER
+        elif alive[ATTACKER]:
+            return ATTACKER
+        return DRAW
+
+    def _set_hex(self, state, occupant, slot, hex1):
+        old_hex = state.hexes[slot]
+        state.hexes[slot] = hex1
+        if old_hex >= 0:
+            if occupant[old_hex] == slot:
+                occupant[old_hex] = -1
+            if old_hex not in state.hexes:
+                state.occupied &= ~(1 << old_hex)
+        if hex1 >= 0:
+            state.occupied |= 1 << hex1
+            if not self.entrance[hex1]:
+                occupant[hex1] = slot
+
+    def _engaged_enemies(self, state, occupant, slot):
+        """Return a list of the slots of live enemies engaged with the
+        creature in slot."""
+        result = []
+        hex1 = state.hexes[slot]
+        if hex1 < 0 or self.entrance[hex1]:
+            return result
+        side = state.sides[slot]
+        for hex2 in state.tables.engage_neighbors[hex1]:
+            slot2 = occupant[hex2]
+            if (slot2 >= 0 and state.sides[slot2] != side and
+                    state.hits[slot2] < state.powers[slot2]):
+                result.append(slot2)
+        return result
+
+    def _maneuver(self, state, occupant):
+        """Move the active side's creatures greedily, strongest first.
+        Creatures left off the board on the first turn die."""
+        side = state.active_side
+        enemy_hexes = [hex1 for hex1, slot in enumerate(occupant)
+                       if slot >= 0 and state.sides[slot] != side and
+                       not state.dead(slot)]
+        # If the enemy hasn't entered yet, wait for it a little way from
+        # its entrance.
+        standoff = not enemy_hexes
+        if standoff:
+            enemy_hexes = list(set(
+                hex1 for slot, hex1 in enumerate(state.hexes)
+                if hex1 >= 0 and state.sides[slot] != side))
+        # For each hex, the range to the nearest enemy.  Ranges are
+        # symmetric, so this is the minimum of the enemies' rows.
+        if len(enemy_hexes) > 1:
+            distances = map(min, *[self.ranges[hex1] for hex1 in enemy_hexes])
+        elif enemy_hexes:
+            distances = self.ranges[enemy_hexes[0]]
+        else:
+            return
+        for slot in self.by_points:
+            if (state.sides[slot] != side or state.hexes[slot] < 0 or
+                    state.moved[slot] or
+                    self._engaged_enemies(state, occupant, slot)):
+                continue
+            start = state.hexes[slot]
+            moves = self._find_moves(state, slot)
+            if not moves:
+                continue
+            if not self.entrance[start]:
+                moves.append(start)
+            best_move = self._best_move(slot, moves, distances, standoff)
+            if best_move != start:
+                self._set_hex(state, occupant, slot, best_move)
+                state.moved[slot] = 1
+        for slot, hex1 in enumerate(state.hexes):
+            if (state.sides[slot] == side and hex1 >= 0 and
+                    self.entrance[hex1]):
+                state.hits[slot] = state.powers[slot]
+                self._set_hex(state, occupant, slot, -1)
+
+    def _find_moves(self, state, slot):
+        """Return a new sorted list of the hex numbers to which the mobile
+        creature in slot can move.
+
+        Playouts often repeat positions, especially early on, so moves are
+        cached by creature name, hex, occupied hexes, and whether the
+        defender's first turn start list applies.
+        """
+        key = (state.names[slot], state.hexes[slot], state.occupied,
+               state.battle_turn == 1 and state.sides[slot] == DEFENDER)
+        moves = self._moves.get(key)
+        if moves is None:
+            if len(self._moves) >= MAX_CACHED_MOVES:
+                self._moves.clear()
+            moves = self._moves[key] = sorted(state.find_move_hexes(slot))
+        return list(moves)
+
+    def _best_move(self, slot, moves, distances, standoff):
+        """Return the move that brings the creature in slot closest to
+        the enemy, or for a rangestriker, the closest one in range but not
+        adjacent.  If standoff, stay STANDOFF_RANGE from the enemy instead.
+        Break ties at random."""
+        if standoff:
+            return min(moves, key=lambda move: (
+                abs(distances[move] - STANDOFF_RANGE), self.rand.random()))
+        template = self.templates[slot]
+        rangestrikes = template.rangestrikes
+        skill = template.skill
+        best = None
+        best_moves = []
+        for move in moves:
+            distance = distances[move]
+            if rangestrikes:
+                if 2 < distance <= skill:
+                    score = -1
+                else:
+                    score = abs(distance - 3)
+            else:
+                score = distance
+            if best is None or score < best:
+                best = score
+                best_moves = [move]
+            elif score == best:
+                best_moves.append(move)
+        return self.rand.choice(best_moves)
+
+    def _strike(self, state, occupant):
+        """Roll the active side's strikes, and the other side's
+        strikebacks, and apply the hits."""
+        active_side = state.active_side
+        damage = {}
+        for slot in occupant:
+            if slot < 0 or state.dead(slot):
+                continue
+            engaged = self._engaged_enemies(state, occupant, slot)
+            if engaged:
+                targets = engaged
+                mode = Creature.ENGAGED
+            elif (state.sides[slot] == active_side and
+                  self.templates[slot].rangestrikes):
+                targets = state.potential_rangestrike_targets(slot)
+                mode = Creature.RANGESTRIKE
+            else:
+                continue
+            best = None
+            for target in targets:
+                dice, strike_number = state.strike_values(slot, target, mode)
+                if dice <= 0:
+                    continue
+                mean_hits = hitodds.mean_hits(dice, strike_number)
+                gain = (min(mean_hits, state.hits_left(target)) *
+                        self.points[target] / state.powers[target])
+                if best is None or gain > best[0]:
+                    best = (gain, target, dice, strike_number)
+            if best is not None:
+                gain, target, dice, strike_number = best
+                hits = self._roll(dice, strike_number)
+                if hits:
+                    damage[target] = damage.get(target, 0) + hits
+        for target, hits in damage.iteritems():
+            state.hits[target] = min(state.hits[target] + hits,
+                                     state.powers[target])
+
+    def _roll(self, dice, strike_number):
+        """Return a random number of hits, with one random number."""
+        roll = self.rand.random()
+        for hits, prob in enumerate(hitodds.hit_distribution(dice,
+                                                             strike_number)):
+            roll -= prob
+            if roll < 0:
+                return hits
+        return dice
+
+    def _end_strike_phase(self, state, occupant):
+        """Remove dead creatures and start the other side's maneuver
+        phase."""
+        active_side = state.active_side
+        other_side = 1 - active_side
+        for slot in xrange(len(state)):
+            if state.dead(slot) and state.hexes[slot] >= 0:
+                self._set_hex(state, occupant, slot, -1)
+            if state.sides[slot] == other_side:
+                state.moved[slot] = 0
+        if active_side == ATTACKER:
+            state.battle_turn += 1
+        state.battle_phase = Phase.MANEUVER
+        state.active_side = other_side
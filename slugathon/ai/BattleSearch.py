@@ -0,0 +1,405 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Expectimax lookahead over battle states, for the AI.
+
+The search alternates two kinds of nodes on a BattleState:
+
+maneuver: the active side picks one of a few candidate legion moves.  This
+    is a max node for our side and a min node for the enemy.
+strike: a chance node over the outcomes of the active side's strikes and
+    the other side's strikebacks, with odds from hitodds.
+
+A position's value is the value of our live creatures minus the value of the
+enemy's, with damaged creatures worth less.  Iterative deepening adds one
+phase at a time until time runs out.  Max and min nodes use alpha-beta
+pruning, chance nodes use Ballard's Star1 bounds, and values are kept in a
+transposition table keyed by the states' Zobrist hashes.
+"""
+
+
+import logging
+from itertools import product
+
+from slugathon.ai import hitodds
+from slugathon.ai.BattleState import ATTACKER, zobrist_key
+from slugathon.ai.TranspositionTable import TranspositionTable
+from slugathon.game import Creature, Phase
+
+
+# Only this many targets per strike phase, the most valuable, get separate
+# outcomes for being killed or surviving.  The rest take the likely one.
+MAX_CHANCE_TARGETS = 3
+
+# Kill odds this close to 0 or 1 are treated as certain.
+CERTAIN = 0.05
+
+# Check the clock every this many nodes.
+CLOCK_INTERVAL = 64
+
+# (attack weight, defense weight, approach weight) for each style of
+# candidate legion move generated inside the search: balanced, aggressive,
+# and cautious.
+STYLES = [(1.0, 1.0, 0.05), (1.0, 0.5, 0.1), (0.5, 1.5, 0.0)]
+
+# Transposition table entry flags
+EXACT, LOWER, UPPER = range(3)
+
+
+class TimeUp(Exception):
+    """Raised when a search runs out of time."""
+
+
+class BattleSearch(object):
+
+    """Expectimax search from one BattleState, for one side."""
+
+    def __init__(self, state, side, values, budget, table=None):
+        """state is the BattleState to search from, with side about to
+        choose its legion move.
+
+        values is a list of each creature's value, by slot.
+
+        budget is the Budget for the search.
+        """
+        self.root = state
+        self.side = side
+        self.values = values
+        self.budget = budget
+        if table is None:
+            table = TranspositionTable()
+        self.table = table
+        self._search_key = zobrist_key(("search", side))
+        self.nodes = 0
+        # Values only go down as creatures take damage, so they are bounded
+        # by the root's.
+        self.low = -sum(self._worth(state, slot) for slot in
+                        xrange(len(state)) if state.sides[slot] != side)
+        self.high = sum(self._worth(state, slot) for slot in
+                        xrange(len(state)) if state.sides[slot] == side)
+
+    def _worth(self, state, slot):
+        """Return what the creature in slot is worth: its value if
+        undamaged, half that when almost dead, and nothing when dead."""
+        if state.dead(slot):
+            return 0.0
+        return self.values[slot] * (0.5 + 0.5 * state.hits_left(slot) /
+                                    state.powers[slot])
+
+    def evaluate(self, state):
+        """Return the value of state for our side."""
+        result = 0.0
+        for slot in xrange(len(state)):
+            if state.sides[slot] == self.side:
+                result += self._worth(state, slot)
+            else:
+                result -= self._worth(state, slot)
+        return result
+
+    def choose(self, slots, legion_moves, max_depth):
+        """Return the index of the best of legion_moves, each a list of
+        hexlabels for the creatures in slots, searching up to max_depth
+        phases past the move.
+
+        If time runs out before the first iteration finishes, return 0.
+        """
+        children = []
+        for legion_move in legion_moves:
+            child = self.root.copy()
+            for ii, slot in enumerate(slots):
+                if child.hexlabel(slot) != legion_move[ii]:
+                    child.move(slot, legion_move[ii])
+            child.set_phase(child.battle_turn, Phase.STRIKE, self.side)
+            children.append(child)
+        best_index = 0
+        order = range(len(children))
+        for depth in xrange(1, max_depth + 1):
+            try:
+                best_index, values = self._search_root(children, order,
+                                                       depth)
+            except TimeUp:
+                logging.info("time limit at depth %d", depth)
+                break
+            logging.info("depth %d best %d value %s nodes %d", depth,
+                         best_index, values[best_index], self.nodes)
+            # Try the best children first next time, for more pruning.
+            order.sort(key=lambda index: (index != best_index,
+                                          -values[index], index))
+        return best_index
+
+    def _search_root(self, children, order, depth):
+        """Search children to depth, in order, and return a tuple of the
+        best one's index and a dict of index : value.
+
+        Only the best value is exact; the others may be upper bounds.
+        The first of equally good children wins.
+        """
+        values = {}
+        best_index = order[0]
+        alpha = self.low
+        for index in order:
+            value = self._value(children[index], depth - 1, alpha, self.high)
+            values[index] = value
+            if value > alpha or index == order[0]:
+                alpha = max(alpha, value)
+                if index != order[0]:
+                    best_index = index
+        return best_index, values
+
+    def _value(self, state, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes % CLOCK_INTERVAL == 0:
+            self.budget.add_nodes(CLOCK_INTERVAL)
+            if self.budget.time_up():
+                raise TimeUp
+        if depth <= 0 or self._over(state):
+            return self.evaluate(state)
+        key = state.hash ^ self._search_key
+        entry = self.table.get(key)
+        if entry is not None and entry[0] >= depth:
+            entry_depth, flag, value = entry
+            if (flag == EXACT or (flag == LOWER and value >= beta) or
+               (flag == UPPER and value <= alpha)):
+                return value
+        if state.battle_phase == Phase.STRIKE:
+            value = self._strike_value(state, depth, alpha, beta)
+        else:
+            value = self._maneuver_value(state, depth, alpha, beta)
+        if value <= alpha:
+            flag = UPPER
+        elif value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.put(key, (depth, flag, value))
+        return value
+
+    def _over(self, state):
+        """Return True iff one side has no creatures left."""
+        alive = [False, False]
+        for slot in xrange(len(state)):
+            if not state.dead(slot) and state.hexes[slot] >= 0:
+                alive[state.sides[slot]] = True
+        return not all(alive)
+
+    def _maneuver_value(self, state, depth, alpha, beta):
+        maximize = state.active_side == self.side
+        best = None
+        for child in self._candidate_moves(state):
+            value = self._value(child, depth - 1, alpha, beta)
+            if maximize:
+                if best is None or value > best:
+                    best = value
+                alpha = max(alpha, value)
+            else:
+                if best is None or value < best:
+                    best = value
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+        return best
+
+    def _strike_value(self, state, depth, alpha, beta):
+        """Return the expected value over the strike outcomes, cutting off
+        early when the rest can't bring it inside (alpha, beta)."""
+        total = 0.0
+        remaining = 1.0
+        for prob, hits in self._strike_outcomes(state):
+            child = state.copy()
+            for slot, new_hits in hits:
+                child.set_hits(slot, new_hits)
+            self._end_strike_phase(child)
+            remaining -= prob
+            child_alpha = (alpha - total - remaining * self.high) / prob
+            child_beta = (beta - total - remaining * self.low) / prob
+            value = self._value(child, depth - 1, max(child_alpha, self.low),
+                                min(child_beta, self.high))
+            total += prob * value
+            if value <= child_alpha:
+                return total + remaining * self.high
+            if value >= child_beta:
+                return total + remaining * self.low
+        return total
+
+    def _end_strike_phase(self, state):
+        """Remove dead creatures and start the other side's maneuver
+        phase."""
+        active_side = state.active_side
+        other_side = 1 - active_side
+        for slot in xrange(len(state)):
+            if state.dead(slot) and state.hexes[slot] >= 0:
+                state.place(slot, None)
+            if state.struck[slot]:
+                state.set_struck(slot, False)
+            if state.sides[slot] == other_side and state.moved[slot]:
+                state.set_moved(slot, False)
+        battle_turn = state.battle_turn
+        if active_side == ATTACKER:
+            battle_turn += 1
+        state.set_phase(battle_turn, Phase.MANEUVER, other_side)
+
+    def _choose_targets(self, state, strikers, plans, mean_hits_planned):
+        """Add each of strikers' strikes to plans, a dict of target slot :
+        list of (dice, strike_number), picking for each the target where
+        its mean hits are worth the most."""
+        for slot in strikers:
+            engaged = state.engaged_enemies(slot)
+            if engaged:
+                targets = engaged
+                mode = Creature.ENGAGED
+            else:
+                targets = state.potential_rangestrike_targets(slot)
+                mode = Creature.RANGESTRIKE
+            best = None
+            for target in targets:
+                dice, strike_number = state.strike_values(slot, target, mode)
+                if dice <= 0:
+                    continue
+                mean_hits = hitodds.mean_hits(dice, strike_number)
+                hits_left = state.hits_left(target)
+                planned = mean_hits_planned.get(target, 0.0)
+                gain = (self.values[target] *
+                        (min(planned + mean_hits, hits_left) -
+                         min(planned, hits_left)) / state.powers[target])
+                if best is None or gain > best[0]:
+                    best = (gain, target, dice, strike_number, mean_hits)
+            if best is not None:
+                gain, target, dice, strike_number, mean_hits = best
+                plans.setdefault(target, []).append((dice, strike_number))
+                mean_hits_planned[target] = (
+                    mean_hits_planned.get(target, 0.0) + mean_hits)
+
+    def _strike_outcomes(self, state):
+        """Return a list of (probability, list of (slot, hits)) outcomes of
+        a strike phase, most likely first."""
+        active_side = state.active_side
+        strikers = []
+        strikebackers = []
+        for slot in xrange(len(state)):
+            if state.dead(slot) or not state.onboard(slot):
+                continue
+            if state.sides[slot] == active_side:
+                strikers.append(slot)
+            elif state.engaged(slot):
+                strikebackers.append(slot)
+        strikers.sort(key=lambda slot: -self.values[slot])
+        strikebackers.sort(key=lambda slot: -self.values[slot])
+        plans = {}
+        mean_hits_planned = {}
+        self._choose_targets(state, strikers, plans, mean_hits_planned)
+        self._choose_targets(state, strikebackers, plans, mean_hits_planned)
+        # list of lists of (probability, slot, hits) for each target
+        target_outcomes = []
+        for target in sorted(plans, key=lambda slot: -self.values[slot]):
+            hits_left = state.hits_left(target)
+            distribution = hitodds.combined_distribution(plans[target],
+                                                         hits_left)
+            if len(distribution) > hits_left:
+                kill_prob = distribution[hits_left]
+            else:
+                kill_prob = 0.0
+            survive_prob = 1.0 - kill_prob
+            kill_hits = state.powers[target]
+            if survive_prob > 0:
+                mean_damage = sum(hits * distribution[hits] for hits in
+                                  xrange(min(hits_left, len(distribution))))
+                survive_hits = (state.hits[target] +
+                                int(round(mean_damage / survive_prob)))
+            else:
+                survive_hits = kill_hits
+            if (kill_prob <= CERTAIN or (len(target_outcomes) >=
+               MAX_CHANCE_TARGETS and not hitodds.likely(kill_prob))):
+                outcomes = [(1.0, target, survive_hits)]
+            elif (kill_prob >= 1.0 - CERTAIN or
+                  len(target_outcomes) >= MAX_CHANCE_TARGETS):
+                outcomes = [(1.0, target, kill_hits)]
+            else:
+                outcomes = [(kill_prob, target, kill_hits),
+                            (survive_prob, target, survive_hits)]
+            target_outcomes.append(outcomes)
+        result = []
+        for combo in product(*target_outcomes):
+            prob = 1.0
+            hits = []
+            for target_prob, target, target_hits in combo:
+                prob *= target_prob
+                hits.append((target, target_hits))
+            result.append((prob, hits))
+        result.sort(key=lambda tup: -tup[0])
+        return result
+
+    def _candidate_moves(self, state):
+        """Return a list of new states, one for each candidate legion move
+        for the active side, with the strike phase next.
+
+        The candidates are not moving at all, and a greedy legion move for
+        each style in STYLES.
+        """
+        side = state.active_side
+        movers = [slot for slot in state.slots(side)
+                  if state.hexes[slot] >= 0 and state.mobile(slot)]
+        movers.sort(key=lambda slot: -self.values[slot])
+        result = []
+        seen = set()
+        stay = state.copy()
+        stay.set_phase(stay.battle_turn, Phase.STRIKE, side)
+        for weights in STYLES:
+            child = state.copy()
+            for slot in movers:
+                start = child.hexlabel(slot)
+                moves = child.find_moves(slot)
+                if not child.offboard(slot):
+                    moves.add(start)
+                if not moves:
+                    continue
+                best_move = max(sorted(moves), key=lambda move:
+                                self._move_score(child, slot, move, weights))
+                if best_move != start:
+                    child.move(slot, best_move)
+            child.set_phase(child.battle_turn, Phase.STRIKE, side)
+            if child.hash not in seen:
+                seen.add(child.hash)
+                result.append(child)
+        if stay.hash not in seen:
+            result.append(stay)
+        return result
+
+    def _move_score(self, state, slot, hexlabel, weights):
+        """Return a rough score for the creature in slot moving to
+        hexlabel, by the damage it could do and take there."""
+        attack_weight, defense_weight, approach_weight = weights
+        start = state.hexlabel(slot)
+        state.place(slot, hexlabel)
+        try:
+            value = self.values[slot] / state.powers[slot]
+            engaged = state.engaged_enemies(slot)
+            attack = 0.0
+            defense = 0.0
+            if engaged:
+                targets = engaged
+                mode = Creature.ENGAGED
+            else:
+                targets = state.potential_rangestrike_targets(slot)
+                mode = Creature.RANGESTRIKE
+            for target in targets:
+                dice, strike_number = state.strike_values(slot, target, mode)
+                attack = max(attack, hitodds.mean_hits(dice, strike_number) *
+                             self.values[target] / state.powers[target])
+            for enemy in engaged:
+                dice, strike_number = state.strike_values(enemy, slot,
+                                                          Creature.ENGAGED)
+                defense += hitodds.mean_hits(dice, strike_number) * value
+            distance = 0
+            if not targets and approach_weight:
+                battlemap = state.tables.battlemap
+                distances = [battlemap.range(hexlabel, state.hexlabel(enemy))
+                             for enemy in xrange(len(state))
+                             if state.sides[enemy] != state.sides[slot] and
+                             state.onboard(enemy) and not state.dead(enemy)]
+                if distances:
+                    distance = min(distances)
+            return (attack_weight * attack - defense_weight * defense -
+                    approach_weight * distance)
+        finally:
+            state.place(slot, start)
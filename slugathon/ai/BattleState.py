@@ -0,0 +1,584 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""A compact copy of a battle's state, for AI search.
+
+Creatures are numbered in Game.battle_legions order (the defender's creatures,
+then the attacker's), and described by parallel arrays of small integers.
+Hexes are numbered in sorted hexlabel order, and occupancy is a bitmask of
+hex numbers.  So states are cheap to copy, and searching them never touches
+the real Game, Legion, and Creature objects.
+
+Each state keeps a Zobrist hash: the XOR of a pseudorandom key for each
+creature's (name, side, power, hex, hits, moved, struck) and for the map,
+turn, phase, and active side.  Identical creatures share keys, so positions
+that only differ by swapping them hash the same.  Keys are derived from the
+features themselves, so every thread and process agrees on them.
+"""
+
+
+from array import array
+from sys import maxint
+import hashlib
+import struct
+
+from slugathon.game import BattleMap, Creature, Phase
+
+
+DEFENDER = 0
+ATTACKER = 1
+
+# (mterrain, entry_side) : _MapTables
+_map_tables = {}
+
+# creature name : Creature, for looking up creature data
+_templates = {}
+
+# feature tuple : 64-bit key
+_zobrist_keys = {}
+
+
+def zobrist_key(feature):
+    """Return the 64-bit key for feature, a tuple of strings, numbers,
+    and booleans.
+
+    The key is part of the MD5 hash of the feature's repr, so it's the
+    same in every process, and threads that race to fill in the cache
+    store the same value.
+    """
+    key = _zobrist_keys.get(feature)
+    if key is None:
+        digest = hashlib.md5("zobrist %r" % (feature,)).digest()
+        key = _zobrist_keys[feature] = struct.unpack("<Q", digest[:8])[0]
+    return key
+
+
+def _template(name):
+    creature = _templates.get(name)
+    if creature is None:
+        creature = _templates[name] = Creature.Creature(name)
+    return creature
+
+
+class _MapTables(object):
+
+    """Lookup tables for one battle map, shared by all states on it."""
+
+    def __init__(self, battlemap):
+        self.battlemap = battlemap
+        self.hexlabels = sorted(battlemap.hexes)
+        self.hex_index = dict((hexlabel, ii) for ii, hexlabel in
+                              enumerate(self.hexlabels))
+        self.num_hexes = len(self.hexlabels)
+        self.entrance_mask = 0
+        # For each hex, a list of (neighbor hex, hexside border crossed
+        # entering it, neighbor terrain)
+        self.steps = []
+        # For each hex, a list of neighbor hexes not across a cliff
+        self.engage_neighbors = []
+        for ii, hexlabel in enumerate(self.hexlabels):
+            hex1 = battlemap.hexes[hexlabel]
+            if hex1.entrance:
+                self.entrance_mask |= 1 << ii
+            steps = []
+            engage_neighbors = []
+            for hexside, hex2 in sorted(hex1.neighbors.iteritems()):
+                jj = self.hex_index[hex2.label]
+                if hex1.entrance:
+                    # Ignore hexside penalties from entrances, like
+                    # Game._find_battle_moves_inner.
+                    border = None
+                else:
+                    border = hex1.opposite_border(hexside)
+                steps.append((jj, border, hex2.terrain))
+                if (hex1.borders[hexside] != "Cliff" and
+                   hex2.borders[(hexside + 3) % 6] != "Cliff"):
+                    engage_neighbors.append(jj)
+            self.steps.append(steps)
+            self.engage_neighbors.append(engage_neighbors)
+        if battlemap.startlist:
+            self.startlist = [self.hex_index[hexlabel] for hexlabel in
+                              battlemap.startlist]
+        else:
+            self.startlist = None
+        # (hex1, hex2) : list of (terrain_blocked, chit mask)
+        self._los_masks = {}
+        # creature name : for each hex, a list of (neighbor hex, entry cost,
+        # flyover cost)
+        self.costs = {}
+
+    def los_masks(self, hex1, hex2):
+        key = (hex1, hex2)
+        masks = self._los_masks.get(key)
+        if masks is None:
+            masks = []
+            for terrain_blocked, chit_hexlabels in self.battlemap.los_paths(
+                    self.hexlabels[hex1], self.hexlabels[hex2]):
+                mask = 0
+                for hexlabel in chit_hexlabels:
+                    mask |= 1 << self.hex_index[hexlabel]
+                masks.append((terrain_blocked, mask))
+            self._los_masks[key] = masks
+        return masks
+
+    def add_costs(self, game, name):
+        """Find movement costs for creatures named name, using game's
+        rules."""
+        if name in self.costs:
+            return
+        creature = _template(name)
+        costs = []
+        for steps in self.steps:
+            lst = []
+            for jj, border, terrain in steps:
+                cost = game.battle_hex_entry_cost(creature, terrain, border)
+                flyover_cost = game.battle_hex_flyover_cost(creature, terrain)
+                lst.append((jj, cost, flyover_cost))
+            costs.append(lst)
+        self.costs[name] = costs
+
+
+def _get_map_tables(battlemap):
+    key = (battlemap.mterrain, battlemap.entry_side)
+    tables = _map_tables.get(key)
+    if tables is None:
+        tables = _map_tables[key] = _MapTables(battlemap)
+    return tables
+
+
+class BattleState(object):
+
+    """The creatures' positions, hits, and moved and struck flags, and the
+    turn and phase, of one battle."""
+
+    def __init__(self, tables, names, sides, powers, hexes, hits, moved,
+                 struck, battle_turn, battle_phase, active_side):
+        self.tables = tables
+        # Creature data doesn't change during the battle, so share it.
+        self.names = names
+        self.sides = sides
+        self.powers = powers
+        # Positions are hex numbers, or -1 for no hex.
+        self.hexes = hexes
+        self.hits = hits
+        self.moved = moved
+        self.struck = struck
+        self.battle_turn = battle_turn
+        self.battle_phase = battle_phase
+        self.active_side = active_side
+        self.occupied = 0
+        for hex1 in hexes:
+            if hex1 >= 0:
+                self.occupied |= 1 << hex1
+        self.hash = self._compute_hash()
+
+    @classmethod
+    def from_game(klass, game):
+        """Return a BattleState for game's current battle."""
+        return klass._from_legions(game, game.battlemap, game.battle_legions,
+                                   game.battle_active_legion, game.battle_turn,
+                                   game.battle_phase)
+
+    @classmethod
+    def for_engagement(klass, game, attacker_legion, defender_legion,
+                       entry_side=None):
+        """Return a BattleState for the start of a battle between
+        attacker_legion and defender_legion, like Game._init_battle, without
+        touching game.
+
+        entry_side defaults to attacker_legion's.
+        """
+        if entry_side is None:
+            entry_side = attacker_legion.entry_side
+        masterhex = game.board.hexes[defender_legion.hexlabel]
+        battlemap = BattleMap.get_battlemap(masterhex.terrain, entry_side)
+        return klass._from_legions(game, battlemap,
+                                   [defender_legion, attacker_legion],
+                                   defender_legion, 1, Phase.MANEUVER,
+                                   ["DEFENDER", "ATTACKER"])
+
+    @classmethod
+    def _from_legions(klass, game, battlemap, legions, active_legion,
+                      battle_turn, battle_phase, entrances=None):
+        """Return a BattleState for legions, the defender's and the
+        attacker's, on battlemap.
+
+        If entrances is not None, it's a list of each legion's entrance
+        hexlabel, where all its creatures start unmoved, instead of where
+        they are.
+        """
+        tables = _get_map_tables(battlemap)
+        names = []
+        sides = array("b")
+        powers = array("b")
+        hexes = array("b")
+        hits = array("b")
+        moved = array("b")
+        struck = array("b")
+        active_side = None
+        for side, legion in enumerate(legions):
+            if legion is active_legion:
+                active_side = side
+            for creature in legion.creatures:
+                names.append(creature.name)
+                tables.add_costs(game, creature.name)
+                sides.append(side)
+                powers.append(creature.power)
+                if entrances is not None:
+                    hexes.append(tables.hex_index[entrances[side]])
+                elif creature.hexlabel is None:
+                    hexes.append(-1)
+                else:
+                    hexes.append(tables.hex_index[creature.hexlabel])
+                hits.append(creature.hits)
+                if entrances is None:
+                    moved.append(creature.moved)
+                    struck.append(creature.struck)
+                else:
+                    moved.append(False)
+                    struck.append(False)
+        return klass(tables, tuple(names), sides, powers, hexes, hits, moved,
+                     struck, battle_turn, battle_phase, active_side)
+
+    @staticmethod
+    def game_creatures(game):
+        """Return a list of game's battle creatures, in slot order."""
+        return [creature for legion in game.battle_legions
+                for creature in legion.creatures]
+
+    @classmethod
+    def game_slots(klass, game, creatures):
+        """Return a list of the slots of game's battle creatures
+        creatures."""
+        slot_of = dict((id(creature), slot) for slot, creature in
+                       enumerate(klass.game_creatures(game)))
+        return [slot_of[id(creature)] for creature in creatures]
+
+    def apply_to_game(self, game):
+        """Set the positions, hits, and flags of game's battle creatures
+        from this state."""
+        creatures = self.game_creatures(game)
+        assert len(creatures) == len(self.names)
+        for slot, creature in enumerate(creatures):
+            assert creature.name == self.names[slot]
+            hexlabel = self.hexlabel(slot)
+            if creature.hexlabel != hexlabel:
+                creature.hexlabel = hexlabel
+            if creature.hits != self.hits[slot]:
+                creature.hits = self.hits[slot]
+            creature.moved = bool(self.moved[slot])
+            creature.struck = bool(self.struck[slot])
+
+    def copy(self):
+        """Return a copy of this state."""
+        return BattleState(self.tables, self.names, self.sides,
+                           array("b", self.powers), array("b", self.hexes),
+                           array("b", self.hits), array("b", self.moved),
+                           array("b", self.struck), self.battle_turn,
+                           self.battle_phase, self.active_side)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _creature_key(self, slot):
+        return zobrist_key((self.names[slot], self.sides[slot],
+                            self.powers[slot], self.hexes[slot],
+                            self.hits[slot], self.moved[slot],
+                            self.struck[slot]))
+
+    def _phase_key(self):
+        battlemap = self.tables.battlemap
+        return zobrist_key(("map", battlemap.mterrain, battlemap.entry_side,
+                            self.battle_turn, self.battle_phase,
+                            self.active_side))
+
+    def _compute_hash(self):
+        """Return the Zobrist hash of this state, from scratch."""
+        result = self._phase_key()
+        for slot in xrange(len(self.names)):
+            result ^= self._creature_key(slot)
+        return result
+
+    def hash_for_slots(self, slots):
+        """Return this state's hash combined with a key for the creatures
+        in slots, for caching values that only cover those creatures."""
+        return self.hash ^ zobrist_key(("slots",) + tuple(slots))
+
+    def move_hash(self, slot, hexlabel):
+        """Return what this state's hash would be after placing the
+        creature in slot in the hex with hexlabel, without moving it.
+
+        Moves of different creatures combine by XORing the differences
+        from the current hash.
+        """
+        old_hex = self.hexes[slot]
+        result = self.hash ^ self._creature_key(slot)
+        if hexlabel is None:
+            self.hexes[slot] = -1
+        else:
+            self.hexes[slot] = self.tables.hex_index[hexlabel]
+        result ^= self._creature_key(slot)
+        self.hexes[slot] = old_hex
+        return result
+
+    def slots(self, side):
+        """Return a list of the creature slots on side."""
+        return [slot for slot in xrange(len(self.names))
+                if self.sides[slot] == side]
+
+    def hexlabel(self, slot):
+        hex1 = self.hexes[slot]
+        if hex1 < 0:
+            return None
+        return self.tables.hexlabels[hex1]
+
+    def dead(self, slot):
+        return self.hits[slot] >= self.powers[slot]
+
+    def hits_left(self, slot):
+        return max(self.powers[slot] - self.hits[slot], 0)
+
+    def offboard(self, slot):
+        hex1 = self.hexes[slot]
+        return hex1 >= 0 and bool(self.tables.entrance_mask & (1 << hex1))
+
+    def onboard(self, slot):
+        return self.hexes[slot] >= 0 and not self.offboard(slot)
+
+    def is_occupied(self, hexlabel):
+        """Return True iff there's a creature in the hex with hexlabel."""
+        return bool(self.occupied & (1 << self.tables.hex_index[hexlabel]))
+
+    def slots_in_hex(self, hex1):
+        return [slot for slot in xrange(len(self.names))
+                if self.hexes[slot] == hex1]
+
+    def place(self, slot, hexlabel):
+        """Put the creature in slot in the hex with hexlabel, without
+        marking it moved."""
+        old_hex = self.hexes[slot]
+        if hexlabel is None:
+            new_hex = -1
+        else:
+            new_hex = self.tables.hex_index[hexlabel]
+        self.hash ^= self._creature_key(slot)
+        self.hexes[slot] = new_hex
+        self.hash ^= self._creature_key(slot)
+        if old_hex >= 0 and old_hex not in self.hexes:
+            self.occupied &= ~(1 << old_hex)
+        if new_hex >= 0:
+            self.occupied |= 1 << new_hex
+
+    def move(self, slot, hexlabel):
+        """Move the creature in slot to the hex with hexlabel."""
+        self.place(slot, hexlabel)
+        self.hash ^= self._creature_key(slot)
+        self.moved[slot] = 1
+        self.hash ^= self._creature_key(slot)
+
+    def set_hits(self, slot, hits):
+        """Set the hits on the creature in slot."""
+        self.hash ^= self._creature_key(slot)
+        self.hits[slot] = hits
+        self.hash ^= self._creature_key(slot)
+
+    def set_moved(self, slot, moved=True):
+        """Mark the creature in slot as having moved, or not."""
+        self.hash ^= self._creature_key(slot)
+        self.moved[slot] = moved
+        self.hash ^= self._creature_key(slot)
+
+    def set_phase(self, battle_turn, battle_phase, active_side):
+        """Set the battle turn, phase, and active side."""
+        self.hash ^= self._phase_key()
+        self.battle_turn = battle_turn
+        self.battle_phase = battle_phase
+        self.active_side = active_side
+        self.hash ^= self._phase_key()
+
+    def set_struck(self, slot, struck=True):
+        """Mark the creature in slot as having struck, or not."""
+        self.hash ^= self._creature_key(slot)
+        self.struck[slot] = struck
+        self.hash ^= self._creature_key(slot)
+
+    def _adjacent_enemies(self, slot, dead):
+        result = []
+        if not self.onboard(slot):
+            return result
+        side = self.sides[slot]
+        neighbors = self.tables.engage_neighbors[self.hexes[slot]]
+        for slot2 in xrange(len(self.names)):
+            if (self.sides[slot2] != side and
+               self.hexes[slot2] in neighbors and
+               self.dead(slot2) == dead and not self.offboard(slot2)):
+                result.append(slot2)
+        return result
+
+    def engaged_enemies(self, slot):
+        """Return a list of the slots of live enemies engaged with the
+        creature in slot."""
+        return self._adjacent_enemies(slot, False)
+
+    def dead_adjacent_enemies(self, slot):
+        """Return a list of the slots of dead enemies adjacent to the
+        creature in slot, not across a cliff."""
+        return self._adjacent_enemies(slot, True)
+
+    def engaged(self, slot):
+        return bool(self.engaged_enemies(slot))
+
+    def mobile(self, slot):
+        return (not self.moved[slot] and not self.dead(slot) and
+                not self.engaged(slot))
+
+    def find_moves(self, slot, ignore_mobile_allies=False):
+        """Return a set of all hexlabels to which the creature in slot can
+        move, excluding its current hex, like Game.find_battle_moves."""
+        hexlabels = self.tables.hexlabels
+        return set(hexlabels[hex1] for hex1 in
+                   self.find_move_hexes(slot, ignore_mobile_allies))
+
+    def find_move_hexes(self, slot, ignore_mobile_allies=False):
+        """Return a set of the hex numbers to which the creature in slot
+        can move, excluding its current hex."""
+        result = set()
+        start = self.hexes[slot]
+        if start < 0:
+            return result
+        if self.moved[slot] or self.engaged(slot):
+            return result
+        tables = self.tables
+        if (self.battle_turn == 1 and self.sides[slot] == DEFENDER and
+           tables.startlist):
+            for hex2 in tables.startlist:
+                if not self.occupied & (1 << hex2):
+                    result.add(hex2)
+            return result
+        template = _template(self.names[slot])
+        flies = template.flies
+        movement_left = template.skill
+        costs = tables.costs[self.names[slot]]
+        # hex : movement left after reaching it
+        best = {start: movement_left}
+        # buckets[ii] is a list of hexes reached with ii movement left
+        buckets = [[] for unused in xrange(movement_left + 1)]
+        buckets[movement_left].append(start)
+        # hex : True iff the creature can end its move there
+        open_hexes = {}
+        for left in xrange(movement_left, 0, -1):
+            for hex1 in buckets[left]:
+                if best[hex1] != left:
+                    continue
+                for hex2, cost, flyover_cost in costs[hex1]:
+                    is_open = open_hexes.get(hex2)
+                    if is_open is None:
+                        if not self.occupied & (1 << hex2):
+                            is_open = True
+                        elif ignore_mobile_allies:
+                            slot2 = self.slots_in_hex(hex2)[0]
+                            is_open = (self.sides[slot2] ==
+                                       self.sides[slot] and
+                                       self.mobile(slot2))
+                        else:
+                            is_open = False
+                        open_hexes[hex2] = is_open
+                    if not is_open and not flies:
+                        continue
+                    if cost <= left and is_open:
+                        result.add(hex2)
+                    if not flies:
+                        flyover_cost = maxint
+                    min_cost = min(cost, flyover_cost)
+                    if min_cost < left:
+                        left2 = left - min_cost
+                        if left2 > best.get(hex2, 0):
+                            best[hex2] = left2
+                            buckets[left2].append(hex2)
+        result.discard(start)
+        return result
+
+    def is_los_blocked(self, slot, slot2):
+        """Return True iff the line of sight between the creatures in slot
+        and slot2 is blocked by terrain or creatures."""
+        hex1 = self.hexes[slot]
+        hex2 = self.hexes[slot2]
+        if hex1 == hex2:
+            return False
+        for terrain_blocked, mask in self.tables.los_masks(hex1, hex2):
+            if not terrain_blocked and not self.occupied & mask:
+                return False
+        return True
+
+    def potential_rangestrike_targets(self, slot):
+        """Return a list of the slots of creatures that the creature in slot
+        could rangestrike if the phase were correct."""
+        result = []
+        template = _template(self.names[slot])
+        if (not self.onboard(slot) or not template.rangestrikes or
+           self.dead_adjacent_enemies(slot)):
+            return result
+        battlemap = self.tables.battlemap
+        hexlabel = self.hexlabel(slot)
+        side = self.sides[slot]
+        for slot2 in xrange(len(self.names)):
+            if (self.sides[slot2] != side and self.onboard(slot2) and
+               not self.dead(slot2) and
+               battlemap.range(hexlabel, self.hexlabel(slot2)) <=
+               template.skill and
+               (template.magicmissile or
+                (not self.is_los_blocked(slot, slot2) and
+                 not _template(self.names[slot2]).is_lord))):
+                result.append(slot2)
+        return result
+
+    def rangestrike_targets(self, slot):
+        """Return a list of the slots of creatures that the creature in slot
+        can rangestrike."""
+        if self.battle_phase != Phase.STRIKE:
+            return []
+        return self.potential_rangestrike_targets(slot)
+
+    def strike_values(self, slot, slot2, mode=None):
+        """Return a tuple (number of dice, strike number) to use if the
+        creature in slot strikes the one in slot2, like
+        Creature.strike_values."""
+        name = self.names[slot]
+        template = _template(name)
+        if mode is None:
+            if slot2 in self.engaged_enemies(slot):
+                mode = Creature.ENGAGED
+            elif slot2 in self.potential_rangestrike_targets(slot):
+                mode = Creature.RANGESTRIKE
+        if (mode == Creature.ENGAGED or template.magicmissile or
+                template.is_native("Bramble")):
+            los_blocked = None
+        elif mode == Creature.RANGESTRIKE:
+            los_blocked = False
+        else:
+            los_blocked = self.is_los_blocked(slot, slot2)
+        hexlabel = self.hexlabel(slot)
+        hexlabel2 = self.hexlabel(slot2)
+        key = (name, self.powers[slot], self.names[slot2], hexlabel,
+               hexlabel2, mode, los_blocked)
+        map1 = self.tables.battlemap
+        values = map1.strike_table.get(key)
+        if values is None:
+            striker = _placed_creature(name, self.powers[slot], hexlabel)
+            target = _placed_creature(self.names[slot2], self.powers[slot2],
+                                      hexlabel2)
+            values = map1.strike_table[key] = (
+                striker._compute_number_of_dice(target, map1, mode),
+                striker._compute_strike_number(target, map1, mode,
+                                               los_blocked))
+        return values
+
+
+def _placed_creature(name, power, hexlabel):
+    """Return a new Creature named name, with power, in hexlabel, outside
+    any legion, for computing strike values."""
+    creature = Creature.Creature(name)
+    creature._power = power
+    creature.hexlabel = hexlabel
+    return creature
@@ -54,3 +54,6 @@ class Bot(Interface):
 
     def acquire_angels(game, markerid, num_angels, num_archangels):
         """Acquire angels."""
+
+    def cancel_planning(game_name):
+        """Abandon any search in progress for game_name."""
@@ -0,0 +1,166 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Time budgets for AI decisions.
+
+A BudgetManager hands each decision a Budget, limited by both the AI time
+limit and what's left of the time for its turn.  A turn is whatever span of
+decisions the caller wants to share one allowance, such as one battle turn
+of one engagement, so a long run of decisions doesn't starve the later
+ones.  A decision splits its Budget into slices for its sub-searches.
+Searches poll time_up() and return their best answer so far once it's
+True, and report their progress with add_nodes().  Each decision may have
+a cancelled Event; setting it (from another thread) makes the decision's
+Budget and all its slices run out at once.
+"""
+
+
+import collections
+import logging
+import time
+
+
+# Plan to use this fraction of the AI time limit per decision, leaving the
+# rest for overhead.
+SAFETY_FRACTION = 0.9
+
+# All the decisions in one turn may take this many times the AI time limit.
+TURN_MULTIPLE = 4
+
+# Never give a decision less than this fraction of the AI time limit, even
+# late in a long turn, so it can find some answer.
+MIN_FRACTION = 0.1
+
+# When a decision runs past its budget by more than this fraction, the
+# machine is probably loaded, so shrink later budgets by SHRINK_FACTOR, down
+# to MIN_SCALE.  Decisions that finish in time grow them back by
+# GROW_FACTOR.
+OVERRUN_FRACTION = 0.1
+SHRINK_FACTOR = 0.75
+GROW_FACTOR = 1.1
+MIN_SCALE = 0.25
+
+
+class Budget(object):
+
+    """The time for one decision or sub-search, ending at finish_time, or
+    when cancelled, an Event or None, is set."""
+
+    def __init__(self, name, finish_time, parent=None, manager=None,
+                 clock=time.time, cancelled=None):
+        self.name = name
+        self.clock = clock
+        self.start_time = clock()
+        self.finish_time = finish_time
+        self.parent = parent
+        self.manager = manager
+        self.cancelled = cancelled
+        # Whether a BudgetManager counts this decision's time against its
+        # turn
+        self.charged = False
+        self.nodes = 0
+        self.expired = False
+
+    def __repr__(self):
+        return "Budget(%s, %.3fs left, %d nodes)" % (self.name, self.remaining,
+                                                     self.nodes)
+
+    @property
+    def remaining(self):
+        """Return the number of seconds left, or 0."""
+        return max(self.finish_time - self.clock(), 0.0)
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.start_time
+
+    def time_up(self):
+        """Return True iff this budget has run out."""
+        if self.expired:
+            return True
+        if self.cancelled is not None and self.cancelled.is_set():
+            self.expired = True
+            logging.info("%s cancelled after %d nodes", self.name, self.nodes)
+            return True
+        if self.clock() < self.finish_time:
+            return False
+        self.expired = True
+        logging.info("%s ran out of time after %d nodes", self.name,
+                     self.nodes)
+        if self.manager is not None:
+            self.manager.limits_hit[self.name] += 1
+        return True
+
+    def add_nodes(self, nodes):
+        """Note that a search has done nodes more units of work."""
+        budget = self
+        while budget is not None:
+            budget.nodes += nodes
+            budget = budget.parent
+
+    def slice(self, name, fraction=1.0):
+        """Return a sub-budget with fraction of the time left."""
+        now = self.clock()
+        finish_time = now + fraction * max(self.finish_time - now, 0.0)
+        return Budget(name, finish_time, self, self.manager, self.clock,
+                      self.cancelled)
+
+
+class BudgetManager(object):
+
+    """Hands out Budgets for one bot's decisions, and keeps statistics on
+    how they were used."""
+
+    def __init__(self, time_limit, clock=time.time):
+        self.time_limit = time_limit
+        self.clock = clock
+        self.turn = None
+        self.turn_time_used = 0.0
+        # Multiplier for budgets, lowered when the machine seems loaded
+        self.scale = 1.0
+        self.decisions = 0
+        self.nodes = 0
+        # budget name : number of times it ran out
+        self.limits_hit = collections.defaultdict(int)
+
+    def decision(self, name, turn=None, cancelled=None, charge=True):
+        """Return a Budget for a new decision during turn, a hashable key
+        shared by the decisions that share a turn's time.  Setting
+        cancelled, an Event or None, abandons the decision.
+
+        If not charge, the decision is speculative, like pondering while
+        other players decide, and neither uses nor is limited by its
+        turn's time.
+        """
+        time_limit = self.scale * SAFETY_FRACTION * self.time_limit
+        if charge:
+            if turn != self.turn:
+                self.turn = turn
+                self.turn_time_used = 0.0
+            turn_time_left = (TURN_MULTIPLE * self.time_limit -
+                              self.turn_time_used)
+            time_limit = max(min(time_limit, turn_time_left),
+                             MIN_FRACTION * self.time_limit)
+        budget = Budget(name, self.clock() + time_limit, manager=self,
+                        clock=self.clock, cancelled=cancelled)
+        budget.charged = charge
+        return budget
+
+    def finish(self, budget):
+        """Note that the decision with budget is done."""
+        elapsed = budget.elapsed
+        if budget.charged:
+            self.turn_time_used += elapsed
+        self.decisions += 1
+        self.nodes += budget.nodes
+        allowed = budget.finish_time - budget.start_time
+        if elapsed > (1.0 + OVERRUN_FRACTION) * allowed:
+            self.scale = max(self.scale * SHRINK_FACTOR, MIN_SCALE)
+            logging.info("%s overran its budget; scale %s", budget.name,
+                         self.scale)
+        elif not budget.expired:
+            self.scale = min(self.scale * GROW_FACTOR, 1.0)
+        logging.info("%s took %.3fs for %d nodes; %d decisions, limits hit "
+                     "%s", budget.name, elapsed, budget.nodes, self.decisions,
+                     dict(self.limits_hit))
@@ -6,19 +6,45 @@ __license__ = "GNU GPL v2"
 
 
 import random
-import copy
 import time
-from sys import maxint
-import itertools
 import collections
+import copy
+import heapq
 import logging
+import multiprocessing
+import threading
 
+from twisted.internet import defer, reactor, threads
 from twisted.python import log
+from twisted.python.threadpool import ThreadPool
 from zope.interface import implementer
 
 from slugathon.ai.Bot import Bot
-from slugathon.ai import BotParams
+from slugathon.ai import BotParams, hitodds
+from slugathon.ai.BattleRollout import BattleRollout
+from slugathon.ai.BattleState import BattleState, ATTACKER, DEFENDER
+from slugathon.ai.Budget import BudgetManager
+from slugathon.ai.EngagementOdds import ALL_SIDES, TITAN_POWER
+from slugathon.ai.LegionMovePool import LegionMovePool, MAX_PROCESSES
+from slugathon.ai.ThreatMap import ThreatMap
+from slugathon.ai.TranspositionTable import TranspositionTable
 from slugathon.game import Game, Creature, Phase, Legion
+try:
+    from slugathon.ai.VectorScorer import VectorScorer
+except ImportError:
+    # numpy is optional; without it, score legion moves one at a time.
+    VectorScorer = None
+
+
+# Number of legion moves to score at once with a VectorScorer.
+LEGION_MOVE_BATCH_SIZE = 256
+
+# Battles to play out when deciding whether to flee
+FLEE_ROLLOUTS = 400
+
+# Fraction of a battle move decision's time for finding the best legion
+# move; the rest is for finding the order to make it in.
+LEGION_MOVE_TIME_FRACTION = 0.9
 
 
 def best7(score_moves):
@@ -43,15 +69,57 @@ def best7(score_moves):
     return best_moves
 
 
+def copy_game(game):
+    """Return a copy of game for a search in another thread to work on.
+
+    The board and battle map hold no per-game state, so they are shared, as
+    is the history, which searches only read.  Observers are not copied.
+    """
+    memo = {id(game.board): game.board, id(game.history): game.history}
+    if game.battlemap is not None:
+        memo[id(game.battlemap)] = game.battlemap
+    observeds = [game, game.attacker_legion, game.defender_legion]
+    for player in game.players:
+        observeds.append(player)
+        observeds.extend(player.legions)
+    for observed in observeds:
+        if observed is not None:
+            memo[id(observed.observers)] = {}
+    return copy.deepcopy(game, memo)
+
+
 @implementer(Bot)
 class CleverBot(object):
 
-    def __init__(self, playername, ai_time_limit, bot_params=None):
+    def __init__(self, playername, ai_time_limit, bot_params=None,
+                 ponder=True, odds=None):
         logging.info("CleverBot %s %s", playername, ai_time_limit)
         self.playername = playername
         self.user = None
         self.ai_time_limit = ai_time_limit
+        # Whether to search for likely future decisions during other
+        # players' turns
+        self.ponder = ponder
+        # EngagementOdds table, or None
+        self.odds = odds
+        self.budgets = BudgetManager(ai_time_limit)
         self.best_creature_moves = None
+        # Searches run one at a time in this thread pool's only thread, so
+        # they don't block the reactor.
+        self.threadpool = None
+        # (game name, Deferred, cancelled Event) for the search in progress
+        self.planning = None
+        # Number of worker processes for big legion move searches, started
+        # on first use; 1 means search in this process
+        self.processes = min(multiprocessing.cpu_count(), MAX_PROCESSES)
+        self.legion_move_pool = None
+        # (signature, Deferred, cancelled Event) for the speculative search
+        # in progress or finished, where signature starts with the game name
+        self.pondering = None
+        # game name : ThreatMap
+        self.threat_maps = {}
+        # position hash : legion move score
+        self.transpositions = TranspositionTable()
         if bot_params is None:
             self.bp = BotParams.default_bot_params
         else:
@@ -62,6 +130,112 @@ class CleverBot(object):
         """Return a string with information for result-tracking purposes."""
         return str(self.bp)
 
+    def _run_in_worker(self, find, game):
+        """Run find(game, cancelled) in the worker thread, where cancelled
+        is a new Event for this search alone.
+
+        Return (Deferred, cancelled Event).  The Deferred fires in the
+        reactor thread with find's result.  Setting the Event makes the
+        search's Budgets run out.
+        """
+        # Fork the worker processes before starting any threads.
+        self._get_legion_move_pool()
+        if self.threadpool is None:
+            self.threadpool = ThreadPool(1, 1, "CleverBot")
+            self.threadpool.start()
+            reactor.addSystemEventTrigger("during", "shutdown",
+                                          self.threadpool.stop)
+        cancelled = threading.Event()
+        def1 = threads.deferToThreadPool(reactor, self.threadpool, find,
+                                         game, cancelled)
+        return def1, cancelled
+
+    def _get_legion_move_pool(self):
+        """Return the LegionMovePool, starting it if needed, or None if
+        there's only one CPU."""
+        if self.legion_move_pool is None and self.processes > 1:
+            self.legion_move_pool = LegionMovePool(self.processes)
+            reactor.addSystemEventTrigger("during", "shutdown",
+                                          self.legion_move_pool.close)
+        return self.legion_move_pool
+
+    def _plan(self, game, find):
+        """Run find on a copy of game in a worker thread.
+
+        Return a Deferred that fires in the reactor thread with find's
+        result, or fails with CancelledError if cancel_planning is called
+        first.
+        """
+        self.cancel_planning()
+        def1, cancelled = self._run_in_worker(find, copy_game(game))
+        self._track_planning(game.name, def1, cancelled)
+        return def1
+
+    def _track_planning(self, game_name, def1, cancelled):
+        self.planning = (game_name, def1, cancelled)
+        def1.addBoth(self._done_planning, def1)
+
+    def _done_planning(self, result, def1):
+        if self.planning is not None and self.planning[1] is def1:
+            self.planning = None
+        return result
+
+    def cancel_planning(self, game_name=None):
+        """Abandon the search in progress, and any pondering, if it's for
+        game_name (or any game, if game_name is None)."""
+        self.cancel_pondering(game_name)
+        if self.planning is None:
+            return
+        (planning_game_name, def1, cancelled) = self.planning
+        if game_name is not None and planning_game_name != game_name:
+            return
+        logging.info("cancelling search for %s", planning_game_name)
+        self.planning = None
+        cancelled.set()
+        def1.cancel()
+
+    def _ponder(self, game, find, signature):
+        """Start running find on game, a copy of a predicted future game,
+        in a worker thread, to be used later if the real game's signature
+        turns out to match."""
+        self.cancel_pondering()
+        logging.info("pondering %s", signature)
+        def1, cancelled = self._run_in_worker(find, game)
+        self.pondering = (signature, def1, cancelled)
+
+    def _take_pondered(self, game_name, signature):
+        """Return a Deferred for the pondered result for signature, or None
+        if we haven't pondered it."""
+        if self.pondering is None:
+            return None
+        if self.pondering[0] != signature:
+            logging.info("pondered the wrong position")
+            self.cancel_pondering()
+            return None
+        logging.info("using pondered %s", signature)
+        (signature, def1, cancelled) = self.pondering
+        self.pondering = None
+        self._track_planning(game_name, def1, cancelled)
+        return def1
+
+    def cancel_pondering(self, game_name=None):
+        """Abandon pondering, if it's for game_name (or any game, if
+        game_name is None)."""
+        if self.pondering is None:
+            return
+        (signature, def1, cancelled) = self.pondering
+        if game_name is not None and signature[0] != game_name:
+            return
+        logging.info("cancelling pondering %s", signature)
+        self.pondering = None
+        cancelled.set()
+        def1.cancel()
+        def1.addErrback(self._planning_failure)
+
+    def _planning_failure(self, error):
+        if not error.check(defer.CancelledError):
+            self.failure(error)
+
     def maybe_pick_color(self, game):
         logging.info("maybe_pick_color")
         if game.next_playername_to_pick_color == self.playername:
@@ -162,22 +336,24 @@ class CleverBot(object):
                 logging.info("defender hasn't chosen whether to flee yet")
                 if defender.can_flee:
                     logging.info("can flee")
-                    if (defender.terrain_combat_value * self.bp.FLEE_RATIO <
-                       attacker.terrain_combat_value):
-                        logging.info("fleeing")
-                        def1 = self.user.callRemote("flee", game.name,
-                                                    defender.markerid)
-                        def1.addErrback(self.failure)
-                    else:
-                        logging.info("not fleeing")
-                        def1 = self.user.callRemote("do_not_flee", game.name,
-                                                    defender.markerid)
-                        def1.addErrback(self.failure)
+                    attacker_markerid = attacker.markerid
+                    defender_markerid = defender.markerid
+
+                    def find(game2, cancelled):
+                        return self._should_flee(
+                            game2, game2.find_legion(attacker_markerid),
+                            game2.find_legion(defender_markerid), cancelled)
+
+                    def1 = self._plan(game, find)
+                    def1.addCallback(self._flee_or_not, game, attacker,
+                                     defender)
+                    def1.addErrback(self._planning_failure)
                 else:
                     logging.info("can't flee")
                     def1 = self.user.callRemote("do_not_flee", game.name,
                                                 defender.markerid)
                     def1.addErrback(self.failure)
+                    self._ponder_first_maneuver(game, attacker, defender)
         elif attacker.player.name == self.playername:
             if not game.defender_chose_not_to_flee:
                 # Wait for the defender to choose whether to flee.
@@ -191,49 +367,110 @@ class CleverBot(object):
         else:
             logging.info("not my engagement")
 
+    def _should_flee(self, game, attacker, defender, cancelled=None):
+        """Return True iff our legion defender should flee from attacker.
+
+        Play out the battle FLEE_ROLLOUTS times, and flee if the attacker
+        can expect to keep more than FLEE_RATIO times the points we can.
+        Use the odds table instead if it has this engagement.  If the
+        attacker's creatures or entry side aren't known, compare the
+        legions' terrain combat values instead.  Setting cancelled, an Event
+        or None, cuts the playouts short.
+        """
+        odds = self._lookup_odds(attacker, defender, defender.hexlabel,
+                                 attacker.entry_side)
+        if odds is not None:
+            logging.info("%s vs %s %s", attacker, defender, odds)
+            return (odds.defender_points * self.bp.FLEE_RATIO <
+                    odds.attacker_points)
+        if ("Unknown" in attacker.creature_names or
+                attacker.entry_side is None):
+            return (defender.terrain_combat_value * self.bp.FLEE_RATIO <
+                    attacker.terrain_combat_value)
+        budget = self.budgets.decision("flee", (game.name, game.turn,
+                                                "flee", defender.markerid),
+                                       cancelled)
+        try:
+            state = BattleState.for_engagement(game, attacker, defender)
+            results = BattleRollout(state).rollouts(FLEE_ROLLOUTS, budget)
+        finally:
+            self.budgets.finish(budget)
+        logging.info("%s vs %s %s", attacker, defender, results)
+        return (results.mean_survivor_points(DEFENDER) * self.bp.FLEE_RATIO <
+                results.mean_survivor_points(ATTACKER))
+
+    def _lookup_odds(self, attacker, defender, hexlabel, entry_side):
+        """Return the precomputed Odds of attacker attacking defender in
+        hexlabel from entry_side, which may be ALL_SIDES, or None if they're
+        not known.
+
+        A titan teleport's entry side isn't chosen yet, so use the odds
+        averaged over all sides.  The table only has titans with their
+        starting power.
+        """
+        if self.odds is None or entry_side is None:
+            return None
+        if entry_side == Game.TELEPORT:
+            entry_side = ALL_SIDES
+        attacker_names = attacker.creature_names
+        defender_names = defender.creature_names
+        if "Unknown" in attacker_names or "Unknown" in defender_names:
+            return None
+        for legion in (attacker, defender):
+            if ("Titan" in legion.creature_names and
+                    legion.player.titan_power != TITAN_POWER):
+                return None
+        mterrain = attacker.player.game.board.hexes[hexlabel].terrain
+        return self.odds.lookup(mterrain, entry_side, attacker_names,
+                                defender_names)
+
+    def _flee_or_not(self, flee, game, attacker, defender):
+        if flee:
+            logging.info("fleeing")
+            def1 = self.user.callRemote("flee", game.name, defender.markerid)
+            def1.addErrback(self.failure)
+        else:
+            logging.info("not fleeing")
+            def1 = self.user.callRemote("do_not_flee", game.name,
+                                        defender.markerid)
+            def1.addErrback(self.failure)
+            self._ponder_first_maneuver(game, attacker, defender)
+
+    def _threat_map(self, game):
+        """Return the ThreatMap for game, creating it if needed."""
+        threat_map = self.threat_maps.get(game.name)
+        if threat_map is None or threat_map.game is not game:
+            if threat_map is not None:
+                threat_map.close()
+            threat_map = self.threat_maps[game.name] = ThreatMap(game)
+        return threat_map
+
     def _scary_enemy_legions_behind(self, legion):
         """Return True if there are any scary enemy legions that can
         catch this legion next turn."""
         player = legion.player
-        game = player.game
+        threat_map = self._threat_map(player.game)
         legion_combat_value = legion.combat_value
         hexlabel = legion.hexlabel
         for enemy in player.enemy_legions():
             # TODO take terrain into account
             if (enemy.combat_value >= self.bp.BE_SQUASHED *
                legion_combat_value):
-                for roll in xrange(1, 6 + 1):
-                    hex1 = game.board.hexes[enemy.hexlabel]
-                    moves = game.find_normal_moves(enemy,
-                                                   hex1,
-                                                   roll).union(
-                        game.find_titan_teleport_moves(enemy))
-                    hexlabels = set((move[0] for move in moves))
-                    if hexlabel in hexlabels:
-                        return True
+                if threat_map.rolls(enemy, hexlabel, legion):
+                    return True
         return False
 
     def _scary_enemy_legions_ahead(self, legion):
         """Return True if there are any scary enemy legions that this
         legion can catch next turn."""
         player = legion.player
-        game = player.game
+        threat_map = self._threat_map(player.game)
         legion_combat_value = legion.combat_value
-        hexlabel = legion.hexlabel
-        all_hexlabels = set()
-        for roll in xrange(1, 6 + 1):
-            hex1 = game.board.hexes[hexlabel]
-            moves = game.find_normal_moves(legion,
-                                           hex1,
-                                           roll).union(
-                game.find_titan_teleport_moves(legion))
-            hexlabels = set((move[0] for move in moves))
-            all_hexlabels.update(hexlabels)
         for enemy in player.enemy_legions():
             # TODO take terrain into account
             if (enemy.combat_value >= self.bp.BE_SQUASHED *
                legion_combat_value):
-                if enemy.hexlabel in all_hexlabels:
+                if threat_map.rolls(legion, enemy.hexlabel, enemy):
                     return True
         return False
 
@@ -533,8 +770,15 @@ class CleverBot(object):
                         if enemies:
                             enemy = enemies.pop()
                             new_legion1.hexlabel = hexlabel
-                            if (enemy.terrain_combat_value < self.bp.SQUASH *
-                               new_legion1.terrain_combat_value):
+                            odds = self._lookup_odds(new_legion1, enemy,
+                                                     hexlabel, entry_side)
+                            if odds is None:
+                                enemy_value = enemy.terrain_combat_value
+                                our_value = new_legion1.terrain_combat_value
+                            else:
+                                enemy_value = odds.defender_points
+                                our_value = odds.attacker_points
+                            if enemy_value < self.bp.SQUASH * our_value:
                                 safe_split_rolls.add(roll)
                         else:
                             safe_split_rolls.add(roll)
@@ -636,18 +880,26 @@ class CleverBot(object):
         enemies = player.enemy_legions(hexlabel)
         legion_combat_value = legion.combat_value
         legion_sort_value = legion.sort_value
+        # The values to compare with the enemy's, if there is one
+        our_combat_value = legion_combat_value
 
         if enemies:
             assert len(enemies) == 1
             enemy = enemies.pop()
-            enemy_combat_value = enemy.terrain_combat_value
+            odds = self._lookup_odds(legion, enemy, hexlabel, ALL_SIDES)
+            if odds is None:
+                enemy_combat_value = enemy.terrain_combat_value
+            else:
+                # Compare the points each side can expect to keep.
+                enemy_combat_value = odds.defender_points
+                our_combat_value = odds.attacker_points
             logging.debug("legion %s hexlabel %s", legion, hexlabel)
-            logging.debug("legion_combat_value %s", legion_combat_value)
+            logging.debug("our_combat_value %s", our_combat_value)
             logging.debug("enemy_combat_value %s", enemy_combat_value)
-            if enemy_combat_value < self.bp.SQUASH * legion_combat_value:
+            if enemy_combat_value < self.bp.SQUASH * our_combat_value:
                 score += enemy.score
             elif (enemy_combat_value >= self.bp.BE_SQUASHED *
-                  legion_combat_value):
+                  our_combat_value):
                 score -= legion_sort_value
         if moved and (len(legion) < 7 or enemies):
             masterhex = board.hexes[hexlabel]
@@ -657,10 +909,10 @@ class CleverBot(object):
                 recruit_name = recruits[-1]
                 recruit = Creature.Creature(recruit_name)
                 # Only give credit for recruiting if we're likely to live.
-                if not enemies or enemy_combat_value < legion_combat_value:
+                if not enemies or enemy_combat_value < our_combat_value:
                     recruit_value = recruit.sort_value
                 elif (enemy_combat_value < self.bp.BE_SQUASHED *
-                      legion_combat_value):
+                      our_combat_value):
                     recruit_value = 0.5 * recruit.sort_value
                 logging.debug("recruit value %s %s %s", legion.markerid,
                               hexlabel, recruit_value)
@@ -669,44 +921,34 @@ class CleverBot(object):
             # Do not fear enemy legions on turn 1.  8-high legions will be
             # forced to split, and hanging around in the tower to avoid getting
             # attacked 5-on-4 is too passive.
-            try:
-                previous_hexlabel = legion.hexlabel
-                legion.hexlabel = hexlabel
-                for enemy in player.enemy_legions():
-                    if (enemy.terrain_combat_value >= self.bp.BE_SQUASHED *
-                       legion_combat_value):
-                        for roll in xrange(1, 6 + 1):
-                            moves = game.find_normal_moves(enemy,
-                                                           game.board.hexes[
-                                                               enemy.hexlabel],
-                                                           roll).union(
-                                game.find_titan_teleport_moves(enemy))
-                            hexlabels = set((move[0] for move in moves))
-                            if hexlabel in hexlabels:
-                                score -= legion_sort_value / 6.0
-            finally:
-                legion.hexlabel = previous_hexlabel
+            threat_map = self._threat_map(game)
+            for enemy in player.enemy_legions():
+                if (enemy.terrain_combat_value >= self.bp.BE_SQUASHED *
+                   legion_combat_value):
+                    rolls = threat_map.rolls(enemy, hexlabel, legion)
+                    score -= len(rolls) * legion_sort_value / 6.0
         return score
 
-    def _gen_legion_moves_inner(self, movesets):
-        """Yield tuples of distinct hexlabels, one from each moveset, in order,
-        with no duplicates.
+    def _gen_legion_moves_inner(self, movesets, index=0, used=None):
+        """Yield tuples of distinct hexlabels, one from each moveset starting
+        at index, in order, with no duplicates.
 
         movesets is a list of sets of hexlabels, corresponding to the order of
-        remaining creatures in the legion.
+        remaining creatures in the legion.  used is a set of the hexlabels
+        already taken by earlier creatures.
         """
-        if not movesets:
+        if used is None:
+            used = set()
+        if index >= len(movesets):
             yield ()
-        elif len(movesets) == 1:
-            for move in movesets[0]:
-                yield (move,)
-        else:
-            for move in movesets[0]:
-                movesets1 = copy.deepcopy(movesets[1:])
-                for moveset in movesets1:
-                    moveset.discard(move)
-                for moves in self._gen_legion_moves_inner(movesets1):
+            return
+        for move in movesets[index]:
+            if move not in used:
+                used.add(move)
+                for moves in self._gen_legion_moves_inner(movesets, index + 1,
+                                                          used):
                     yield (move,) + moves
+                used.remove(move)
 
     def _gen_legion_moves(self, movesets):
         """Yield all possible legion_moves for movesets.
@@ -723,84 +965,311 @@ class CleverBot(object):
         """
         logging.info("_gen_legion_moves %s", movesets)
         for moves in self._gen_legion_moves_inner(movesets):
-            if len(moves) == len(movesets):
-                yield list(moves)
+            yield list(moves)
 
-    def _gen_fallback_legion_moves(self, movesets):
-        """Yield all possible legion_moves for movesets, possibly including
-        some missing moves in the case where not all creatures can get onboard.
+    def _find_best_legion_move(self, game, creatures, score_movesets,
+                               budget, scorer=None):
+        """Return the best legion_move found for creatures within budget,
+        or None if there are no legion_moves.
 
-        movesets is a list of sets of hexlabels to which each Creature can move
-        (or stay), in the same order as Legion.sorted_creatures.  Like:
-        creatures [titan1, ogre1, troll1]
-        movesets [{"A1", "A2", "B1"}, {"B1", "B2"}, {"B1", "B3"}]
+        See _find_best_legion_moves.
+        """
+        best = self._find_best_legion_moves(game, creatures, score_movesets,
+                                            budget, scorer)
+        if not best:
+            return None
+        return best[0][1]
 
-        A legion_move is a list of hexlabels, in the same order as creatures,
-        where each Creature's hexlabel is one from its original list, and no
-        two Creatures have the same hexlabel.  Like:
-        ["A1", "B1", "B3"]
+    def _find_best_legion_moves(self, game, creatures, score_movesets,
+                                budget, scorer=None, num=1):
+        """Return a list of up to num (score, legion_move) tuples, the best
+        legion_moves found for creatures within budget, best first.
+
+        score_movesets is a list of lists of (score, hexlabel) tuples, one
+        list for each creature, in the same order as creatures, with each
+        creature's possible moves scored for that creature alone.
+
+        If scorer is not None, it's a VectorScorer for these moves, and
+        legion moves are scored in batches with it.
+
+        Big searches are split across a pool of worker processes, if there's
+        more than one CPU.
         """
-        logging.info(movesets)
-        for moves in self._gen_legion_moves_inner(movesets):
-            yield list(moves)
+        pool = self._get_legion_move_pool()
+        results = None
+        if pool is not None and pool.worthwhile(score_movesets):
+            try:
+                results = pool.search(self, game, creatures, score_movesets,
+                                      budget, scorer, num)
+            except multiprocessing.TimeoutError:
+                logging.info("legion move workers timed out")
+            else:
+                # Zobrist keys are the same in every process, so the
+                # workers' position hashes are good here too.
+                for score, legion_move, position in results:
+                    self.transpositions.put(position, score)
+        if results is None:
+            results = self._search_legion_moves(game, creatures,
+                                                score_movesets, budget,
+                                                scorer, num)
+        return [(score, legion_move) for score, legion_move, unused in
+                results]
+
+    def _search_legion_moves(self, game, creatures, score_movesets, budget,
+                             scorer=None, num=1):
+        """Return a list of up to num (score, legion_move, position hash)
+        tuples, the best legion_moves found for creatures within budget,
+        best first.
+
+        Scores are kept in a transposition table, keyed by the Zobrist
+        hash of the position, so a position reached by swapping identical
+        creatures, or seen in an earlier search, is only scored once.
+
+        This is a depth-first search over legion moves with no two creatures
+        in the same hex, trying each creature's best moves first, so the
+        likely best legion moves are scored before the budget runs out.
+        Nothing is pruned: the creatures interact, through the legion
+        score's terms for allies and shared enemies, so there's no cheap
+        sound bound on the legion score from the single scores.
+        """
+        score_movesets = [sorted(score_moves, reverse=True)
+                          for score_moves in score_movesets]
+        battle_state = BattleState.from_game(game)
+        slots = BattleState.game_slots(game, creatures)
+        base_hash = battle_state.hash_for_slots(slots)
+        # hash_deltas[ii][hexlabel] is the change to the position hash from
+        # moving creature ii to hexlabel
+        hash_deltas = []
+        for ii, score_moves in enumerate(score_movesets):
+            hash_deltas.append(dict(
+                (move, battle_state.move_hash(slots[ii], move) ^
+                 battle_state.hash) for unused, move in score_moves))
+        moves = []
+        used = set()
+        # (legion_move, position hash) tuples waiting to be scored
+        leaves = []
+        if scorer is None:
+            batch_size = 1
+        else:
+            batch_size = LEGION_MOVE_BATCH_SIZE
+        # heap of the best (score, leaf number, legion_move, position hash)
+        # tuples
+        best = []
+        # position hashes in best, so each position is only kept once
+        best_positions = set()
+        # leaves scored, timed out
+        state = [0, False]
+
+        def score_leaves():
+            # position hash : score
+            known = {}
+            new_moves = []
+            new_positions = []
+            for legion_move, position in leaves:
+                if position not in known:
+                    score = self.transpositions.get(position)
+                    known[position] = score
+                    if score is None:
+                        new_moves.append(legion_move)
+                        new_positions.append(position)
+            if scorer is None:
+                scores = []
+                depth = game.battle_try_depth
+                try:
+                    for legion_move in new_moves:
+                        for ii, creature in enumerate(creatures):
+                            game.try_battle_move(creature, legion_move[ii],
+                                                 False)
+                        scores.append(self._score_legion_move(game,
+                                                              creatures))
+                        game.undo_battle_tries(depth)
+                finally:
+                    game.undo_battle_tries(depth)
+            elif new_moves:
+                scores = scorer.score(new_moves)
+            else:
+                scores = []
+            for ii, position in enumerate(new_positions):
+                known[position] = scores[ii]
+                self.transpositions.put(position, scores[ii])
+            for ii, (legion_move, position) in enumerate(leaves):
+                score = known[position]
+                entry = (score, -(state[0] + ii), legion_move, position)
+                if position in best_positions:
+                    pass
+                elif len(best) < num:
+                    heapq.heappush(best, entry)
+                    best_positions.add(position)
+                elif score > best[0][0]:
+                    best_positions.remove(heapq.heapreplace(best, entry)[3])
+                    best_positions.add(position)
+            state[0] += len(leaves)
+            budget.add_nodes(len(leaves))
+            del leaves[:]
+            if budget.time_up():
+                state[1] = True
+
+        def search(ii, position):
+            if ii == len(creatures):
+                leaves.append((list(moves), position))
+                if len(leaves) >= batch_size:
+                    score_leaves()
+                return
+            for unused, move in score_movesets[ii]:
+                if state[1]:
+                    return
+                if move not in used:
+                    used.add(move)
+                    moves.append(move)
+                    search(ii + 1, position ^ hash_deltas[ii][move])
+                    moves.pop()
+                    used.remove(move)
+
+        search(0, base_hash)
+        if leaves:
+            score_leaves()
+        logging.info("scored %d legion_moves", state[0])
+        return [(entry[0], entry[2], entry[3]) for entry in
+                sorted(best, reverse=True)]
 
     def _score_perm(self, game, sort_values, perm):
         """Score one move order permutation."""
         score = 0
-        moved_creatures = set()
+        depth = game.battle_try_depth
         try:
             for creature_name, start, move in perm:
                 creature = game.creatures_in_battle_hex(start,
                                                         creature_name).pop()
                 if (move == start or move in
                    game.find_battle_moves(creature)):
-                    creature.previous_hexlabel = creature.hexlabel
-                    creature.hexlabel = move
-                    moved_creatures.add(creature)
+                    game.try_battle_move(creature, move, False)
                     score += sort_values[creature_name]
             return score
         finally:
-            for creature in moved_creatures:
-                creature.hexlabel = creature.previous_hexlabel
-                creature.previous_hexlabel = None
+            game.undo_battle_tries(depth)
 
-    def _find_move_order(self, game, creature_moves):
+    def _find_move_order(self, game, creature_moves, budget=None):
         """Return a new list with creature_moves rearranged so that as
         many of the moves as possible can be legally made.
 
         creature_moves is a list of (creature_name, start_hexlabel,
         finish_hexlabel) tuples.
+
+        First build a graph of which creatures must move before which others,
+        because one's start hex blocks the other's path or target or one's
+        finish hex blocks the other's path, and take a topological order of
+        it.  If that order doesn't work (cycles, or blocking that takes more
+        than one creature), search the sets of creatures that can be moved,
+        in topological order first, for the order that moves the most,
+        until budget runs out.
         """
-        max_score = 0
-        sort_values = {}
+        creatures = []
         for creature_name, start, move in creature_moves:
-            creature = game.creatures_in_battle_hex(start, creature_name).pop()
-            sort_values[creature_name] = creature.sort_value
-            max_score += creature.sort_value
-        perms = list(itertools.permutations(creature_moves))
-        logging.info("%d perms" % len(perms))
-        # Scramble the list so we don't get a bunch of similar bad
-        # orders jumbled together at the beginning.
-        random.shuffle(perms)
-        best_score = -maxint
-        best_perm = None
-        finish_time = time.time() + self.ai_time_limit
-        for perm in perms:
-            score = self._score_perm(game, sort_values, perm)
-            if score == max_score:
-                best_perm = perm
-                logging.info("found perfect order")
-                break
-            elif score > best_score:
-                best_perm = perm
-                best_score = score
-            if time.time() > finish_time:
-                logging.info("time limit")
-                break
-        logging.info("returning %s" % list(best_perm))
-        return list(best_perm)
+            for creature in game.creatures_in_battle_hex(start,
+                                                         creature_name):
+                if not any(creature is creature2 for creature2 in creatures):
+                    creatures.append(creature)
+                    break
+        starts = [tup[1] for tup in creature_moves]
+        finishes = [tup[2] for tup in creature_moves]
+        num = len(creature_moves)
+        # Try out moves on a copy of the battle, not the real creatures.
+        state = BattleState.from_game(game)
+        slots = BattleState.game_slots(game, creatures)
+
+        def can_move(ii):
+            return (finishes[ii] == starts[ii] or finishes[ii] in
+                    state.find_moves(slots[ii]))
+
+        # successors[ii] is the set of creatures that must move after ii
+        successors = [set() for ii in xrange(num)]
+        for ii in xrange(num):
+            if finishes[ii] == starts[ii]:
+                continue
+            if not can_move(ii):
+                for jj in xrange(num):
+                    if jj != ii:
+                        state.place(slots[jj], finishes[jj])
+                        if can_move(ii):
+                            successors[jj].add(ii)
+                        state.place(slots[jj], starts[jj])
+            for jj in xrange(num):
+                if jj != ii:
+                    state.place(slots[jj], finishes[jj])
+            if not can_move(ii):
+                for jj in xrange(num):
+                    if jj != ii:
+                        state.place(slots[jj], starts[jj])
+                        if can_move(ii):
+                            successors[ii].add(jj)
+                        state.place(slots[jj], finishes[jj])
+            for jj in xrange(num):
+                state.place(slots[jj], starts[jj])
+
+        # Kahn's algorithm, taking the most valuable ready creature first.
+        in_degree = [0] * num
+        for ii in xrange(num):
+            for jj in successors[ii]:
+                in_degree[jj] += 1
+        order = []
+        ready = [ii for ii in xrange(num) if in_degree[ii] == 0]
+        while ready:
+            ready.sort(key=lambda ii: (creatures[ii].sort_value, -ii))
+            ii = ready.pop()
+            order.append(ii)
+            for jj in successors[ii]:
+                in_degree[jj] -= 1
+                if in_degree[jj] == 0:
+                    ready.append(jj)
+        if len(order) < num:
+            logging.info("move order graph has a cycle")
+            order.extend(ii for ii in xrange(num) if ii not in order)
 
-    def _find_best_creature_moves(self, game):
+        sort_values = {}
+        for creature in creatures:
+            sort_values[creature.name] = creature.sort_value
+        perm = [creature_moves[index] for index in order]
+        # Sum in the same order as _score_perm, so a perfect order matches.
+        max_score = sum(sort_values[tup[0]] for tup in perm)
+        if self._score_perm(game, sort_values, perm) == max_score:
+            logging.info("returning %s" % perm)
+            return perm
+
+        # Search the sets of moved creatures for the best one.
+        logging.info("searching for move order")
+        best = [0, []]
+        seen = set()
+        moved = []
+
+        def search(mask, score):
+            if score > best[0]:
+                best[0] = score
+                best[1] = list(moved)
+            if len(best[1]) == num or mask in seen:
+                return
+            if budget is not None:
+                budget.add_nodes(1)
+                if budget.time_up():
+                    return
+            seen.add(mask)
+            for ii in order:
+                if not mask & (1 << ii) and can_move(ii):
+                    state.place(slots[ii], finishes[ii])
+                    moved.append(ii)
+                    search(mask | (1 << ii),
+                           score + creatures[ii].sort_value)
+                    moved.pop()
+                    state.place(slots[ii], starts[ii])
+                    if len(best[1]) == num:
+                        return
+
+        search(0, 0)
+        order = best[1] + [index for index in order if index not in best[1]]
+        perm = [creature_moves[index] for index in order]
+        logging.info("returning %s" % perm)
+        return perm
+
+    def _find_best_creature_moves(self, game, cancelled=None, charge=True):
         """Return a list of up to one (creature_name, start_hexlabel,
         finish_hexlabel) tuple for each Creature in the battle active legion.
 
@@ -813,23 +1282,44 @@ class CleverBot(object):
         the best legion move.  Finally, find the order of creature moves
         that lets all the creatures reach their assigned hexes without
         blocking their allies' moves.
+
+        Setting cancelled, an Event or None, cuts the search short.  If not
+        charge, the search is pondering, and has its own time rather than
+        the battle turn's.
         """
         if (game.battle_active_player is None or game.battle_active_player.name
            != self.playername):
             return None
+        budget = self.budgets.decision("move_creatures",
+                                       self._battle_turn_key(game), cancelled,
+                                       charge)
+        try:
+            return self._find_best_creature_moves_inner(game, budget)
+        finally:
+            self.budgets.finish(budget)
+
+    def _battle_turn_key(self, game):
+        """Return a key for the active legion's current battle turn, so each
+        battle turn of each engagement gets its own time allowance."""
+        return (game.name, game.turn, game.attacker_legion.markerid,
+                game.defender_legion.markerid, game.battle_turn,
+                game.battle_active_legion.markerid)
+
+    def _find_best_creature_moves_inner(self, game, budget):
         legion = game.battle_active_legion
         creatures = legion.sorted_living_creatures
         logging.info("_find_best_creature_moves %s %s", legion, creatures)
         if not creatures:
             return None
-        movesets = []  # list of a set of hexlabels for each creature
+        # list of a list of (score, hexlabel) for each creature
+        score_movesets = []
         previous_creature = None
-        moveset = None
+        score_moveset = None
         for creature in creatures:
             if (previous_creature and creature.name == previous_creature.name
                and creature.hexlabel == previous_creature.hexlabel):
                 # Reuse previous moveset
-                moveset = copy.deepcopy(moveset)
+                pass
             else:
                 moves = game.find_battle_moves(creature,
                                                ignore_mobile_allies=True)
@@ -839,53 +1329,44 @@ class CleverBot(object):
                     if creature.hexlabel not in ["ATTACKER", "DEFENDER"]:
                         moves.add(creature.hexlabel)
                     for move in moves:
+                        game.try_battle_move(creature, move, False)
                         try:
-                            creature.previous_hexlabel = creature.hexlabel
-                            creature.hexlabel = move
                             score = self._score_legion_move(game, [creature])
                             score_moves.append((score, move))
                         finally:
-                            creature.hexlabel = creature.previous_hexlabel
+                            game.undo_battle_try()
                     score_moves.sort()
                     logging.info("score_moves %s %s", creature, score_moves)
                     moveset = best7(score_moves)
+                    score_moveset = [tup for tup in score_moves
+                                     if tup[1] in moveset]
                 else:
-                    moveset = set([creature.hexlabel])
-            movesets.append(moveset)
+                    score_moveset = [(0, creature.hexlabel)]
+            score_movesets.append(score_moveset)
             previous_creature = creature
-        best_legion_move = None
-        now = time.time()
-        legion_moves = list(self._gen_legion_moves(movesets))
-        logging.info("found %d legion_moves in %fs" % (len(legion_moves),
-                                                       time.time() - now))
-        if not legion_moves:
-            legion_moves = list(self._gen_fallback_legion_moves(movesets))
-            if not legion_moves:
-                return None
-        best_score = -maxint
         start_time = time.time()
-        finish_time = start_time + self.ai_time_limit
-        # Scramble the moves, in case we don't have time to look at them all.
-        random.shuffle(legion_moves)
-        logging.info("len(creatures) %d len(legion_moves[0]) %d" % (
-                     len(creatures), len(legion_moves[0])))
-        for legion_move in legion_moves:
-            try:
-                for ii, creature in enumerate(creatures):
-                    move = legion_move[ii]
-                    creature.previous_hexlabel = creature.hexlabel
-                    creature.hexlabel = move
-                score = self._score_legion_move(game, creatures)
-                if score > best_score:
-                    best_legion_move = legion_move
-                    best_score = score
-                now = time.time()
-                if now > finish_time:
-                    logging.info("time limit")
-                    break
-            finally:
-                for creature in creatures:
-                    creature.hexlabel = creature.previous_hexlabel
+        scorer = None
+        if VectorScorer is not None and len(creatures) > 1:
+            movesets = [[tup[1] for tup in moves_and_scores]
+                        for moves_and_scores in score_movesets]
+            hex_scores = []
+            for ii, creature in enumerate(creatures):
+                hex_score = {}
+                for move in movesets[ii]:
+                    game.try_battle_move(creature, move, False)
+                    try:
+                        hex_score[move] = self._score_hex(game, creature)
+                    finally:
+                        game.undo_battle_try()
+                hex_scores.append(hex_score)
+            scorer = VectorScorer(game, creatures, movesets, self.bp,
+                                  hex_scores)
+        best_legion_move = self._find_best_legion_move(
+            game, creatures, score_movesets,
+            budget.slice("legion moves", LEGION_MOVE_TIME_FRACTION), scorer)
+        if best_legion_move is None:
+            return None
+        now = time.time()
         logging.info("found best_legion_move %s in %fs" % (best_legion_move,
                                                            now - start_time))
         start_hexlabels = [creature.hexlabel for creature in creatures]
@@ -893,7 +1374,8 @@ class CleverBot(object):
         creature_moves = zip(creature_names, start_hexlabels, best_legion_move)
         logging.info("creature_moves %s", creature_moves)
         now = time.time()
-        ordered_creature_moves = self._find_move_order(game, creature_moves)
+        ordered_creature_moves = self._find_move_order(
+            game, creature_moves, budget.slice("move order"))
         logging.info("found ordered_creature_moves %s in %fs" % (
                      ordered_creature_moves, time.time() - now))
         return ordered_creature_moves
@@ -913,7 +1395,54 @@ class CleverBot(object):
         """
         logging.info("CleverBot.move_creatures")
         if self.best_creature_moves is None:
-            self.best_creature_moves = self._find_best_creature_moves(game)
+            self._plan_creature_moves(game)
+        else:
+            self._make_creature_move(game)
+
+    def _maneuver_signature(self, game):
+        """Return a key for game's battle position, to match pondered
+        creature moves against."""
+        state = BattleState.from_game(game)
+        return (game.name, game.attacker_legion.markerid,
+                game.defender_legion.markerid, game.battlemap.mterrain,
+                game.battle_entry_side, state.hash)
+
+    def _ponder_first_maneuver(self, game, attacker, defender):
+        """Start finding our first creature moves as defender, while the
+        attacker decides whether to fight.
+
+        The attacker's creatures are our best guess until the battle starts,
+        so the result is only used if the guess was right.  The search
+        isn't charged to the battle turn's time, so a wrong guess doesn't
+        shorten the real search.
+        """
+        if not self.ponder or "Unknown" in attacker.creature_names:
+            return
+        game2 = copy_game(game)
+        game2._init_battle(game2.find_legion(attacker.markerid),
+                           game2.find_legion(defender.markerid))
+
+        def find(game3, cancelled):
+            return self._find_best_creature_moves(game3, cancelled, False)
+
+        self._ponder(game2, find, self._maneuver_signature(game2))
+
+    def _plan_creature_moves(self, game):
+        def1 = None
+        if self.pondering is not None:
+            def1 = self._take_pondered(game.name,
+                                       self._maneuver_signature(game))
+        if def1 is None:
+            def1 = self._plan(game, self._find_best_creature_moves)
+        def1.addCallback(self._got_best_creature_moves, game)
+        def1.addErrback(self._planning_failure)
+
+    def _got_best_creature_moves(self, best_creature_moves, game):
+        self.best_creature_moves = best_creature_moves or []
+        self._make_creature_move(game)
+
+    def _make_creature_move(self, game):
+        """Make the next move in self.best_creature_moves."""
         # Loop in case a non-move is best.
         while self.best_creature_moves:
             (creature_name, start, finish) = \
@@ -925,8 +1454,9 @@ class CleverBot(object):
                 creature = creatures.pop()
             else:
                 logging.info("best_creature_moves was broken")
-                self.best_creature_moves = self._find_best_creature_moves(game)
-                continue
+                self.best_creature_moves = None
+                self._plan_creature_moves(game)
+                return
             if finish != start and finish in game.find_battle_moves(
                     creature):
                 logging.info("calling move_creature %s %s %s", creature.name,
@@ -942,6 +1472,111 @@ class CleverBot(object):
         def1 = self.user.callRemote("done_with_maneuvers", game.name)
         def1.addErrback(self.failure)
 
+    def _score_hex(self, game, creature):
+        """Return the part of the score for creature that depends only on
+        the hex it's in, not on where other creatures are."""
+        score = 0
+        battlemap = game.battlemap
+        legion = creature.legion
+        battlehex = battlemap.hexes[creature.hexlabel]
+        terrain = battlehex.terrain
+
+        # Make titans hang back early.
+        if (creature.is_titan and game.battle_turn < 4 and
+           terrain != "Tower"):
+            if legion == game.attacker_legion:
+                entrance = "ATTACKER"
+            else:
+                entrance = "DEFENDER"
+            distance = battlemap.range(creature.hexlabel, entrance,
+                                       allow_entrance=True) - 2
+            penalty = distance * self.bp.TITAN_FORWARD_PENALTY
+            if penalty:
+                score += penalty
+                logging.info(creature, "TITAN_FORWARD_PENALTY %s", penalty)
+
+        # Make defenders hang back early.
+        if (legion == game.defender_legion and game.battle_turn < 4 and
+           terrain != "Tower"):
+            entrance = "DEFENDER"
+            distance = battlemap.range(creature.hexlabel, entrance,
+                                       allow_entrance=True) - 2
+            penalty = distance * self.bp.DEFENDER_FORWARD_PENALTY
+            if penalty:
+                score += penalty
+                logging.info(creature, "DEFENDER_FORWARD_PENALTY %s",
+                             penalty)
+
+        # terrain
+        if battlehex.elevation:
+            bonus = battlehex.elevation * self.bp.ELEVATION_BONUS
+            score += bonus
+            logging.info(creature, "ELEVATION_BONUS %s", bonus)
+        if terrain == "Bramble":
+            if creature.is_native(terrain):
+                score += self.bp.NATIVE_BRAMBLE_BONUS
+                logging.info(creature, "NATIVE_BRAMBLE_BONUS %s",
+                             self.bp.NATIVE_BRAMBLE_BONUS)
+            else:
+                score += self.bp.NON_NATIVE_BRAMBLE_PENALTY
+                logging.info(creature, "NON_NATIVE_BRAMBLE_PENALTY %s",
+                             self.bp.NON_NATIVE_BRAMBLE_PENALTY)
+        elif terrain == "Tower":
+            # XXX Hardcoded to default Tower map
+            logging.info("%s TOWER_BONUS", creature)
+            score += self.bp.TOWER_BONUS
+            if battlehex.elevation == 2:
+                if creature.is_titan:
+                    score += self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS
+                    logging.info("%s TITAN_IN_CENTER_OF_TOWER_BONUS %s",
+                                 creature,
+                                 self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS)
+                else:
+                    score += self.bp.CENTER_OF_TOWER_BONUS
+                    logging.info("%s CENTER_OF_TOWER_BONUS %s",
+                                 creature, self.bp.CENTER_OF_TOWER_BONUS)
+            elif (legion == game.defender_legion and
+                  creature.name != "Titan" and battlehex.label in
+                  ["C3", "D3"]):
+                score += self.bp.FRONT_OF_TOWER_BONUS
+                logging.info("%s FRONT_OF_TOWER_BONUS %s",
+                             creature, self.bp.FRONT_OF_TOWER_BONUS)
+            elif (legion == game.defender_legion and
+                  creature.name != "Titan" and battlehex.label in
+                  ["C4", "E3"]):
+                score += self.bp.MIDDLE_OF_TOWER_BONUS
+                logging.info("%s MIDDLE_OF_TOWER_BONUS %s",
+                             creature, self.bp.MIDDLE_OF_TOWER_BONUS)
+        elif terrain == "Drift":
+            if not creature.is_native(terrain):
+                score += self.bp.NON_NATIVE_DRIFT_PENALTY
+                logging.info("%s NON_NATIVE_DRIFT_PENALTY %s",
+                             creature, self.bp.NON_NATIVE_DRIFT_PENALTY)
+        elif terrain == "Volcano":
+            score += self.bp.NATIVE_VOLCANO_BONUS
+            logging.info("%s NATIVE_VOLCANO_BONUS %s",
+                         creature, self.bp.NATIVE_VOLCANO_BONUS)
+
+        if "Slope" in battlehex.borders:
+            if creature.is_native("Slope"):
+                score += self.bp.NATIVE_SLOPE_BONUS
+                logging.info("%s NATIVE_SLOPE_BONUS %s",
+                             creature, self.bp.NATIVE_SLOPE_BONUS)
+            else:
+                score += self.bp.NON_NATIVE_SLOPE_PENALTY
+                logging.info("%s NON_NATIVE_SLOPE_PENALTY %s",
+                             creature, self.bp.NON_NATIVE_SLOPE_PENALTY)
+        if "Dune" in battlehex.borders:
+            if creature.is_native("Dune"):
+                score += self.bp.NATIVE_DUNE_BONUS
+                logging.info("%s NATIVE_DUNE_BONUS %s",
+                             creature, self.bp.NATIVE_DUNE_BONUS)
+            else:
+                score += self.bp.NON_NATIVE_DUNE_PENALTY
+                logging.info("%s NON_NATIVE_DUNE_PENALTY %s",
+                             creature, self.bp.NON_NATIVE_DUNE_PENALTY)
+        return score
+
     def _score_legion_move(self, game, creatures):
         """Return a score for creatures in their current hexlabels."""
         score = 0
@@ -949,23 +1584,21 @@ class CleverBot(object):
         legion = creatures[0].legion
         legion2 = game.other_battle_legion(legion)
 
-        # For each enemy, figure out the average damage we could do to it if
-        # everyone concentrated on hitting it, and if that's enough to kill it,
-        # give every creature a kill bonus.
+        # For each enemy, figure out the odds that we could kill it if
+        # everyone concentrated on hitting it, and give every creature a kill
+        # bonus for that.
         # (This is not quite right because each creature can only hit one enemy
         # (ignoring carries), but it's a start.)
         kill_bonus = 0
         for enemy in legion2.creatures:
-            total_mean_hits = 0
+            strikes = []
             for creature in creatures:
                 if (enemy in creature.engaged_enemies or
                    (not creature.engaged and enemy in
                         creature.rangestrike_targets)):
-                    dice = creature.number_of_dice(enemy)
-                    strike_number = creature.strike_number(enemy)
-                    mean_hits = dice * (7. - strike_number) / 6
-                    total_mean_hits += mean_hits
-            if total_mean_hits >= enemy.hits_left:
+                    strikes.append(creature.strike_values(enemy))
+            if hitodds.likely(hitodds.combined_kill_probability(
+                    strikes, enemy.hits_left)):
                 kill_bonus += enemy.sort_value
 
         for creature in creatures:
@@ -973,30 +1606,32 @@ class CleverBot(object):
             engaged = creature.engaged_enemies
             max_mean_hits = 0.0
             total_mean_damage_taken = 0.0
+            # (dice, strike_number) of each strike we can take
+            damage_strikes = []
             engaged_with_rangestriker = False
             # melee
             for enemy in engaged:
                 # Damage we can do.
-                dice = creature.number_of_dice(enemy)
-                strike_number = creature.strike_number(enemy)
-                mean_hits = dice * (7. - strike_number) / 6
+                dice, strike_number = creature.strike_values(enemy)
+                mean_hits = hitodds.mean_hits(dice, strike_number)
                 max_mean_hits = max(mean_hits, max_mean_hits)
                 # Damage we can take.
-                dice = enemy.number_of_dice(creature)
-                strike_number = enemy.strike_number(creature)
-                mean_hits = dice * (7. - strike_number) / 6
-                total_mean_damage_taken += mean_hits
+                dice, strike_number = enemy.strike_values(creature)
+                total_mean_damage_taken += hitodds.mean_hits(dice,
+                                                             strike_number)
+                damage_strikes.append((dice, strike_number))
                 if enemy.rangestrikes:
                     engaged_with_rangestriker = True
             # inbound rangestriking
             for enemy in legion2.creatures:
                 if enemy not in engaged:
                     if creature in enemy.potential_rangestrike_targets:
-                        dice = enemy.number_of_dice(creature)
-                        strike_number = enemy.strike_number(creature)
-                        mean_hits = dice * (7. - strike_number) / 6
-                        total_mean_damage_taken += mean_hits
-            probable_death = total_mean_damage_taken >= creature.hits_left
+                        dice, strike_number = enemy.strike_values(creature)
+                        total_mean_damage_taken += hitodds.mean_hits(
+                            dice, strike_number)
+                        damage_strikes.append((dice, strike_number))
+            probable_death = hitodds.likely(hitodds.combined_kill_probability(
+                damage_strikes, creature.hits_left))
 
             if engaged_with_rangestriker and not creature.rangestrikes:
                 score += self.bp.ENGAGE_RANGESTRIKER_BONUS
@@ -1008,9 +1643,8 @@ class CleverBot(object):
                 targets = creature.rangestrike_targets
                 for enemy in targets:
                     # Damage we can do
-                    dice = creature.number_of_dice(enemy)
-                    strike_number = creature.strike_number(enemy)
-                    mean_hits = dice * (7. - strike_number) / 6
+                    dice, strike_number = creature.strike_values(enemy)
+                    mean_hits = hitodds.mean_hits(dice, strike_number)
                     max_mean_hits = max(mean_hits, max_mean_hits)
                     can_rangestrike = True
             if can_rangestrike:
@@ -1061,105 +1695,10 @@ class CleverBot(object):
                         logging.info(creature, "ATTACKER_DISTANCE_PENALTY %s",
                                      penalty)
 
-            battlehex = battlemap.hexes[creature.hexlabel]
-            terrain = battlehex.terrain
-
-            # Make titans hang back early.
-            if (creature.is_titan and game.battle_turn < 4 and
-               terrain != "Tower"):
-                if legion == game.attacker_legion:
-                    entrance = "ATTACKER"
-                else:
-                    entrance = "DEFENDER"
-                distance = battlemap.range(creature.hexlabel, entrance,
-                                           allow_entrance=True) - 2
-                penalty = distance * self.bp.TITAN_FORWARD_PENALTY
-                if penalty:
-                    score += penalty
-                    logging.info(creature, "TITAN_FORWARD_PENALTY %s", penalty)
-
-            # Make defenders hang back early.
-            if (legion == game.defender_legion and game.battle_turn < 4 and
-               terrain != "Tower"):
-                entrance = "DEFENDER"
-                distance = battlemap.range(creature.hexlabel, entrance,
-                                           allow_entrance=True) - 2
-                penalty = distance * self.bp.DEFENDER_FORWARD_PENALTY
-                if penalty:
-                    score += penalty
-                    logging.info(creature, "DEFENDER_FORWARD_PENALTY %s",
-                                 penalty)
-
-            # terrain
-            if battlehex.elevation:
-                bonus = battlehex.elevation * self.bp.ELEVATION_BONUS
-                score += bonus
-                logging.info(creature, "ELEVATION_BONUS %s", bonus)
-            if terrain == "Bramble":
-                if creature.is_native(terrain):
-                    score += self.bp.NATIVE_BRAMBLE_BONUS
-                    logging.info(creature, "NATIVE_BRAMBLE_BONUS %s",
-                                 self.bp.NATIVE_BRAMBLE_BONUS)
-                else:
-                    score += self.bp.NON_NATIVE_BRAMBLE_PENALTY
-                    logging.info(creature, "NON_NATIVE_BRAMBLE_PENALTY %s",
-                                 self.bp.NON_NATIVE_BRAMBLE_PENALTY)
-            elif terrain == "Tower":
-                # XXX Hardcoded to default Tower map
-                logging.info("%s TOWER_BONUS", creature)
-                score += self.bp.TOWER_BONUS
-                if battlehex.elevation == 2:
-                    if creature.is_titan:
-                        score += self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS
-                        logging.info("%s TITAN_IN_CENTER_OF_TOWER_BONUS %s",
-                                     creature,
-                                     self.bp.TITAN_IN_CENTER_OF_TOWER_BONUS)
-                    else:
-                        score += self.bp.CENTER_OF_TOWER_BONUS
-                        logging.info("%s CENTER_OF_TOWER_BONUS %s",
-                                     creature, self.bp.CENTER_OF_TOWER_BONUS)
-                elif (legion == game.defender_legion and
-                      creature.name != "Titan" and battlehex.label in
-                      ["C3", "D3"]):
-                    score += self.bp.FRONT_OF_TOWER_BONUS
-                    logging.info("%s FRONT_OF_TOWER_BONUS %s",
-                                 creature, self.bp.FRONT_OF_TOWER_BONUS)
-                elif (legion == game.defender_legion and
-                      creature.name != "Titan" and battlehex.label in
-                      ["C4", "E3"]):
-                    score += self.bp.MIDDLE_OF_TOWER_BONUS
-                    logging.info("%s MIDDLE_OF_TOWER_BONUS %s",
-                                 creature, self.bp.MIDDLE_OF_TOWER_BONUS)
-            elif terrain == "Drift":
-                if not creature.is_native(terrain):
-                    score += self.bp.NON_NATIVE_DRIFT_PENALTY
-                    logging.info("%s NON_NATIVE_DRIFT_PENALTY %s",
-                                 creature, self.bp.NON_NATIVE_DRIFT_PENALTY)
-            elif terrain == "Volcano":
-                score += self.bp.NATIVE_VOLCANO_BONUS
-                logging.info("%s NATIVE_VOLCANO_BONUS %s",
-                             creature, self.bp.NATIVE_VOLCANO_BONUS)
-
-            if "Slope" in battlehex.borders:
-                if creature.is_native("Slope"):
-                    score += self.bp.NATIVE_SLOPE_BONUS
-                    logging.info("%s NATIVE_SLOPE_BONUS %s",
-                                 creature, self.bp.NATIVE_SLOPE_BONUS)
-                else:
-                    score += self.bp.NON_NATIVE_SLOPE_PENALTY
-                    logging.info("%s NON_NATIVE_SLOPE_PENALTY %s",
-                                 creature, self.bp.NON_NATIVE_SLOPE_PENALTY)
-            if "Dune" in battlehex.borders:
-                if creature.is_native("Dune"):
-                    score += self.bp.NATIVE_DUNE_BONUS
-                    logging.info("%s NATIVE_DUNE_BONUS %s",
-                                 creature, self.bp.NATIVE_DUNE_BONUS)
-                else:
-                    score += self.bp.NON_NATIVE_DUNE_PENALTY
-                    logging.info("%s NON_NATIVE_DUNE_PENALTY %s",
-                                 creature, self.bp.NON_NATIVE_DUNE_PENALTY)
+            score += self._score_hex(game, creature)
 
             # allies
+            battlehex = battlemap.hexes[creature.hexlabel]
             num_adjacent_allies = 0
             for neighbor in battlehex.neighbors.itervalues():
                 for ally in legion.living_creatures:
@@ -1190,8 +1729,7 @@ class CleverBot(object):
                 if len(hexlabels) == 1:
                     hexlabel = hexlabels.pop()
                     target = game.creatures_in_battle_hex(hexlabel).pop()
-                    num_dice = striker.number_of_dice(target)
-                    strike_number = striker.strike_number(target)
+                    num_dice, strike_number = striker.strike_values(target)
                     def1 = self.user.callRemote("strike", game.name,
                                                 striker.name, striker.hexlabel,
                                                 target.name,
@@ -1202,19 +1740,22 @@ class CleverBot(object):
 
         # Then do the ones that have to choose a target.
         target_to_total_mean_hits = collections.defaultdict(float)
+        target_to_strikes = collections.defaultdict(list)
         best_target = None
         for striker in legion.sorted_creatures:
             if striker.can_strike:
                 hexlabels = striker.find_target_hexlabels()
                 for hexlabel in hexlabels:
                     target = game.creatures_in_battle_hex(hexlabel).pop()
-                    num_dice = striker.number_of_dice(target)
-                    strike_number = striker.strike_number(target)
-                    mean_hits = num_dice * (7. - strike_number) / 6
+                    num_dice, strike_number = striker.strike_values(target)
+                    mean_hits = hitodds.mean_hits(num_dice, strike_number)
                     target_to_total_mean_hits[target] += mean_hits
-        # First find the best target we can kill.
-        for target, total_mean_hits in target_to_total_mean_hits.iteritems():
-            if total_mean_hits >= target.hits_left:
+                    target_to_strikes[target].append((num_dice,
+                                                      strike_number))
+        # First find the best target we can probably kill.
+        for target, strikes in target_to_strikes.iteritems():
+            if hitodds.likely(hitodds.combined_kill_probability(
+                    strikes, target.hits_left)):
                 if (best_target is None or target.sort_value >
                    best_target.sort_value):
                     best_target = target
@@ -1233,8 +1774,7 @@ class CleverBot(object):
                 for hexlabel in hexlabels:
                     target = game.creatures_in_battle_hex(hexlabel).pop()
                     if target is best_target:
-                        num_dice = striker.number_of_dice(target)
-                        strike_number = striker.strike_number(target)
+                        num_dice, strike_number = striker.strike_values(target)
                         def1 = self.user.callRemote("strike",
                                                     game.name,
                                                     striker.name,
@@ -1281,8 +1821,7 @@ class CleverBot(object):
             best_num_dice = None
             best_strike_number = None
             for carry_target in carry_targets:
-                num_dice2 = striker.number_of_dice(carry_target)
-                strike_number2 = striker.strike_number(carry_target)
+                num_dice2, strike_number2 = striker.strike_values(carry_target)
                 if (best_target is None or num_dice2 < best_num_dice
                    or strike_number2 > best_strike_number):
                     best_target = carry_target
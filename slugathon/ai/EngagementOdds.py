@@ -0,0 +1,302 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""A precomputed table of engagement odds, for the AI.
+
+The table is built offline by playing out battles between common legion
+compositions in every masterboard terrain and from every entry side, and
+written to a binary file of fixed-size records sorted by key.  AI
+processes map the file read-only and binary search it, so every AI on a
+host shares one copy of the table through the page cache.
+
+A record's key is a 64-bit hash of the terrain, the entry side, and the
+attacker's and defender's sorted creature names.  Entry side ALL_SIDES
+holds the odds averaged over the terrain's entry sides, for when the side
+isn't known yet.  Creatures are assumed to be undamaged, and titans to
+have their starting power, TITAN_POWER.
+
+Build a table with "python -m slugathon.ai.EngagementOdds".
+"""
+
+
+import argparse
+import hashlib
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import time
+from collections import namedtuple
+
+from slugathon.ai.BattleRollout import BattleRollout
+from slugathon.ai.BattleState import BattleState, ATTACKER, DEFENDER
+from slugathon.data.creaturedata import starting_creature_names
+from slugathon.game import Creature, Game, Legion
+from slugathon.util import prefs
+
+
+MAGIC = "SLUGODDS"
+VERSION = 1
+
+# magic, version, number of records
+HEADER = struct.Struct("<8sII")
+
+# key, attacker win fraction, defender win fraction, attacker mean surviving
+# points, defender mean surviving points
+RECORD = struct.Struct("<Qffff")
+
+# Entry side for odds averaged over all of a terrain's entry sides
+ALL_SIDES = 0
+
+# Titans are played out with the power they start the game with.
+TITAN_POWER = 6
+
+# Battles to play out per matchup and entry side
+DEFAULT_ROLLOUTS = 200
+
+DEFAULT_PATH = os.path.join(prefs.SLUGATHON_DIR, "engagement_odds")
+
+
+Odds = namedtuple("Odds", ["attacker_wins", "defender_wins",
+                           "attacker_points", "defender_points"])
+
+
+def engagement_key(mterrain, entry_side, attacker_names, defender_names):
+    """Return the 64-bit table key for attacker_names attacking
+    defender_names in mterrain from entry_side."""
+    text = "%s %d %s|%s" % (mterrain, entry_side,
+                            ",".join(sorted(attacker_names)),
+                            ",".join(sorted(defender_names)))
+    return struct.unpack("<Q", hashlib.md5(text).digest()[:8])[0]
+
+
+def entry_sides(mterrain):
+    """Return a list of the sides from which legions can enter mterrain."""
+    if mterrain == "Tower":
+        return [5]
+    return [1, 3, 5]
+
+
+class EngagementOdds(object):
+
+    """A read-only, memory-mapped table of engagement odds."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fil:
+            self.mmap = mmap.mmap(fil.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER.size:
+            raise ValueError("%s is too short for an odds table" % path)
+        magic, version, self.count = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d odds table" % (
+                path, VERSION))
+        if len(self.mmap) != HEADER.size + self.count * RECORD.size:
+            raise ValueError("%s is truncated" % path)
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, mterrain, entry_side, attacker_names, defender_names):
+        """Return the Odds for attacker_names attacking defender_names in
+        mterrain from entry_side, or None if they're not in the table."""
+        key = engagement_key(mterrain, entry_side, attacker_names,
+                             defender_names)
+        low = 0
+        high = self.count
+        while low < high:
+            mid = (low + high) // 2
+            record = RECORD.unpack_from(self.mmap,
+                                        HEADER.size + mid * RECORD.size)
+            if record[0] < key:
+                low = mid + 1
+            elif record[0] > key:
+                high = mid
+            else:
+                return Odds(*record[1:])
+        return None
+
+    def close(self):
+        self.mmap.close()
+
+
+def open_odds(path=None):
+    """Return the EngagementOdds at path, or DEFAULT_PATH if path is None,
+    or None if there's no usable table there."""
+    if path is None:
+        path = DEFAULT_PATH
+        if not os.path.exists(path):
+            return None
+    try:
+        return EngagementOdds(path)
+    except (IOError, ValueError):
+        logging.exception("cannot open odds table %s", path)
+        return None
+
+
+def write_odds(path, records):
+    """Write records, a dict of key : Odds, to an odds table at path.
+
+    The table is written to a temporary file and renamed into place, so
+    processes that have the old table open keep a consistent copy.
+    """
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as fil:
+        fil.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        for key in sorted(records):
+            fil.write(RECORD.pack(key, *records[key]))
+    os.rename(temp_path, path)
+
+
+def common_compositions():
+    """Return a sorted list of tuples of sorted creature names for common
+    legions: the 4-high legions from every initial split."""
+    result = set()
+    lords = ["Titan", "Angel"]
+    others = [name for name in starting_creature_names if name not in lords]
+    for lord in lords:
+        for names in itertools.combinations(others, 3):
+            result.add(tuple(sorted((lord,) + names)))
+    return sorted(result)
+
+
+def read_compositions(path):
+    """Return a list of tuples of sorted creature names from the file at
+    path, which has one legion per line, with its creature names separated
+    by commas.  Blank lines and lines starting with # are skipped."""
+    result = []
+    with open(path) as fil:
+        for line in fil:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                names = tuple(sorted(name.strip() for name in
+                                     line.split(",")))
+                for name in names:
+                    Creature.Creature(name)
+                result.append(names)
+    return result
+
+
+def _make_game():
+    """Return a game with two players but no legions, for building
+    BattleStates."""
+    now = time.time()
+    game = Game.Game("odds", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    return game
+
+
+def _terrain_hexlabel(game, mterrain):
+    """Return the label of a masterboard hex with terrain mterrain."""
+    return min(hexlabel for hexlabel, masterhex in game.board.hexes.iteritems()
+               if masterhex.terrain == mterrain)
+
+
+def _play_terrain(args):
+    """Play out every matchup of compositions in one terrain.
+
+    Return a dict of key : Odds.
+    """
+    mterrain, compositions, rollouts, seed = args
+    rand = random.Random(seed)
+    game = _make_game()
+    hexlabel = _terrain_hexlabel(game, mterrain)
+    sides = entry_sides(mterrain)
+    records = {}
+    for attacker_names in compositions:
+        for defender_names in compositions:
+            attacker = Legion.Legion(game.players[0], "Rd01",
+                                     Creature.n2c(attacker_names), hexlabel)
+            defender = Legion.Legion(game.players[1], "Bu01",
+                                     Creature.n2c(defender_names), hexlabel)
+            totals = []
+            for entry_side in sides:
+                state = BattleState.for_engagement(game, attacker, defender,
+                                                   entry_side)
+                results = BattleRollout(state, rand).rollouts(rollouts)
+                odds = Odds(results.win_fraction(ATTACKER),
+                            results.win_fraction(DEFENDER),
+                            results.mean_survivor_points(ATTACKER),
+                            results.mean_survivor_points(DEFENDER))
+                key = engagement_key(mterrain, entry_side, attacker_names,
+                                     defender_names)
+                records[key] = odds
+                totals.append(odds)
+            key = engagement_key(mterrain, ALL_SIDES, attacker_names,
+                                 defender_names)
+            records[key] = Odds(*[sum(column) / len(totals) for column in
+                                  zip(*totals)])
+    logging.info("played %d matchups in %s", len(compositions) ** 2,
+                 mterrain)
+    return records
+
+
+def build_odds(compositions, terrains, rollouts=DEFAULT_ROLLOUTS,
+               processes=1, seed=None):
+    """Play out every matchup of compositions in every terrain and from
+    every entry side, and return a dict of key : Odds."""
+    if seed is None:
+        seed = random.getrandbits(32)
+    tasks = [(mterrain, compositions, rollouts, seed + ii)
+             for ii, mterrain in enumerate(terrains)]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = pool.map(_play_terrain, tasks)
+        finally:
+            pool.terminate()
+    else:
+        chunks = map(_play_terrain, tasks)
+    records = {}
+    for chunk in chunks:
+        records.update(chunk)
+    return records
+
+
+def add_arguments(parser):
+    parser.add_argument("-o", "--output", action="store", type=str,
+                        default=DEFAULT_PATH)
+    parser.add_argument("-c", "--compositions", action="store", type=str,
+                        help="file of legions, one per line, with creature "
+                        "names separated by commas (default: initial "
+                        "splits)")
+    parser.add_argument("-t", "--terrain", action="append", type=str,
+                        dest="terrains",
+                        help="masterboard terrain (default: all)")
+    parser.add_argument("-r", "--rollouts", action="store", type=int,
+                        default=DEFAULT_ROLLOUTS,
+                        help="battles per matchup and entry side")
+    parser.add_argument("-j", "--processes", action="store", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--seed", action="store", type=int)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.compositions:
+        compositions = read_compositions(args.compositions)
+    else:
+        compositions = common_compositions()
+    terrains = args.terrains
+    if not terrains:
+        game = _make_game()
+        terrains = sorted(set(masterhex.terrain for masterhex in
+                              game.board.hexes.itervalues()))
+    records = build_odds(compositions, terrains, args.rollouts,
+                         args.processes, args.seed)
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    write_odds(args.output, records)
+    logging.info("wrote %d records to %s", len(records), args.output)
+
+
+if __name__ == "__main__":
+    main()
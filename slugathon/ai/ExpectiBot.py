@@ -0,0 +1,60 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""A CleverBot that looks ahead in battle."""
+
+
+import logging
+
+from zope.interface import implementer
+
+from slugathon.ai.Bot import Bot
+from slugathon.ai.CleverBot import CleverBot
+from slugathon.ai.BattleState import BattleState
+from slugathon.ai.BattleSearch import BattleSearch
+
+
+# How many of CleverBot's best legion moves to search
+NUM_CANDIDATES = 8
+
+# Fraction of the time limit for finding the candidates; the rest is for
+# searching them.
+CANDIDATE_TIME_FRACTION = 0.5
+
+# Most battle phases to search past each legion move
+MAX_DEPTH = 7
+
+
+@implementer(Bot)
+class ExpectiBot(CleverBot):
+
+    """An AI that picks its battle legion move by expectimax search.
+
+    CleverBot's static scores pick the candidate legion moves, then a
+    BattleSearch looks at our strikes, the enemy's reply maneuver, and the
+    enemy's strikes (and further if there's time), and picks the candidate
+    with the best expected outcome.
+    """
+
+    def _find_best_legion_move(self, game, creatures, score_movesets,
+                               budget, scorer=None):
+        candidates = self._find_best_legion_moves(
+            game, creatures, score_movesets,
+            budget.slice("candidate legion moves", CANDIDATE_TIME_FRACTION),
+            scorer, NUM_CANDIDATES)
+        if not candidates:
+            return None
+        legion_moves = [legion_move for score, legion_move in candidates]
+        if len(legion_moves) == 1:
+            return legion_moves[0]
+        state = BattleState.from_game(game)
+        slots = BattleState.game_slots(game, creatures)
+        values = [creature.sort_value for creature in
+                  BattleState.game_creatures(game)]
+        search = BattleSearch(state, state.active_side, values,
+                              budget.slice("battle search"))
+        index = search.choose(slots, legion_moves, MAX_DEPTH)
+        logging.info("searched %d nodes, picked candidate %d", search.nodes,
+                     index)
+        return legion_moves[index]
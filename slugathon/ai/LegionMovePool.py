@@ -0,0 +1,217 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Search for legion moves in several processes at once.
+
+The first creature's moves are dealt out round-robin to the worker
+processes, each of which runs the usual legion move search over its
+share and returns its best legion moves.  Workers get the game pickled
+without its board, battle map, and history, which they rebuild or share
+locally.
+
+Each search has a generation number, and bumping the pool's shared
+generation counter cancels it: workers stop the search as soon as they
+notice, and skip any of its tasks still queued.
+"""
+
+
+import cPickle
+import StringIO
+import logging
+import multiprocessing
+
+from slugathon.ai.BattleState import BattleState
+from slugathon.ai.Budget import Budget
+from slugathon.game import BattleMap, History, MasterBoard
+
+
+# Most worker processes per bot, since several bots may share a host
+MAX_PROCESSES = 4
+
+# Search legion moves in one process if there are fewer than this many
+# (counting moves to the same hex), as the pool's overhead would dominate.
+MIN_LEGION_MOVES = 5000
+
+# Seconds to wait for workers past their budget before giving up on them
+GRACE_TIME = 5.0
+
+# Seconds between checks for cancellation while waiting for workers
+POLL_INTERVAL = 0.05
+
+
+def dumps_game(game):
+    """Return game pickled, except its board, battle map, and history."""
+    def persistent_id(obj):
+        if obj is game.board:
+            return "board"
+        elif obj is game.battlemap:
+            return "battlemap %s %s" % (game.battlemap.mterrain,
+                                        game.battlemap.entry_side)
+        elif obj is game.history:
+            return "history"
+        return None
+
+    out = StringIO.StringIO()
+    pickler = cPickle.Pickler(out, cPickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(game)
+    return out.getvalue()
+
+
+# The board is the same for every game, so each worker only builds it once.
+_board = None
+
+
+def loads_game(data):
+    """Return a game pickled with dumps_game."""
+    def persistent_load(persid):
+        global _board
+        if persid == "board":
+            if _board is None:
+                _board = MasterBoard.MasterBoard()
+            return _board
+        elif persid == "history":
+            return History.History()
+        elif persid.startswith("battlemap "):
+            unused, mterrain, entry_side = persid.split()
+            return BattleMap.get_battlemap(mterrain, int(entry_side))
+        raise cPickle.UnpicklingError("unknown persistent id %s" % persid)
+
+    unpickler = cPickle.Unpickler(StringIO.StringIO(data))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+# (bot class, str(bot params)) : bot, so each worker keeps its bots'
+# transposition tables between searches
+_bots = {}
+
+# The pool's shared generation counter, in each worker
+_generation = None
+
+
+def _init_worker(generation):
+    global _generation
+    _generation = generation
+
+
+class _Superseded(object):
+
+    """Acts as a cancelled Event for a Budget, set once the shared
+    generation counter has moved past number."""
+
+    def __init__(self, generation, number):
+        self.generation = generation
+        self.number = number
+
+    def is_set(self):
+        return self.generation.value != self.number
+
+
+def _search(args):
+    """Search for legion moves in a worker process.
+
+    Return (nodes searched, list of (score, legion_move, position hash)).
+    """
+    (klass, bot_params, game_data, slots, score_movesets, scorer,
+     finish_time, num, number) = args
+    cancelled = _Superseded(_generation, number)
+    if cancelled.is_set():
+        return 0, []
+    key = (klass, str(bot_params))
+    bot = _bots.get(key)
+    if bot is None:
+        bot = _bots[key] = klass("worker", 0, bot_params, ponder=False)
+    game = loads_game(game_data)
+    game_creatures = BattleState.game_creatures(game)
+    creatures = [game_creatures[slot] for slot in slots]
+    budget = Budget("legion move worker", finish_time, cancelled=cancelled)
+    results = bot._search_legion_moves(game, creatures, score_movesets,
+                                       budget, scorer, num)
+    return budget.nodes, results
+
+
+def num_legion_moves(score_movesets):
+    """Return an upper bound on the number of legion moves."""
+    product = 1
+    for score_moves in score_movesets:
+        product *= len(score_moves)
+    return product
+
+
+class LegionMovePool(object):
+
+    """A pool of worker processes for legion move searches, kept for the
+    life of the bot so there's no startup cost per decision."""
+
+    def __init__(self, processes):
+        self.processes = processes
+        # Number of the current search
+        self.generation = multiprocessing.Value("l", 0)
+        self.pool = multiprocessing.Pool(processes, _init_worker,
+                                         (self.generation,))
+
+    def _next_generation(self):
+        """Cancel the current search, and return the next search's
+        number."""
+        with self.generation.get_lock():
+            self.generation.value += 1
+            return self.generation.value
+
+    def worthwhile(self, score_movesets):
+        """Return True iff a search over score_movesets is big enough to
+        split up."""
+        return (len(score_movesets) > 1 and len(score_movesets[0]) > 1 and
+                num_legion_moves(score_movesets) >= MIN_LEGION_MOVES)
+
+    def search(self, bot, game, creatures, score_movesets, budget, scorer,
+               num):
+        """Return a list of up to num (score, legion_move, position hash)
+        tuples, the best legion_moves found for creatures within budget,
+        best first, like CleverBot._search_legion_moves.
+
+        When budget runs out or is cancelled, the workers are told to
+        return their best so far.  Raise multiprocessing.TimeoutError if
+        they still don't finish.
+        """
+        number = self._next_generation()
+        game_data = dumps_game(game)
+        slots = BattleState.game_slots(game, creatures)
+        first_moves = sorted(score_movesets[0], reverse=True)
+        tasks = []
+        for ii in xrange(min(self.processes, len(first_moves))):
+            chunk_movesets = [first_moves[ii::self.processes]]
+            chunk_movesets.extend(score_movesets[1:])
+            tasks.append((type(bot), bot.bp, game_data, slots,
+                          chunk_movesets, scorer, budget.finish_time, num,
+                          number))
+        async_result = self.pool.map_async(_search, tasks)
+        while not async_result.ready():
+            if budget.time_up():
+                self._next_generation()
+                break
+            async_result.wait(POLL_INTERVAL)
+        chunk_results = async_result.get(GRACE_TIME)
+        # Merge by score, breaking ties by chunk and then by rank within the
+        # chunk, so the result doesn't depend on which worker was fastest.
+        entries = []
+        for chunk, (nodes, results) in enumerate(chunk_results):
+            budget.add_nodes(nodes)
+            for rank, (score, legion_move, position) in enumerate(results):
+                entries.append((-score, chunk, rank, legion_move, position))
+        entries.sort()
+        best = []
+        positions = set()
+        for (neg_score, chunk, rank, legion_move, position) in entries:
+            if position not in positions:
+                positions.add(position)
+                best.append((-neg_score, legion_move, position))
+                if len(best) == num:
+                    break
+        logging.info("merged %d legion moves from %d workers", len(entries),
+                     len(tasks))
+        return best
+
+    def close(self):
+        self.pool.terminate()
@@ -0,0 +1,168 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Which legions can reach which masterboard hexes, with which rolls.
+
+The AI asks, for many candidate moves, whether each enemy legion could
+attack a legion in some hex next turn.  Searching each enemy's moves for
+each roll every time is slow in big games, so a ThreatMap does one
+breadth-first search per legion, finding the fewest steps to each hex within
+6, and keeps it until a legion moves, appears, or disappears inside the
+area searched.
+"""
+
+
+import collections
+
+from zope.interface import implementer
+
+from slugathon.game.Game import ARCHES_AND_ARROWS, opposite
+from slugathon.util.Observer import IObserver
+
+
+MAX_ROLL = 6
+
+ALL_ROLLS = frozenset(xrange(1, MAX_ROLL + 1))
+
+# steps : rolls of at least steps
+_ROLLS_FROM = [frozenset(xrange(steps, MAX_ROLL + 1))
+               for steps in xrange(MAX_ROLL + 1)]
+
+
+@implementer(IObserver)
+class ThreatMap(object):
+
+    """Where each legion in one game could attack next turn.
+
+    It observes the game, and after each action drops the searches that
+    legion changes might affect.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        # markerid : (playername, hexlabel) of every legion
+        self.positions = {}
+        # hexlabel : set of playernames with legions there
+        self.owners = collections.defaultdict(set)
+        # (mover markerid, ignored markerid or None) :
+        #     (hexlabel : fewest steps, set of hexlabels searched)
+        self.searches = {}
+        self.sync()
+        game.add_observer(self)
+
+    def close(self):
+        self.game.remove_observer(self)
+
+    def sync(self):
+        """Catch up with legions that have moved, been split off, or been
+        removed, and drop the searches they affect."""
+        positions = {}
+        for legion in self.game.all_legions():
+            positions[legion.markerid] = (legion.player.name, legion.hexlabel)
+        if positions == self.positions:
+            return
+        changed_markerids = set()
+        changed_hexlabels = set()
+        for markerid in set(positions).union(self.positions):
+            old = self.positions.get(markerid)
+            new = positions.get(markerid)
+            if old != new:
+                changed_markerids.add(markerid)
+                for position in (old, new):
+                    if position is not None:
+                        changed_hexlabels.add(position[1])
+        for key, (steps, searched) in self.searches.items():
+            if (key[0] in changed_markerids or
+                    not searched.isdisjoint(changed_hexlabels)):
+                del self.searches[key]
+        self.positions = positions
+        self.owners.clear()
+        for playername, hexlabel in positions.itervalues():
+            self.owners[hexlabel].add(playername)
+
+    def update(self, observed, action, names):
+        if getattr(action, "game_name", None) == self.game.name:
+            self.sync()
+
+    def rolls(self, mover, hexlabel, target):
+        """Return a frozenset of the movement rolls with which legion mover
+        could attack legion target, another player's, if target were in
+        hexlabel instead of where it is.
+
+        Like find_normal_moves plus find_titan_teleport_moves for every
+        roll.
+        """
+        playername = mover.player.name
+        if playername in self.owners.get(hexlabel, ()):
+            return frozenset()
+        if (mover.player.can_titan_teleport and
+                "Titan" in mover.creature_names):
+            return ALL_ROLLS
+        steps = self._steps(mover.markerid, target.markerid, hexlabel)
+        if steps is None:
+            return frozenset()
+        return _ROLLS_FROM[steps]
+
+    def _steps(self, mover_markerid, target_markerid, hexlabel):
+        """Return the fewest steps in which mover could reach hexlabel,
+        ignoring target, or None if it can't within MAX_ROLL."""
+        steps, searched = self._search(mover_markerid, None)
+        # Target only matters if the search ran into it somewhere other
+        # than hexlabel.
+        target_hexlabel = self.positions[target_markerid][1]
+        if target_hexlabel != hexlabel and target_hexlabel in searched:
+            steps, searched = self._search(mover_markerid, target_markerid)
+        return steps.get(hexlabel)
+
+    def _search(self, mover_markerid, ignored_markerid):
+        """Return (hexlabel : fewest steps, set of hexlabels searched) for
+        the legion with mover_markerid, treating the legion with
+        ignored_markerid, if not None, as absent."""
+        key = (mover_markerid, ignored_markerid)
+        result = self.searches.get(key)
+        if result is not None:
+            return result
+        playername, start = self.positions[mover_markerid]
+        blocked = set()
+        for markerid, (playername2, hexlabel) in self.positions.iteritems():
+            if playername2 != playername and markerid != ignored_markerid:
+                blocked.add(hexlabel)
+        steps = {}
+        searched = set([start])
+        # An engaged legion can't move.
+        if start not in blocked:
+            board = self.game.board
+            masterhex = board.hexes[start]
+            block = masterhex.find_block()
+            if block is None:
+                block = ARCHES_AND_ARROWS
+            if block >= 0:
+                frontier = [(masterhex.neighbors[block], opposite(block))]
+            else:
+                frontier = [(masterhex.neighbors[direction],
+                             opposite(direction))
+                            for direction, gate in enumerate(masterhex.exits)
+                            if gate in ("ARCH", "ARROW", "ARROWS")]
+            seen = set()
+            for step in xrange(1, MAX_ROLL + 1):
+                next_frontier = []
+                for masterhex, came_from in frontier:
+                    if (masterhex.label, came_from) in seen:
+                        continue
+                    seen.add((masterhex.label, came_from))
+                    hexlabel = masterhex.label
+                    searched.add(hexlabel)
+                    steps.setdefault(hexlabel, step)
+                    # Legions stop when they reach an enemy.
+                    if hexlabel in blocked or step == MAX_ROLL:
+                        continue
+                    for direction, gate in enumerate(masterhex.exits):
+                        if (gate in ("ARROW", "ARROWS") and
+                                direction != came_from):
+                            next_frontier.append((
+                                masterhex.neighbors[direction],
+                                opposite(direction)))
+                frontier = next_frontier
+        result = self.searches[key] = (steps, searched)
+        return result
@@ -0,0 +1,79 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""A bounded table of evaluated positions, keyed by Zobrist hash."""
+
+
+DEFAULT_MAX_SIZE = 100000
+
+# Indexes into the [previous, next, key, value] lists that make up the
+# recently used list
+PREVIOUS, NEXT, KEY, VALUE = range(4)
+
+
+class TranspositionTable(object):
+
+    """Map position hashes to scores, discarding the least recently used
+    entries once there are more than max_size.
+
+    Entries are kept in a circular doubly linked list, most recently used
+    last, as well as a dict, since collections.OrderedDict needs Python
+    2.7.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        # key : link
+        self._table = {}
+        self._root = root = [None, None, None, None]
+        root[PREVIOUS] = root[NEXT] = root
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._table)
+
+    def __contains__(self, key):
+        return key in self._table
+
+    def _unlink(self, link):
+        link[PREVIOUS][NEXT] = link[NEXT]
+        link[NEXT][PREVIOUS] = link[PREVIOUS]
+
+    def _append(self, link):
+        root = self._root
+        last = root[PREVIOUS]
+        link[PREVIOUS] = last
+        link[NEXT] = root
+        last[NEXT] = root[PREVIOUS] = link
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default."""
+        link = self._table.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self._unlink(link)
+        self._append(link)
+        self.hits += 1
+        return link[VALUE]
+
+    def put(self, key, value):
+        """Store value for key."""
+        link = self._table.get(key)
+        if link is None:
+            link = self._table[key] = [None, None, key, value]
+        else:
+            self._unlink(link)
+            link[VALUE] = value
+        self._append(link)
+        if len(self._table) > self.max_size:
+            oldest = self._root[NEXT]
+            self._unlink(oldest)
+            del self._table[oldest[KEY]]
+
+    def clear(self):
+        self._table.clear()
+        root = self._root
+        root[PREVIOUS] = root[NEXT] = root
@@ -0,0 +1,323 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Score many legion moves at once, using numpy.
+
+This gives the same scores as CleverBot._score_legion_move, but finds
+everything that depends only on one creature's hex once, and then scores a
+whole batch of legion moves with array operations.
+"""
+
+
+import numpy
+
+from slugathon.ai import hitodds
+from slugathon.game import Creature, Phase
+
+
+class VectorScorer(object):
+
+    """Scores legion moves for creatures, each of which must move to one of
+    the hexlabels in its moveset."""
+
+    def __init__(self, game, creatures, movesets, bot_params, hex_scores):
+        """creatures is a list of the living Creatures in one battle legion.
+
+        movesets is a list of lists of hexlabels, one list for each creature.
+
+        hex_scores is a list of dicts of hexlabel to the part of the score
+        that depends only on the hex, one dict for each creature.
+        """
+        self.bp = bot_params
+        self.num_creatures = len(creatures)
+        battlemap = game.battlemap
+        legion = creatures[0].legion
+        legion2 = game.other_battle_legion(legion)
+        enemies = legion2.creatures
+        self.num_enemies = len(enemies)
+        hexlabels = sorted(battlemap.hexes)
+        self.num_hexes = len(hexlabels)
+        hex_index = dict((hexlabel, ii) for ii, hexlabel in
+                         enumerate(hexlabels))
+
+        def is_mover(creature):
+            return any(creature is creature2 for creature2 in creatures)
+
+        # Hexes occupied by creatures that we aren't moving.
+        occupied = set()
+        for hexlabel in hexlabels:
+            for creature in game.creatures_in_battle_hex(hexlabel):
+                if not is_mover(creature):
+                    occupied.add(hexlabel)
+
+        self.adjacent = numpy.zeros((self.num_hexes, self.num_hexes))
+        for hexlabel, battlehex in battlemap.hexes.iteritems():
+            for neighbor in battlehex.neighbors.itervalues():
+                self.adjacent[hex_index[hexlabel],
+                              hex_index[neighbor.label]] = 1
+        still_ally_hexes = [creature.hexlabel for creature in
+                            legion.living_creatures if not is_mover(creature)]
+
+        # Index 0 is no strike.
+        strike_values = [(0, 6)]
+        strike_value_index = {(0, 6): 0}
+
+        def strike_index(values):
+            index = strike_value_index.get(values)
+            if index is None:
+                index = strike_value_index[values] = len(strike_values)
+                strike_values.append(values)
+            return index
+
+        num = self.num_creatures
+        max_moves = max(len(moveset) for moveset in movesets)
+        shape = (num, max_moves, self.num_enemies)
+        self.hex_of = numpy.zeros((num, max_moves), dtype=int)
+        self.static = numpy.zeros((num, max_moves))
+        self.distance_penalty = numpy.zeros((num, max_moves))
+        self.engaged = numpy.zeros(shape, dtype=bool)
+        self.melee_out = numpy.zeros(shape, dtype=int)
+        self.melee_in = numpy.zeros(shape, dtype=int)
+        self.range_out = numpy.zeros(shape, dtype=int)
+        self.range_in = numpy.zeros(shape, dtype=int)
+        # can rangestrike if the line of sight is clear
+        self.range_out_ok = numpy.zeros(shape, dtype=bool)
+        self.range_in_ok = numpy.zeros(shape, dtype=bool)
+        # line of sight doesn't matter
+        self.range_out_sure = numpy.zeros(shape, dtype=bool)
+        self.range_in_sure = numpy.zeros(shape, dtype=bool)
+        # for each of up to two lines of sight, whether it's open apart
+        # from our moving creatures, and which hexes they could block it in
+        self.los_out_open = numpy.zeros(shape + (2,), dtype=bool)
+        self.los_in_open = numpy.zeros(shape + (2,), dtype=bool)
+        self.los_out_chits = numpy.zeros(shape + (2, self.num_hexes))
+        self.los_in_chits = numpy.zeros(shape + (2, self.num_hexes))
+
+        def set_los(is_open, chits, index, hexlabel1, hexlabel2):
+            for jj, (terrain_blocked, chit_hexlabels) in enumerate(
+                    battlemap.los_paths(hexlabel1, hexlabel2)):
+                if terrain_blocked or occupied.intersection(chit_hexlabels):
+                    continue
+                is_open[index + (jj,)] = True
+                for hexlabel in chit_hexlabels:
+                    chits[index + (jj, hex_index[hexlabel])] = 1
+
+        live_enemy_hexlabels = [enemy.hexlabel for enemy in
+                                legion2.living_creatures]
+        is_attacker = legion == game.attacker_legion
+        for ii, creature in enumerate(creatures):
+            for kk, hexlabel in enumerate(movesets[ii]):
+                game.try_battle_move(creature, hexlabel, False)
+                try:
+                    self.hex_of[ii, kk] = hex_index[hexlabel]
+                    self.static[ii, kk] = hex_scores[ii][hexlabel]
+                    for ally_hexlabel in still_ally_hexes:
+                        if ally_hexlabel in hex_index:
+                            self.static[ii, kk] += (
+                                self.bp.ADJACENT_ALLY_BONUS *
+                                self.adjacent[hex_index[hexlabel],
+                                              hex_index[ally_hexlabel]])
+                    if is_attacker and live_enemy_hexlabels:
+                        min_range = min((battlemap.range(hexlabel,
+                                                         enemy_hexlabel)
+                                         for enemy_hexlabel in
+                                         live_enemy_hexlabels))
+                        self.distance_penalty[ii, kk] = (
+                            min_range * self.bp.ATTACKER_DISTANCE_PENALTY)
+                    if creature.offboard:
+                        continue
+                    engaged_enemies = creature.engaged_enemies
+                    dead_adjacent_enemies = creature.dead_adjacent_enemies
+                    for ee, enemy in enumerate(enemies):
+                        index = (ii, kk, ee)
+                        if enemy.offboard or enemy.hexlabel is None:
+                            continue
+                        if enemy in engaged_enemies:
+                            self.engaged[index] = True
+                            self.melee_out[index] = strike_index(
+                                creature.strike_values(enemy,
+                                                       Creature.ENGAGED))
+                            self.melee_in[index] = strike_index(
+                                enemy.strike_values(creature,
+                                                    Creature.ENGAGED))
+                        if (creature.rangestrikes and
+                           not dead_adjacent_enemies and
+                           not enemy.dead and
+                           battlemap.range(hexlabel, enemy.hexlabel) <=
+                           creature.skill and (creature.magicmissile or
+                                               not enemy.is_lord)):
+                            self.range_out_ok[index] = True
+                            self.range_out[index] = strike_index(
+                                creature.strike_values(enemy,
+                                                       Creature.RANGESTRIKE))
+                            if creature.magicmissile:
+                                self.range_out_sure[index] = True
+                            else:
+                                set_los(self.los_out_open, self.los_out_chits,
+                                        index, hexlabel, enemy.hexlabel)
+                        if (enemy.rangestrikes and
+                           not enemy.dead_adjacent_enemies and
+                           battlemap.range(enemy.hexlabel, hexlabel) <=
+                           enemy.skill and (enemy.magicmissile or
+                                            not creature.is_lord)):
+                            self.range_in_ok[index] = True
+                            # A dead enemy can still be adjacent, and then
+                            # its strike values are for melee.
+                            if enemy in dead_adjacent_enemies:
+                                mode = Creature.ENGAGED
+                            else:
+                                mode = Creature.RANGESTRIKE
+                            self.range_in[index] = strike_index(
+                                enemy.strike_values(creature, mode))
+                            if enemy.magicmissile:
+                                self.range_in_sure[index] = True
+                            else:
+                                set_los(self.los_in_open, self.los_in_chits,
+                                        index, enemy.hexlabel, hexlabel)
+                finally:
+                    game.undo_battle_try()
+
+        self.hits_left = [creature.hits_left for creature in creatures]
+        self.enemy_hits_left = [enemy.hits_left for enemy in enemies]
+        max_hits = max(self.hits_left + self.enemy_hits_left + [1])
+        self.mean_hits = numpy.array([hitodds.mean_hits(dice, strike_number)
+                                      for (dice, strike_number) in
+                                      strike_values])
+        self.distributions = numpy.zeros((len(strike_values), max_hits))
+        for index, (dice, strike_number) in enumerate(strike_values):
+            distribution = hitodds.hit_distribution(dice, strike_number)
+            distribution = distribution[:max_hits]
+            self.distributions[index, :len(distribution)] = distribution
+
+        self.rangestrike_phase = game.battle_phase == Phase.STRIKE
+        self.creature_rangestrikes = numpy.array([creature.rangestrikes for
+                                                  creature in creatures])
+        self.enemy_rangestrikes = numpy.array([enemy.rangestrikes for enemy
+                                               in enemies], dtype=bool)
+        self.sort_values = numpy.array([creature.sort_value for creature in
+                                        creatures])
+        self.can_charge = numpy.array([
+            creature.name != "Titan" or game.battle_turn >= 4 or
+            len(legion) == 1 for creature in creatures])
+        self.is_attacker = is_attacker
+        # Dead enemies count toward the kill bonus, like in the scalar code.
+        self.dead_kill_bonus = sum(enemy.sort_value for enemy in enemies
+                                   if enemy.hits_left <= 0)
+        self.enemy_sort_values = [enemy.sort_value for enemy in enemies]
+        self.enemies_to_kill = [ee for ee, enemy in enumerate(enemies)
+                                if enemy.hits_left > 0 and not
+                                enemy.offboard and enemy.hexlabel is not None]
+        self.moves_to_index = [dict((hexlabel, kk) for kk, hexlabel in
+                                    enumerate(moveset))
+                               for moveset in movesets]
+
+    def _likely(self, distribution):
+        """Return a bool array of whether each row of distribution, of the
+        odds of too few hits to kill, is likely to kill."""
+        return 1.0 - distribution.sum(axis=1) >= 0.5 - hitodds.EPSILON
+
+    def _add_hits(self, distribution, indexes):
+        """Return the distribution of the total of distribution and the
+        strikes with strike value indexes, cut off at the kill."""
+        max_hits = distribution.shape[1]
+        hits = self.distributions[indexes, :max_hits]
+        result = numpy.zeros(distribution.shape)
+        for jj in xrange(max_hits):
+            result[:, jj:] += (distribution[:, jj, None] *
+                               hits[:, :max_hits - jj])
+        return result
+
+    def _los_clear(self, is_open, chits, occupied):
+        """Return a bool array of whether any line of sight is clear, given
+        which hexes our moving creatures occupy."""
+        blocked = numpy.einsum("bh,bnmph->bnmp", occupied, chits) > 0
+        return (is_open & ~blocked).any(axis=3)
+
+    def score(self, legion_moves):
+        """Return a numpy array of the scores of legion_moves, each of which
+        is a list of hexlabels in the same order as creatures."""
+        num = self.num_creatures
+        batch = len(legion_moves)
+        moves = numpy.array([[self.moves_to_index[ii][hexlabel] for
+                              ii, hexlabel in enumerate(legion_move)]
+                             for legion_move in legion_moves], dtype=int)
+        rows = numpy.arange(num)[None, :]
+
+        def gather(array):
+            return array[rows, moves]
+
+        hexes = gather(self.hex_of)
+        occupied = numpy.zeros((batch, self.num_hexes))
+        for ii in xrange(num):
+            occupied[numpy.arange(batch), hexes[:, ii]] = 1
+
+        engaged = gather(self.engaged)
+        engaged_any = engaged.any(axis=2)
+
+        # Strikes out
+        out = numpy.where(engaged, gather(self.melee_out), 0)
+        can_rangestrike = numpy.zeros((batch, num), dtype=bool)
+        if self.rangestrike_phase:
+            range_out = (gather(self.range_out_ok) &
+                         ~engaged_any[:, :, None] &
+                         (gather(self.range_out_sure) |
+                          self._los_clear(gather(self.los_out_open),
+                                          gather(self.los_out_chits),
+                                          occupied)))
+            out = numpy.where(range_out, gather(self.range_out), out)
+            can_rangestrike = range_out.any(axis=2)
+        max_mean_hits = self.mean_hits[out].max(axis=2)
+
+        # Strikes in
+        range_in = (gather(self.range_in_ok) & ~engaged &
+                    (gather(self.range_in_sure) |
+                     self._los_clear(gather(self.los_in_open),
+                                     gather(self.los_in_chits), occupied)))
+        strikes_in = numpy.where(engaged, gather(self.melee_in),
+                                 numpy.where(range_in, gather(self.range_in),
+                                             0))
+        mean_damage_taken = self.mean_hits[strikes_in].sum(axis=2)
+        probable_death = numpy.zeros((batch, num), dtype=bool)
+        for ii in xrange(num):
+            distribution = numpy.zeros((batch, self.hits_left[ii]))
+            distribution[:, 0] = 1.0
+            for ee in xrange(self.num_enemies):
+                distribution = self._add_hits(distribution,
+                                              strikes_in[:, ii, ee])
+            probable_death[:, ii] = self._likely(distribution)
+
+        kill_bonus = numpy.zeros(batch) + self.dead_kill_bonus
+        for ee in self.enemies_to_kill:
+            distribution = numpy.zeros((batch, self.enemy_hits_left[ee]))
+            distribution[:, 0] = 1.0
+            for ii in xrange(num):
+                distribution = self._add_hits(distribution, out[:, ii, ee])
+            kill_bonus += (self._likely(distribution) *
+                           self.enemy_sort_values[ee])
+
+        engaged_with_rangestriker = (engaged &
+                                     self.enemy_rangestrikes).any(axis=2)
+        scores = gather(self.static)
+        scores += (self.bp.ENGAGE_RANGESTRIKER_BONUS *
+                   (engaged_with_rangestriker & ~self.creature_rangestrikes))
+        scores += self.bp.RANGESTRIKE_BONUS * can_rangestrike
+        scores += self.can_charge * (
+            self.bp.HIT_BONUS * max_mean_hits +
+            self.bp.KILL_MULTIPLIER * kill_bonus[:, None])
+        scores += self.bp.DAMAGE_PENALTY * mean_damage_taken
+        scores += (self.bp.DEATH_MULTIPLIER * probable_death *
+                   self.sort_values)
+        if self.is_attacker:
+            scores += self.can_charge * numpy.where(
+                engaged_any | can_rangestrike,
+                self.bp.ATTACKER_AGGRESSION_BONUS,
+                gather(self.distance_penalty))
+        # Adjacent moving allies
+        for ii in xrange(num):
+            for jj in xrange(num):
+                if ii != jj:
+                    scores[:, ii] += (self.bp.ADJACENT_ALLY_BONUS *
+                                      self.adjacent[hexes[:, ii],
+                                                    hexes[:, jj]])
+        return scores.sum(axis=1)
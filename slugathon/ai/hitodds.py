@@ -0,0 +1,189 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Exact hit odds for battle strikes, for the AI.
+
+A strike rolls dice six-sided dice, and each die that rolls strike_number or
+higher is a hit, so the number of hits is binomially distributed.  These
+functions build each distribution once and then answer from cached tables.
+"""
+
+
+EPSILON = 0.000001
+
+# (dice, strike_number) -> tuple of the probabilities of 0..dice hits
+_distributions = {}
+
+# (dice, strike_number) -> tuple of the probabilities of at least 0..dice + 1
+# hits
+_tails = {}
+
+# (dice, strike_number) -> tuple of the mean damage done to a creature with
+# 0..dice hits left
+_damages = {}
+
+# (sorted tuple of (dice, strike_number) tuples, max_hits) -> tuple of the
+# probabilities of 0..max_hits total hits
+_combined = {}
+
+# Most combined distributions to cache
+MAX_COMBINED = 100000
+
+
+def hit_probability(strike_number):
+    """Return the probability of one die hitting with strike_number."""
+    strike_number = max(1, min(6, strike_number))
+    return (7 - strike_number) / 6.
+
+
+def hit_distribution(dice, strike_number):
+    """Return a tuple of the probabilities of 0..dice hits."""
+    key = (dice, strike_number)
+    distribution = _distributions.get(key)
+    if distribution is None:
+        prob = hit_probability(strike_number)
+        distribution = [1.0]
+        for unused in xrange(dice):
+            next_distribution = [0.0] * (len(distribution) + 1)
+            for hits, odds in enumerate(distribution):
+                next_distribution[hits] += odds * (1 - prob)
+                next_distribution[hits + 1] += odds * prob
+            distribution = next_distribution
+        distribution = tuple(distribution)
+        _distributions[key] = distribution
+    return distribution
+
+
+def _tail(dice, strike_number):
+    key = (dice, strike_number)
+    tail = _tails.get(key)
+    if tail is None:
+        distribution = hit_distribution(dice, strike_number)
+        tail = [0.0] * (dice + 2)
+        for hits in xrange(dice, -1, -1):
+            tail[hits] = tail[hits + 1] + distribution[hits]
+        tail = tuple(tail)
+        _tails[key] = tail
+    return tail
+
+
+def _damage(dice, strike_number):
+    key = (dice, strike_number)
+    damage = _damages.get(key)
+    if damage is None:
+        tail = _tail(dice, strike_number)
+        damage = [0.0] * (dice + 1)
+        for hits_left in xrange(1, dice + 1):
+            damage[hits_left] = damage[hits_left - 1] + tail[hits_left]
+        damage = tuple(damage)
+        _damages[key] = damage
+    return damage
+
+
+def mean_hits(dice, strike_number):
+    """Return the mean number of hits."""
+    return dice * hit_probability(strike_number)
+
+
+def kill_probability(dice, strike_number, hits_left):
+    """Return the probability of at least hits_left hits."""
+    if hits_left <= 0:
+        return 1.0
+    if hits_left > dice:
+        return 0.0
+    return _tail(dice, strike_number)[hits_left]
+
+
+def carry_probability(dice, strike_number, hits_left):
+    """Return the probability of more than hits_left hits, leaving some to
+    carry."""
+    return kill_probability(dice, strike_number, max(hits_left, 0) + 1)
+
+
+def mean_damage(dice, strike_number, hits_left):
+    """Return the mean number of hits actually taken by a creature with
+    hits_left hits left, without carries."""
+    if hits_left <= 0:
+        return 0.0
+    if hits_left > dice:
+        return mean_hits(dice, strike_number)
+    return _damage(dice, strike_number)[hits_left]
+
+
+def mean_carries(dice, strike_number, hits_left):
+    """Return the mean number of hits beyond hits_left."""
+    return (mean_hits(dice, strike_number) -
+            mean_damage(dice, strike_number, hits_left))
+
+
+def add_distributions(distribution1, distribution2, max_hits=None):
+    """Return the distribution of the total hits of two independent
+    distributions.
+
+    If max_hits is not None, fold all totals above max_hits into max_hits,
+    which is enough to find the odds of killing a creature with max_hits
+    hits left.
+    """
+    length = len(distribution1) + len(distribution2) - 1
+    if max_hits is not None:
+        length = min(length, max_hits + 1)
+    result = [0.0] * length
+    for hits1, odds1 in enumerate(distribution1):
+        if not odds1:
+            continue
+        for hits2, odds2 in enumerate(distribution2):
+            result[min(hits1 + hits2, length - 1)] += odds1 * odds2
+    return tuple(result)
+
+
+def combined_distribution(strikes, max_hits):
+    """Return the distribution of the total hits of strikes, a sequence of
+    (dice, strike_number) tuples, with all totals above max_hits folded into
+    max_hits.
+
+    The AI asks about the same groups of strikes over and over while
+    scoring moves, so the distributions are cached by the sorted strikes.
+    """
+    key = (tuple(sorted(strikes)), max_hits)
+    distribution = _combined.get(key)
+    if distribution is None:
+        distribution = (1.0,)
+        for dice, strike_number in key[0]:
+            distribution = add_distributions(
+                distribution, hit_distribution(dice, strike_number),
+                max_hits)
+        if len(_combined) >= MAX_COMBINED:
+            _combined.clear()
+        _combined[key] = distribution
+    return distribution
+
+
+def combined_kill_probability(strikes, hits_left):
+    """Return the probability that strikes, a sequence of (dice,
+    strike_number) tuples, do at least hits_left hits in total."""
+    if hits_left <= 0:
+        return 1.0
+    if len(strikes) == 1:
+        dice, strike_number = strikes[0]
+        return kill_probability(dice, strike_number, hits_left)
+    distribution = combined_distribution(strikes, hits_left)
+    if len(distribution) > hits_left:
+        return distribution[hits_left]
+    return 0.0
+
+
+def probability_at_least(distribution, hits):
+    """Return the probability of at least hits hits in distribution."""
+    if hits <= 0:
+        return 1.0
+    return sum(distribution[hits:])
+
+
+def likely(probability):
+    """Return True iff probability is at least one half.
+
+    Allow for rounding error, so that sums of the same odds taken in a
+    different order agree.
+    """
+    return probability >= 0.5 - EPSILON
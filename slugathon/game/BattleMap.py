@@ -134,11 +134,26 @@ def is_obstacle(border):
     return bool(border)
 
 
+class _OccupiedHex(object):
+
+    """Stand-in for a Game with only one occupied battle hex, used to find
+    which hexes block a line of sight when a creature is in them."""
+
+    def __init__(self, hexlabel):
+        self.hexlabel = hexlabel
+
+    def is_battle_hex_occupied(self, hexlabel):
+        return hexlabel == self.hexlabel
+
+
 class BattleMap(object):
 
     """A logical battle map.  No GUI code.
 
     See label_to_coords for hex labeling docs.
+
+    BattleMaps hold no per-battle state, so they are shared between battles.
+    Use get_battlemap rather than constructing them directly.
     """
 
     def __init__(self, mterrain, entry_side):
@@ -162,6 +177,38 @@ class BattleMap(object):
         for hex1 in self.hexes.itervalues():
             hex1.init_neighbors()
         self.startlist = battlemapdata.startlist.get(mterrain)
+        self._init_ranges()
+        # (hexlabel1, hexlabel2) : [(terrain_blocked, chit_hexlabels)]
+        self._los_paths = {}
+        # (hexlabel1, hexlabel2) : count
+        self._bramble_counts = {}
+        # (striker name, striker power, target name, hexlabel1, hexlabel2,
+        #  mode, los_blocked) : (number of dice, strike number)
+        # Filled in by Creature.strike_values
+        self.strike_table = {}
+
+    def _init_ranges(self):
+        """Fill in the table of ranges from every hex to every hex it can
+        reach, with a breadth-first search from each hex.
+
+        Entrances are adjacent to their neighbors but not vice-versa, so
+        ranges involving an entrance are only stored starting from it.
+        """
+        self._ranges = {}
+        for hexlabel, hex1 in self.hexes.iteritems():
+            ranges = {hexlabel: 1}
+            prev = [hex1]
+            result = 2
+            while prev:
+                neighbors = []
+                for hex2 in prev:
+                    for hex3 in hex2.neighbors.itervalues():
+                        if hex3.label not in ranges:
+                            ranges[hex3.label] = result
+                            neighbors.append(hex3)
+                result += 1
+                prev = neighbors
+            self._ranges[hexlabel] = ranges
 
     @property
     def hex_width(self):
@@ -198,27 +245,14 @@ class BattleMap(object):
             return maxint
         if hexlabel1 == hexlabel2:
             return 1
-        hex1 = self.hexes[hexlabel1]
-        hex2 = self.hexes[hexlabel2]
-        if (hex1.entrance or hex2.entrance):
-            if not allow_entrance or (hex1.entrance and hex2.entrance):
+        if (self.hexes[hexlabel1].entrance or self.hexes[hexlabel2].entrance):
+            if not allow_entrance or (self.hexes[hexlabel1].entrance and
+                                      self.hexes[hexlabel2].entrance):
                 return maxint
-            elif hex2.entrance:
+            elif self.hexes[hexlabel2].entrance:
                 # We need to start from the entrance.
-                hex1, hex2 = hex2, hex1
-        result = 2
-        prev = set([hex1])
-        ignore = set()
-        while True:
-            neighbors = set()
-            for hex3 in prev:
-                neighbors.update(hex3.neighbors.itervalues())
-            if hex2 in neighbors:
-                return result
-            neighbors -= ignore
-            result += 1
-            ignore = prev
-            prev = neighbors
+                hexlabel1, hexlabel2 = hexlabel2, hexlabel1
+        return self._ranges[hexlabel1][hexlabel2]
 
     def _to_left(self, delta_x, delta_y):
         """Return True iff the path of displacement (delta_x, delta_y)
@@ -415,15 +449,15 @@ class BattleMap(object):
                                         mid_cliff, mid_chit,
                                         total_obstacles, total_walls, game)
 
-    def is_los_blocked(self, hexlabel1, hexlabel2, game):
-        """Return True iff the line of sight from hexlabel1 to
-        hexlabel2 is blocked by terrain or creatures.
+    def _compute_los_paths(self, hexlabel1, hexlabel2):
+        """Return a list of (terrain_blocked, chit_hexlabels) tuples, one for
+        each line of sight from hexlabel1 to hexlabel2.  (Two if it runs
+        along a hexspine, else one.)
 
-        game is optional, but needed to check creatures.
+        terrain_blocked is True iff terrain alone blocks that line.
+        chit_hexlabels is a tuple of the intervening hexlabels which block
+        that line if a creature occupies them.
         """
-        assert hexlabel1 in self.hexes and hexlabel2 in self.hexes
-        if hexlabel1 == hexlabel2:
-            return False
         x1, y1 = label_to_coords(hexlabel1, self.entry_side, True)
         x2, y2 = label_to_coords(hexlabel2, self.entry_side, True)
         delta_x = x2 - x1
@@ -432,19 +466,64 @@ class BattleMap(object):
         hex2 = self.hexes[hexlabel2]
         strike_elevation = min(hex1.elevation, hex2.elevation)
         if close(delta_y, 0) or close(abs(delta_y), 1.5 * abs(delta_x)):
-            return (self._is_los_blocked_dir(
-                hex1, hex1, hex2, True, strike_elevation, game=game)
-                and
-                self._is_los_blocked_dir(hex1, hex1, hex2, False,
-                                         strike_elevation, game=game))
+            lefts = [True, False]
         else:
-            return self._is_los_blocked_dir(
-                hex1,
-                hex1,
-                hex2,
-                self._to_left(delta_x, delta_y),
-                strike_elevation,
-                game=game)
+            lefts = [self._to_left(delta_x, delta_y)]
+        paths = []
+        for left in lefts:
+            terrain_blocked = self._is_los_blocked_dir(hex1, hex1, hex2, left,
+                                                       strike_elevation)
+            chit_hexlabels = []
+            if not terrain_blocked:
+                hex3 = hex1
+                while True:
+                    direction = self._get_direction(hex3, hex2, left)
+                    hex3 = hex3.neighbors[direction]
+                    if hex3 == hex2:
+                        break
+                    if self._is_los_blocked_dir(
+                            hex1, hex1, hex2, left, strike_elevation,
+                            game=_OccupiedHex(hex3.label)):
+                        chit_hexlabels.append(hex3.label)
+            paths.append((terrain_blocked, tuple(chit_hexlabels)))
+        return paths
+
+    def los_paths(self, hexlabel1, hexlabel2):
+        """Return a list of (terrain_blocked, chit_hexlabels) tuples, one for
+        each line of sight from hexlabel1 to hexlabel2.
+
+        The line of sight is blocked iff every line is blocked by terrain or
+        by a creature in one of its chit_hexlabels.
+        """
+        key = (hexlabel1, hexlabel2)
+        paths = self._los_paths.get(key)
+        if paths is None:
+            paths = self._los_paths[key] = self._compute_los_paths(hexlabel1,
+                                                                   hexlabel2)
+        return paths
+
+    def is_los_blocked(self, hexlabel1, hexlabel2, game):
+        """Return True iff the line of sight from hexlabel1 to
+        hexlabel2 is blocked by terrain or creatures.
+
+        game is optional, but needed to check creatures.
+        """
+        assert hexlabel1 in self.hexes and hexlabel2 in self.hexes
+        if hexlabel1 == hexlabel2:
+            return False
+        for terrain_blocked, chit_hexlabels in self.los_paths(hexlabel1,
+                                                              hexlabel2):
+            if terrain_blocked:
+                continue
+            if game is not None:
+                for hexlabel in chit_hexlabels:
+                    if game.is_battle_hex_occupied(hexlabel):
+                        break
+                else:
+                    return False
+            else:
+                return False
+        return True
 
     def _count_bramble_hexes_dir(self, hex1, hex2, left, count):
         """Return the number of intervening bramble hexes.
@@ -482,6 +561,18 @@ class BattleMap(object):
         if hex1.entrance or hex2.entrance:
             logging.info("count_bramble_hexes entrance hex")
             return 0
+        key = (hexlabel1, hexlabel2)
+        count = self._bramble_counts.get(key)
+        if count is None:
+            count = self._bramble_counts[key] = self._compute_bramble_hexes(
+                hex1, hex2)
+        return count
+
+    def _compute_bramble_hexes(self, hex1, hex2):
+        """Return the minimum number of intervening bramble hexes along a
+        line of sight between hex1 and hex2 that terrain does not block."""
+        hexlabel1 = hex1.label
+        hexlabel2 = hex2.label
         x1, y1 = label_to_coords(hexlabel1, self.entry_side, True)
         x2, y2 = label_to_coords(hexlabel2, self.entry_side, True)
         delta_x = x2 - x1
@@ -519,3 +610,17 @@ class BattleMap(object):
         hex1 = self.hexes[hexlabel1]
         hex2 = self.hexes[hexlabel2]
         return max(hex2.elevation - hex1.elevation, 0)
+
+
+# (mterrain, entry_side) : BattleMap
+_battlemaps = {}
+
+
+def get_battlemap(mterrain, entry_side):
+    """Return the shared BattleMap for mterrain and entry_side, building it
+    the first time it is asked for."""
+    key = (mterrain, entry_side)
+    battlemap = _battlemaps.get(key)
+    if battlemap is None:
+        battlemap = _battlemaps[key] = BattleMap(mterrain, entry_side)
+    return battlemap
@@ -57,6 +57,10 @@ def _compute_nativity():
 
 creature_name_to_native_hazards = _compute_nativity()
 
+# Kinds of strike, for the strike table
+ENGAGED = "engaged"
+RANGESTRIKE = "rangestrike"
+
 
 def n2c(names):
     """Make a list of Creatures from a list of creature names"""
@@ -75,12 +79,58 @@ class Creature(object):
         self.rangestrikes = bool(rangestrikes)
         self.magicmissile = (rangestrikes == 2)
         self.acquirable = bool(self.acquirable_every)
-        self.hits = 0
+        self._hits = 0
         self.moved = False
         self.struck = False
-        self.hexlabel = None
+        self._hexlabel = None
         self.previous_hexlabel = None
         self.legion = None
+        # Values derived from the battle state, valid while the game's
+        # battle_version is still _cache_version.
+        self._cache = {}
+        self._cache_version = None
+
+    @property
+    def hexlabel(self):
+        return self._hexlabel
+
+    @hexlabel.setter
+    def hexlabel(self, hexlabel):
+        """Set this creature's battle hexlabel, and tell the game so it can
+        keep its battle hex index current.
+
+        Setting hexlabel directly, as the AI does to try out moves, is
+        fine; it does not notify observers.
+        """
+        old_hexlabel = self._hexlabel
+        self._hexlabel = hexlabel
+        try:
+            game = self.legion.player.game
+        except AttributeError:
+            return
+        game.battle_creature_moved(self, old_hexlabel, hexlabel)
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @hits.setter
+    def hits(self, hits):
+        self._hits = hits
+        try:
+            game = self.legion.player.game
+        except AttributeError:
+            return
+        game.battle_changed()
+
+    def _battle_cache(self):
+        """Return a dict of this creature's cached battle values, emptying
+        it first if the battle has changed since they were computed."""
+        version = self.legion.player.game.battle_version
+        if version != self._cache_version:
+            self._cache = {}
+            self._cache_version = version
+        return self._cache
 
     @property
     def power(self):
@@ -225,38 +275,43 @@ class Creature(object):
                 hexlabel_to_enemy[creature.hexlabel] = creature
         return hexlabel_to_enemy
 
-    @property
-    def engaged_enemies(self):
-        """Return a set of live enemy Creatures this Creature is engaged
-        with."""
+    def _adjacent_enemies(self, hexlabel_to_enemy):
+        """Return a frozenset of the Creatures in hexlabel_to_enemy that are
+        adjacent to this Creature, not across a cliff."""
         enemies = set()
-        if self.offboard or self.hexlabel is None:
-            return enemies
         game = self.legion.player.game
         hex1 = game.battlemap.hexes[self.hexlabel]
-        hexlabel_to_enemy = self._hexlabel_to_enemy()
         for hexside, hex2 in hex1.neighbors.iteritems():
             if hex2.label in hexlabel_to_enemy:
                 if (hex1.borders[hexside] != "Cliff" and
                    hex2.borders[(hexside + 3) % 6] != "Cliff"):
                     enemies.add(hexlabel_to_enemy[hex2.label])
+        return frozenset(enemies)
+
+    @property
+    def engaged_enemies(self):
+        """Return a frozenset of live enemy Creatures this Creature is
+        engaged with."""
+        if self.offboard or self.hexlabel is None:
+            return frozenset()
+        cache = self._battle_cache()
+        enemies = cache.get("engaged_enemies")
+        if enemies is None:
+            enemies = cache["engaged_enemies"] = self._adjacent_enemies(
+                self._hexlabel_to_enemy())
         return enemies
 
     @property
     def dead_adjacent_enemies(self):
-        """Return a set of dead enemy Creatures this Creature is engaged
-        with."""
-        enemies = set()
+        """Return a frozenset of dead enemy Creatures this Creature is
+        engaged with."""
         if self.offboard or self.hexlabel is None:
-            return enemies
-        game = self.legion.player.game
-        hex1 = game.battlemap.hexes[self.hexlabel]
-        hexlabel_to_enemy = self._hexlabel_to_dead_enemy()
-        for hexside, hex2 in hex1.neighbors.iteritems():
-            if hex2.label in hexlabel_to_enemy:
-                if (hex1.borders[hexside] != "Cliff" and
-                   hex2.borders[(hexside + 3) % 6] != "Cliff"):
-                    enemies.add(hexlabel_to_enemy[hex2.label])
+            return frozenset()
+        cache = self._battle_cache()
+        enemies = cache.get("dead_adjacent_enemies")
+        if enemies is None:
+            enemies = cache["dead_adjacent_enemies"] = self._adjacent_enemies(
+                self._hexlabel_to_dead_enemy())
         return enemies
 
     def has_los_to(self, hexlabel):
@@ -268,28 +323,34 @@ class Creature(object):
 
     @property
     def potential_rangestrike_targets(self):
-        """Return a set of Creatures that this Creature could rangestrike
-        if the phase were correct."""
-        game = self.legion.player.game
-        enemies = set()
+        """Return a frozenset of Creatures that this Creature could
+        rangestrike if the phase were correct."""
         if (self.offboard or self.hexlabel is None or not self.rangestrikes
            or self.dead_adjacent_enemies):
-            return enemies
-        hexlabel_to_enemy = self._hexlabel_to_enemy()
-        map1 = game.battlemap
-        for hexlabel, enemy in hexlabel_to_enemy.iteritems():
-            if (map1.range(self.hexlabel, hexlabel) <= self.skill and
-               (self.magicmissile or self.has_los_to(hexlabel)) and
-               (self.magicmissile or not enemy.is_lord)):
-                enemies.add(enemy)
+            return frozenset()
+        cache = self._battle_cache()
+        enemies = cache.get("potential_rangestrike_targets")
+        if enemies is None:
+            game = self.legion.player.game
+            enemies = set()
+            hexlabel_to_enemy = self._hexlabel_to_enemy()
+            map1 = game.battlemap
+            for hexlabel, enemy in hexlabel_to_enemy.iteritems():
+                if (map1.range(self.hexlabel, hexlabel) <= self.skill and
+                   (self.magicmissile or self.has_los_to(hexlabel)) and
+                   (self.magicmissile or not enemy.is_lord)):
+                    enemies.add(enemy)
+            enemies = cache["potential_rangestrike_targets"] = frozenset(
+                enemies)
         return enemies
 
     @property
     def rangestrike_targets(self):
-        """Return a set of Creatures that this Creature can rangestrike."""
+        """Return a frozenset of Creatures that this Creature can
+        rangestrike."""
         game = self.legion.player.game
         if game.battle_phase != Phase.STRIKE:
-            return set()
+            return frozenset()
         else:
             return self.potential_rangestrike_targets
 
@@ -376,12 +437,59 @@ class Creature(object):
         """Return True iff this creature can rangestrike an enemy."""
         return bool(self.rangestrike_targets)
 
+    def strike_values(self, target, mode=None):
+        """Return a tuple (number of dice, strike number) to use if striking
+        target.
+
+        If mode is ENGAGED or RANGESTRIKE, strike that way without checking
+        whether target is engaged or in range, assuming a clear line of
+        sight for a rangestrike.
+
+        The values are looked up in the battle map's strike table, keyed
+        by everything they depend on, and computed the first time.
+        """
+        game = self.legion.player.game
+        map1 = game.battlemap
+        if mode is None:
+            if target in self.engaged_enemies:
+                mode = ENGAGED
+            elif target in self.potential_rangestrike_targets:
+                mode = RANGESTRIKE
+        # Creatures can only block a rangestrike's line of sight, and that
+        # only matters for bramble.  A potential rangestrike target is never
+        # blocked.
+        if (mode == ENGAGED or self.magicmissile or
+                self.is_native("Bramble")):
+            los_blocked = None
+        elif mode == RANGESTRIKE:
+            los_blocked = False
+        else:
+            los_blocked = map1.is_los_blocked(self.hexlabel, target.hexlabel,
+                                              game)
+        key = (self.name, self.power, target.name, self.hexlabel,
+               target.hexlabel, mode, los_blocked)
+        values = map1.strike_table.get(key)
+        if values is None:
+            values = map1.strike_table[key] = (
+                self._compute_number_of_dice(target, map1, mode),
+                self._compute_strike_number(target, map1, mode, los_blocked))
+        return values
+
     def number_of_dice(self, target):
         """Return the number of dice to use if striking target."""
-        map1 = self.legion.player.game.battlemap
+        return self.strike_values(target)[0]
+
+    def strike_number(self, target):
+        """Return the strike number to use if striking target."""
+        return self.strike_values(target)[1]
+
+    def _compute_number_of_dice(self, target, map1, mode):
+        """Return the number of dice to use if striking target on map1,
+        with mode ENGAGED, RANGESTRIKE, or None if target cannot be
+        struck."""
         hex1 = map1.hexes[self.hexlabel]
         hex2 = map1.hexes[target.hexlabel]
-        if target in self.engaged_enemies:
+        if mode == ENGAGED:
             dice = self.power
             if hex1.terrain == "Volcano" and self.is_native(hex1.terrain):
                 dice += 2
@@ -394,7 +502,7 @@ class Creature(object):
             border2 = hex1.opposite_border(hexside)
             if border2 == "Dune" and not self.is_native(border2):
                 dice -= 1
-        elif target in self.potential_rangestrike_targets:
+        elif mode == RANGESTRIKE:
             dice = int(self.power / 2)
             if hex1.terrain == "Volcano" and self.is_native(hex1.terrain):
                 dice += 2
@@ -402,15 +510,18 @@ class Creature(object):
             dice = 0
         return dice
 
-    def strike_number(self, target):
-        """Return the strike number to use if striking target."""
-        game = self.legion.player.game
-        map1 = game.battlemap
+    def _compute_strike_number(self, target, map1, mode, los_blocked):
+        """Return the strike number to use if striking target on map1,
+        with mode ENGAGED, RANGESTRIKE, or None.
+
+        los_blocked is whether creatures or terrain block the line of sight
+        to target, if it matters.
+        """
         hex1 = map1.hexes[self.hexlabel]
         hex2 = map1.hexes[target.hexlabel]
         skill1 = self.skill
         skill2 = target.skill
-        if target in self.engaged_enemies:
+        if mode == ENGAGED:
             hexside = hex1.neighbor_to_hexside(hex2)
             border = hex1.borders[hexside]
             border2 = hex1.opposite_border(hexside)
@@ -427,14 +538,15 @@ class Creature(object):
             if (not self.magicmissile and map1.range(self.hexlabel,
                target.hexlabel) >= 4):
                 skill1 -= 1
-            if not self.magicmissile and not self.is_native("Bramble"):
+            if (not self.magicmissile and not self.is_native("Bramble")
+                    and not los_blocked):
                 skill1 -= map1.count_bramble_hexes(self.hexlabel,
-                                                   target.hexlabel, game)
+                                                   target.hexlabel, None)
             if not self.magicmissile:
                 skill1 -= map1.count_walls(self.hexlabel, target.hexlabel,
-                                           game)
+                                           None)
         strike_number = 4 - skill1 + skill2
-        if target in self.engaged_enemies:
+        if mode == ENGAGED:
             if (hex2.terrain == "Bramble" and not self.is_native(hex2.terrain)
                and target.is_native(hex2.terrain)):
                 strike_number += 1
@@ -468,9 +580,10 @@ class Creature(object):
                 return False
         retval = (carry_target is not original_target and
                   carry_target in self.engaged_enemies and
-                  not carry_target.dead and
-                  self.number_of_dice(carry_target) >= num_dice and
-                  self.strike_number(carry_target) <= strike_number)
+                  not carry_target.dead)
+        if retval:
+            num_dice2, strike_number2 = self.strike_values(carry_target)
+            retval = num_dice2 >= num_dice and strike_number2 <= strike_number
         logging.info("can_carry_to %s %s %s %s returning %s", carry_target,
                      original_target, num_dice, strike_number, retval)
         return retval
@@ -500,13 +613,11 @@ class Creature(object):
         """Return a set of all valid tuples (num_dice, strike_number) that
         this creature can use to strike target."""
         result = set()
-        num_dice = self.number_of_dice(target)
-        strike_number = self.strike_number(target)
+        num_dice, strike_number = self.strike_values(target)
         result.add((num_dice, strike_number))
         for creature in self.engaged_enemies:
             if creature is not target:
-                num_dice2 = self.number_of_dice(creature)
-                strike_number2 = self.strike_number(creature)
+                num_dice2, strike_number2 = self.strike_values(creature)
                 # Neither natives nor non-natives to dunes may roll one less
                 # die, when their strike is not up a dune hexside, in order to
                 # allow carry over up a dune hexside.
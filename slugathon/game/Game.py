@@ -33,6 +33,102 @@ def opposite(direction):
     return (direction + 3) % 6
 
 
+# (hexlabel, roll, block, came_from) : tuple of move path nodes
+_move_paths = {}
+
+
+def _add_move_paths(nodes, masterhex, roll, block, came_from, entry_side):
+    """Add masterhex's move path node, and then its subtree's, to
+    nodes."""
+    index = len(nodes)
+    nodes.append(None)
+    if roll > 0:
+        if block >= 0:
+            directions = [block]
+        elif block == ARCHES_AND_ARROWS:
+            directions = [direction for direction, gate in
+                          enumerate(masterhex.exits)
+                          if gate in ("ARCH", "ARROW", "ARROWS") and
+                          direction != came_from]
+        else:
+            directions = [direction for direction, gate in
+                          enumerate(masterhex.exits)
+                          if gate in ("ARROW", "ARROWS") and
+                          direction != came_from]
+        for direction in directions:
+            neighbor = masterhex.neighbors[direction]
+            _add_move_paths(nodes, neighbor, roll - 1, ARROWS_ONLY,
+                            opposite(direction),
+                            neighbor.find_entry_side(opposite(direction)))
+    nodes[index] = (masterhex.label, entry_side, roll, len(nodes))
+
+
+def find_move_paths(masterhex, roll, block, came_from):
+    """Return every path a legion could take from masterhex with roll,
+    ignoring other legions, as a tree.
+
+    The tree is a tuple of (hexlabel, entry_side, roll left, end) nodes in
+    depth-first order, where end is the index just past the node's subtree.
+    The root's entry_side is None.  The board never changes, so trees are
+    built once and shared.
+    """
+    key = (masterhex.label, roll, block, came_from)
+    paths = _move_paths.get(key)
+    if paths is None:
+        nodes = []
+        _add_move_paths(nodes, masterhex, roll, block, came_from, None)
+        paths = _move_paths[key] = tuple(nodes)
+    return paths
+
+
+# (hexlabel, distance) : frozenset of hexlabels
+_nearby_hexlabels = {}
+
+
+def find_nearby_hexlabels(masterhex, distance):
+    """Return a frozenset of the labels of hexes within distance steps of
+    masterhex, including masterhex, crossing any hexside with a gate on
+    either side.
+
+    Found once per hex and distance by breadth-first search, and shared.
+    """
+    key = (masterhex.label, distance)
+    hexlabels = _nearby_hexlabels.get(key)
+    if hexlabels is None:
+        seen = set([masterhex.label])
+        frontier = [masterhex]
+        for unused in xrange(distance):
+            next_frontier = []
+            for hex1 in frontier:
+                for direction, gate in enumerate(hex1.exits):
+                    neighbor = hex1.neighbors[direction]
+                    if (neighbor and neighbor.label not in seen and (
+                            gate != "NONE" or
+                            neighbor.exits[opposite(direction)] != "NONE")):
+                        seen.add(neighbor.label)
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        hexlabels = _nearby_hexlabels[key] = frozenset(seen)
+    return hexlabels
+
+
+# tower hexlabel : frozenset of hexlabels
+_tower_teleport_hexlabels = {}
+
+
+def find_tower_teleport_hexlabels(masterhex):
+    """Return a frozenset of the labels of the hexes a legion with a lord
+    could tower teleport to from tower masterhex, if they were empty: those
+    within 6 hexes, and the other towers, but not masterhex itself."""
+    hexlabels = _tower_teleport_hexlabels.get(masterhex.label)
+    if hexlabels is None:
+        hexlabels = _tower_teleport_hexlabels[masterhex.label] = (
+            find_nearby_hexlabels(masterhex, 6).union(
+                masterhex.board.get_tower_labels()).difference(
+                [masterhex.label]))
+    return hexlabels
+
+
 @implementer(IObserver)
 class Game(Observed):
 
@@ -55,6 +151,8 @@ class Game(Observed):
         self.players = []
         self.add_player(owner, player_class, player_info)
         self.board = MasterBoard.MasterBoard()
+        # masterboard hexlabel : set of legions there
+        self._hexlabel_to_legions = defaultdict(set)
         self.turn = 1
         self.phase = Phase.SPLIT
         self.active_player = None
@@ -63,6 +161,9 @@ class Game(Observed):
         self.add_observer(self.history)
         self.current_engagement_hexlabel = None
         self.defender_chose_not_to_flee = False
+        # Bumped whenever anything changes that derived creature battle
+        # values depend on, so that creatures know when to recompute them.
+        self.battle_version = 0
         self.attacker_legion = None
         self.defender_legion = None
         self.battle_masterhex = None
@@ -76,12 +177,35 @@ class Game(Observed):
         self.pending_carry = None
         self.pending_summon = False
         self.pending_reinforcement = False
+        # battle hexlabel : list of creatures in that hex
+        self._battle_hex_to_creatures = {}
+        # Stack of tentative battle changes, each a tuple of
+        # (creature, hexlabel, index in hex, previous_hexlabel, moved, hits,
+        #  struck) records to restore
+        self._battle_tries = []
         self.master = master
         self.ai_time_limit = ai_time_limit
         self.player_time_limit = player_time_limit
         # list of tuples of Player like [(winner,), (tied1, tied2), (loser,)]
         self.finish_order = []
 
+    @property
+    def battle_phase(self):
+        return self._battle_phase
+
+    @battle_phase.setter
+    def battle_phase(self, battle_phase):
+        self._battle_phase = battle_phase
+        self.battle_changed()
+
+    def battle_changed(self):
+        """Note that the battle state has changed, invalidating creatures'
+        cached battle values.
+
+        Called on creature moves and hits, and battle phase changes.
+        """
+        self.battle_version += 1
+
     @property
     def battle_legions(self):
         """Return a list of the legions involved in battle, or []."""
@@ -104,13 +228,14 @@ class Game(Observed):
         assert defender_legion.hexlabel == attacker_legion.hexlabel
         self.battle_masterhex = self.board.hexes[attacker_legion.hexlabel]
         self.battle_entry_side = attacker_legion.entry_side
-        self.battlemap = BattleMap.BattleMap(self.battle_masterhex.terrain,
-                                             self.battle_entry_side)
+        self.battlemap = BattleMap.get_battlemap(
+            self.battle_masterhex.terrain, self.battle_entry_side)
         self.battle_turn = 1
         self.battle_phase = Phase.MANEUVER
         self.battle_active_legion = self.defender_legion
         self.defender_legion.enter_battle("DEFENDER")
         self.attacker_legion.enter_battle("ATTACKER")
+        self.reindex_battle_hexes()
         self.first_attacker_kill = None
         self.attacker_entered = False
         self.pending_carry = None
@@ -134,6 +259,9 @@ class Game(Observed):
         self.pending_carry = None
         self.pending_summon = False
         self.pending_reinforcement = False
+        self._battle_hex_to_creatures = {}
+        del self._battle_tries[:]
+        self.battle_changed()
 
     def __eq__(self, other):
         return isinstance(other, Game) and self.name == other.name
@@ -389,13 +517,53 @@ class Game(Observed):
     def all_legions(self, hexlabel=None):
         """Return a set of all legions in hexlabel, or in the whole
         game if hexlabel is None"""
+        if hexlabel is not None:
+            return set(legion for legion in self.legions_in_hex(hexlabel)
+                       if len(legion))
         legions = set()
         for player in self.players:
             for legion in player.legions:
-                if hexlabel in (None, legion.hexlabel) and len(legion):
+                if len(legion):
                     legions.add(legion)
         return legions
 
+    def legions_in_hex(self, hexlabel):
+        """Return a set of the legions in the masterboard hex with
+        hexlabel, including any with no living creatures.
+
+        The caller must not modify it.
+        """
+        return self._hexlabel_to_legions.get(hexlabel, frozenset())
+
+    def add_legion_to_index(self, legion):
+        """Add legion to the masterboard hex index.  Called from Player
+        when it gains a legion."""
+        self._hexlabel_to_legions[legion.hexlabel].add(legion)
+
+    def remove_legion_from_index(self, legion):
+        """Remove legion from the masterboard hex index.  Called from
+        Player when it loses a legion."""
+        legions = self._hexlabel_to_legions.get(legion.hexlabel)
+        if legions is not None:
+            legions.discard(legion)
+            if not legions:
+                del self._hexlabel_to_legions[legion.hexlabel]
+
+    def legion_moved(self, legion, old_hexlabel, new_hexlabel):
+        """Update the masterboard hex index for legion's change of
+        hexlabel.
+
+        Called from Legion.  Legions that are not in the index, like the
+        AI's hypothetical legions, are ignored.
+        """
+        legions = self._hexlabel_to_legions.get(old_hexlabel)
+        if not legions or legion not in legions:
+            return
+        legions.remove(legion)
+        if not legions:
+            del self._hexlabel_to_legions[old_hexlabel]
+        self._hexlabel_to_legions[new_hexlabel].add(legion)
+
     def find_legion(self, markerid):
         """Return the legion called markerid, or None."""
         for player in self.players:
@@ -450,80 +618,54 @@ class Game(Observed):
 
     def find_normal_moves(self, legion, masterhex, roll, block=None,
                           came_from=None):
-        """Recursively find non-teleport moves for legion from masterhex.
+        """Find non-teleport moves for legion from masterhex.
 
         If block >= 0, go only that way.
         If block == ARCHES_AND_ARROWS, use arches and arrows.
         If block == ARROWS_ONLY, use only arrows.
+        Follow the paths from find_move_paths, stopping at enemy legions.
         Return a set of (hexlabel, entry_side) tuples.
         """
         if block is None:
             block = masterhex.find_block()
             if block is None:
                 block = ARCHES_AND_ARROWS
-        moves = set()
-        hexlabel = masterhex.label
         player = legion.player
-        # If there is an enemy legion and no friendly legion, mark the hex
-        # as a legal move, and stop.
-        if player.enemy_legions(hexlabel):
-            if not player.friendly_legions(hexlabel):
-                moves.add((hexlabel, masterhex.find_entry_side(came_from)))
-        elif roll == 0:
-            # Final destination
-            # Do not add this hex if already occupied by another friendly
-            # legion.
-            allies = set(player.friendly_legions(hexlabel))
-            allies.discard(legion)
-            if not allies:
-                moves.add((hexlabel, masterhex.find_entry_side(came_from)))
-        elif block >= 0:
-            moves.update(self.find_normal_moves(legion,
-                                                masterhex.neighbors[
-                                                    block],
-                                                roll - 1,
-                                                ARROWS_ONLY,
-                                                opposite(block)))
-        elif block == ARCHES_AND_ARROWS:
-            for direction, gate in enumerate(masterhex.exits):
-                if gate in ("ARCH", "ARROW", "ARROWS") and (direction !=
-                                                            came_from):
-                    moves.update(self.find_normal_moves(legion,
-                                                        masterhex.neighbors[
-                                                            direction],
-                                                        roll - 1,
-                                                        ARROWS_ONLY,
-                                                        opposite(direction)))
-        elif block == ARROWS_ONLY:
-            for direction, gate in enumerate(masterhex.exits):
-                if gate in ("ARROW", "ARROWS") and (direction != came_from):
-                    moves.update(self.find_normal_moves(legion,
-                                                        masterhex.neighbors[
-                                                            direction],
-                                                        roll - 1,
-                                                        ARROWS_ONLY,
-                                                        opposite(direction)))
+        moves = set()
+        paths = find_move_paths(masterhex, roll, block, came_from)
+        ii = 0
+        while ii < len(paths):
+            hexlabel, entry_side, roll_left, end = paths[ii]
+            legions = self.legions_in_hex(hexlabel)
+            if any(legion2.player is not player and len(legion2)
+                   for legion2 in legions):
+                # If there is an enemy legion and no friendly legion, mark
+                # the hex as a legal move, and stop.
+                if not any(legion2.player is player for legion2 in legions):
+                    if entry_side is None:
+                        entry_side = masterhex.find_entry_side(came_from)
+                    moves.add((hexlabel, entry_side))
+                ii = end
+            elif roll_left == 0:
+                # Final destination
+                # Do not add this hex if already occupied by another
+                # friendly legion.
+                if not any(legion2.player is player and legion2 != legion
+                           for legion2 in legions):
+                    if entry_side is None:
+                        entry_side = masterhex.find_entry_side(came_from)
+                    moves.add((hexlabel, entry_side))
+                ii = end
+            else:
+                ii += 1
         return moves
 
-    def find_nearby_empty_hexes(self, legion, masterhex, roll, came_from):
-        """Recursively find empty hexes within roll hexes, for tower
-        teleport"""
-        hexlabel = masterhex.label
+    def find_nearby_empty_hexes(self, legion, masterhex, roll):
+        """Find empty hexes within roll hexes, for tower teleport"""
         moves = set()
-        if not self.all_legions(hexlabel):
-            moves.add((hexlabel, TELEPORT))
-        if roll > 0:
-            for direction, gate in enumerate(masterhex.exits):
-                if direction != came_from:
-                    neighbor = masterhex.neighbors[direction]
-                    if neighbor and (
-                            gate != "NONE" or
-                            neighbor.exits[opposite(direction)] != "NONE"):
-                        moves.update(self.find_nearby_empty_hexes(
-                                     legion,
-                                     neighbor,
-                                     roll - 1,
-                                     opposite(direction)))
+        for hexlabel in find_nearby_hexlabels(masterhex, roll):
+            if not self.all_legions(hexlabel):
+                moves.add((hexlabel, TELEPORT))
         return moves
 
     def find_tower_teleport_moves(self, legion, masterhex):
@@ -531,11 +673,8 @@ class Game(Observed):
         teleport."""
         moves = set()
         if masterhex.tower and legion.num_lords:
-            moves.update(self.find_nearby_empty_hexes(legion, masterhex, 6,
-                                                      None))
-            for hexlabel in self.board.get_tower_labels():
-                if hexlabel != masterhex.label and not self.all_legions(
-                        hexlabel):
+            for hexlabel in find_tower_teleport_hexlabels(masterhex):
+                if not self.all_legions(hexlabel):
                     moves.add((hexlabel, TELEPORT))
         return moves
 
@@ -962,6 +1101,7 @@ class Game(Observed):
             legion.recruit_creature(creature, recruiter_names)
             if self.phase == Phase.FIGHT:
                 creature.hexlabel = "DEFENDER"
+                self.reindex_battle_hexes()
         if self.pending_reinforcement:
             self.pending_reinforcement = False
             if self.is_battle_over and not self.pending_acquire:
@@ -1004,6 +1144,7 @@ class Game(Observed):
             if self.phase == Phase.FIGHT:
                 creature = legion.creatures[-1]
                 creature.hexlabel = "ATTACKER"
+                self.reindex_battle_hexes()
             action = Action.SummonAngel(self.name, player.name, markerid,
                                         donor_markerid, creature_name)
             self.notify(action)
@@ -1056,6 +1197,7 @@ class Game(Observed):
         if legion is None:
             return
         legion.unreinforce()
+        self.reindex_battle_hexes()
 
     def carry(self, playername, carry_target_name, carry_target_hexlabel,
               carries):
@@ -1103,17 +1245,23 @@ class Game(Observed):
     @property
     def engagement_hexlabels(self):
         """Return a set of all hexlabels with engagements"""
-        hexlabels_to_legion_colors = defaultdict(set)
-        for legion in self.all_legions():
-            hexlabel = legion.hexlabel
-            color = legion.player.color
-            hexlabels_to_legion_colors[hexlabel].add(color)
         results = set()
-        for hexlabel, colorset in hexlabels_to_legion_colors.iteritems():
-            if len(colorset) >= 2:
+        for hexlabel, legions in self._hexlabel_to_legions.iteritems():
+            if len(legions) >= 2 and self.is_engagement(hexlabel):
                 results.add(hexlabel)
         return results
 
+    def is_engagement(self, hexlabel):
+        """Return True iff legions of more than one player are in
+        hexlabel."""
+        colors = set()
+        for legion in self.legions_in_hex(hexlabel):
+            if len(legion):
+                colors.add(legion.player.color)
+                if len(colors) >= 2:
+                    return True
+        return False
+
     @property
     def pending_acquire(self):
         """True iff we're waiting for any player to acquire angels."""
@@ -1150,22 +1298,134 @@ class Game(Observed):
             if legion2 != legion:
                 return legion2
 
+    def reindex_battle_hexes(self):
+        """Rebuild the index of battle hexes to the creatures in them.
+
+        Creatures keep the index current when their hexlabels change, but
+        this must be called after adding creatures to or removing them from
+        a legion in battle.
+        """
+        self.battle_changed()
+        self._battle_hex_to_creatures = {}
+        for legion in self.battle_legions:
+            for creature in legion.creatures:
+                self._battle_hex_to_creatures.setdefault(
+                    creature.hexlabel, []).append(creature)
+
+    def battle_creature_moved(self, creature, old_hexlabel, new_hexlabel):
+        """Update the battle hex index for creature's change of hexlabel.
+
+        Called from Creature.  Creatures that are not in the index, because
+        they're not in battle, are ignored.
+        """
+        self.battle_changed()
+        creatures = self._battle_hex_to_creatures.get(old_hexlabel)
+        if not creatures:
+            return
+        for ii, creature2 in enumerate(creatures):
+            if creature2 is creature:
+                del creatures[ii]
+                if not creatures:
+                    del self._battle_hex_to_creatures[old_hexlabel]
+                self._battle_hex_to_creatures.setdefault(
+                    new_hexlabel, []).append(creature)
+                return
+
     def creatures_in_battle_hex(self, hexlabel, name=None):
         """Return a set of all creatures in the battlehex with hexlabel.
 
         If name is not None, then return only creatures with that name.
         """
-        creatures = set()
-        for legion in self.battle_legions:
-            for creature in legion.creatures:
-                if creature.hexlabel == hexlabel:
-                    if name is None or creature.name == name:
-                        creatures.add(creature)
-        return creatures
+        creatures = self._battle_hex_to_creatures.get(hexlabel, ())
+        if name is None:
+            return set(creatures)
+        return set(creature for creature in creatures if creature.name == name)
 
     def is_battle_hex_occupied(self, hexlabel):
         """Return True iff there's a creature in the hex with hexlabel."""
-        return bool(self.creatures_in_battle_hex(hexlabel))
+        return bool(self._battle_hex_to_creatures.get(hexlabel))
+
+    def _battle_try_record(self, creature):
+        """Return a record of creature's battle state, for undo."""
+        hexlabel = creature.hexlabel
+        index = None
+        for ii, creature2 in enumerate(
+                self._battle_hex_to_creatures.get(hexlabel, ())):
+            if creature2 is creature:
+                index = ii
+                break
+        return (creature, hexlabel, index, creature.previous_hexlabel,
+                creature.moved, creature.hits, creature.struck)
+
+    def _restore_battle_try_record(self, record):
+        (creature, hexlabel, index, previous_hexlabel, moved, hits,
+         struck) = record
+        if creature.hexlabel != hexlabel:
+            creature.hexlabel = hexlabel
+            if index is not None:
+                # Put it back in the same place among the hex's creatures,
+                # so the first creature in each hex is unchanged.
+                creatures = self._battle_hex_to_creatures[hexlabel]
+                if creatures[-1] is creature:
+                    creatures.insert(index, creatures.pop())
+        if creature.hits != hits:
+            creature.hits = hits
+        creature.previous_hexlabel = previous_hexlabel
+        creature.moved = moved
+        creature.struck = struck
+
+    def try_battle_move(self, creature, hexlabel, moved=True):
+        """Tentatively move creature to the battle hex with hexlabel.
+
+        This is for the AI to try out moves.  Legality is not checked, and
+        no Action is sent.  If moved is False, leave the creature's moved
+        flag alone, to see how it would do standing there.  Undo with
+        undo_battle_try.
+        """
+        self._battle_tries.append((self._battle_try_record(creature),))
+        creature.previous_hexlabel = creature.hexlabel
+        creature.hexlabel = hexlabel
+        if moved:
+            creature.moved = True
+        self.battle_changed()
+
+    def try_battle_strike(self, striker, target, hits):
+        """Tentatively have striker strike target for hits hits, without
+        carries.
+
+        striker may be None, to just damage target.  Undo with
+        undo_battle_try.
+        """
+        if striker is None:
+            records = (self._battle_try_record(target),)
+        else:
+            records = (self._battle_try_record(striker),
+                       self._battle_try_record(target))
+            striker.struck = True
+        self._battle_tries.append(records)
+        target.hits = min(target.hits + hits, target.power)
+        self.battle_changed()
+
+    def try_battle_kill(self, creature):
+        """Tentatively kill creature.  Undo with undo_battle_try."""
+        self.try_battle_strike(None, creature, creature.power)
+
+    @property
+    def battle_try_depth(self):
+        """Return the number of tentative battle changes not yet undone."""
+        return len(self._battle_tries)
+
+    def undo_battle_try(self):
+        """Undo the last tentative battle change."""
+        records = self._battle_tries.pop()
+        for record in reversed(records):
+            self._restore_battle_try_record(record)
+        self.battle_changed()
+
+    def undo_battle_tries(self, depth=0):
+        """Undo tentative battle changes until only depth remain."""
+        while len(self._battle_tries) > depth:
+            self.undo_battle_try()
 
     def battle_hex_entry_cost(self, creature, terrain, border):
         """Return the cost for creature to enter a battle hex with terrain,
@@ -1220,52 +1480,66 @@ class Game(Observed):
         starting from hexlabel, with movement_left.
 
         Do not include hexlabel itself.
+
+        Entry costs only depend on the hex entered and the hexside crossed,
+        so arriving somewhere with more movement left is always at least as
+        good.  We expand each hex once, with the most movement left it can
+        be reached with, trying hexes in order of decreasing movement left.
         """
         result = set()
         if movement_left <= 0:
             return result
-        hex1 = self.battlemap.hexes[hexlabel]
-        for hexside, hex2 in hex1.neighbors.iteritems():
-            try:
-                creature2 = self.creatures_in_battle_hex(hex2.label).pop()
-            except KeyError:
-                creature2 = None
-            if (creature.flies or not creature2 or (
-                    ignore_mobile_allies and
-                    creature2.legion == creature.legion and
-                    creature2.mobile)):
-                if hex1.entrance:
-                    # Ignore hexside penalties from entrances.  There aren't
-                    # any on the standard boards, and this avoids having to
-                    # properly compute the real hexside.
-                    border = None
-                else:
-                    border = hex1.opposite_border(hexside)
-                cost = self.battle_hex_entry_cost(creature, hex2.terrain,
-                                                  border)
-                if cost <= movement_left:
-                    try:
-                        creature2 = self.creatures_in_battle_hex(
-                            hex2.label).pop()
-                    except KeyError:
-                        creature2 = None
-                    if (not creature2 or (
-                            ignore_mobile_allies and
-                            creature2.legion == creature.legion and
-                            creature2.mobile)):
-                        result.add(hex2.label)
-                if creature.flies:
-                    flyover_cost = self.battle_hex_flyover_cost(creature,
-                                                                hex2.terrain)
-                else:
-                    flyover_cost = maxint
-                min_cost = min(cost, flyover_cost)
-                if min_cost < movement_left:
-                    result.update(self._find_battle_moves_inner(
-                                  creature,
-                                  hex2.label,
-                                  movement_left - min_cost,
-                                  ignore_mobile_allies))
+        # hexlabel : movement left after reaching it
+        best = {hexlabel: movement_left}
+        # buckets[ii] is a list of hexlabels reached with ii movement left
+        buckets = [[] for unused in xrange(movement_left + 1)]
+        buckets[movement_left].append(hexlabel)
+        # hexlabel : True iff creature can end its move there
+        open_hexlabels = {}
+        for left in xrange(movement_left, 0, -1):
+            for hexlabel1 in buckets[left]:
+                if best[hexlabel1] != left:
+                    # Already expanded with more movement left.
+                    continue
+                hex1 = self.battlemap.hexes[hexlabel1]
+                for hexside, hex2 in hex1.neighbors.iteritems():
+                    hexlabel2 = hex2.label
+                    is_open = open_hexlabels.get(hexlabel2)
+                    if is_open is None:
+                        creatures = self._battle_hex_to_creatures.get(
+                            hexlabel2)
+                        if creatures:
+                            creature2 = creatures[0]
+                            is_open = (ignore_mobile_allies and
+                                       creature2.legion == creature.legion and
+                                       creature2.mobile)
+                        else:
+                            is_open = True
+                        open_hexlabels[hexlabel2] = is_open
+                    if not is_open and not creature.flies:
+                        continue
+                    if hex1.entrance:
+                        # Ignore hexside penalties from entrances.  There
+                        # aren't any on the standard boards, and this avoids
+                        # having to properly compute the real hexside.
+                        border = None
+                    else:
+                        border = hex1.opposite_border(hexside)
+                    cost = self.battle_hex_entry_cost(creature, hex2.terrain,
+                                                      border)
+                    if cost <= left and is_open:
+                        result.add(hexlabel2)
+                    if creature.flies:
+                        flyover_cost = self.battle_hex_flyover_cost(
+                            creature, hex2.terrain)
+                    else:
+                        flyover_cost = maxint
+                    min_cost = min(cost, flyover_cost)
+                    if min_cost < left:
+                        left2 = left - min_cost
+                        if left2 > best.get(hexlabel2, 0):
+                            best[hexlabel2] = left2
+                            buckets[left2].append(hexlabel2)
         result.discard(hexlabel)
         return result
 
@@ -1595,6 +1869,7 @@ class Game(Observed):
                                     legion.unreinforce()
                         else:
                             logging.info("%s has hexlabel None", creature)
+        self.reindex_battle_hexes()
 
     def cleanup_dead_creatures(self):
         logging.info("cleanup_dead_creatures")
@@ -1864,6 +2139,7 @@ class Game(Observed):
             if legion is None:
                 return
             player.unsummon_angel(legion, action.creature_name)
+            self.reindex_battle_hexes()
 
         elif isinstance(action, Action.DoNotSummonAngel):
             self._do_not_summon_angel(action.playername, action.markerid)
@@ -27,7 +27,7 @@ class Legion(Observed):
         self.creatures = creatures
         for creature in self.creatures:
             creature.legion = self
-        self.hexlabel = hexlabel  # an int not a str
+        self._hexlabel = hexlabel  # an int not a str
         self.player = player
         self.moved = False
         self.teleported = False
@@ -110,10 +110,30 @@ class Legion(Observed):
                 return True
         return False
 
+    @property
+    def hexlabel(self):
+        return self._hexlabel
+
+    @hexlabel.setter
+    def hexlabel(self, hexlabel):
+        """Set this legion's masterboard hexlabel, and tell the game so it
+        can keep its hex index current.
+
+        Setting hexlabel directly, as the AI does to try out moves, is
+        fine; it does not notify observers.
+        """
+        old_hexlabel = self._hexlabel
+        self._hexlabel = hexlabel
+        try:
+            game = self.player.game
+        except AttributeError:
+            return
+        game.legion_moved(self, old_hexlabel, hexlabel)
+
     @property
     def engaged(self):
         """Return True iff this legion is engaged with an enemy legion."""
-        return self.hexlabel in self.player.game.engagement_hexlabels
+        return self.player.game.is_engagement(self.hexlabel)
 
     def __repr__(self):
         return "Legion %s (%s) in %s %s" % (self.markerid, self.picname,
@@ -132,7 +132,7 @@ class Player(Observed):
                      creaturedata.starting_creature_names]
         legion = Legion.Legion(self, self.take_marker(markerid), creatures,
                                self.starting_tower)
-        self.markerid_to_legion[markerid] = legion
+        self.add_legion(legion)
         legion.add_observer(self.game)
         action = Action.CreateStartingLegion(self.game.name, self.name,
                                              markerid)
@@ -187,7 +187,7 @@ class Player(Observed):
             creature.legion = parent
         self.take_marker(child_markerid)
         new_legion2.add_observer(self.game)
-        self.markerid_to_legion[child_markerid] = new_legion2
+        self.add_legion(new_legion2)
         del parent
         # One action for our player with creature names
         action = Action.SplitLegion(self.game.name, self.name,
@@ -218,6 +218,7 @@ class Player(Observed):
         parent.creatures += child.creatures
         child.remove_observer(self)
         del self.markerid_to_legion[child_markerid]
+        self.game.remove_legion_from_index(child)
         self.markerids_left.add(child.markerid)
         self.selected_markerid = None
         del child
@@ -291,13 +292,22 @@ class Player(Observed):
 
     def friendly_legions(self, hexlabel=None):
         """Return a set of this player's legions, in hexlabel if not None."""
-        return set([legion for legion in self.legions if hexlabel in
-                    (None, legion.hexlabel)])
+        if hexlabel is None:
+            return set(self.legions)
+        return set(legion for legion in self.game.legions_in_hex(hexlabel)
+                   if legion.player is self)
 
     def enemy_legions(self, hexlabel=None):
         """Return a set of other players' legions, in hexlabel if not None."""
-        return set([legion for legion in self.game.all_legions(hexlabel)
-                    if legion.player is not self])
+        if hexlabel is None:
+            legions = set()
+            for player in self.game.players:
+                if player is not self:
+                    legions.update(legion for legion in player.legions
+                                   if len(legion))
+            return legions
+        return set(legion for legion in self.game.legions_in_hex(hexlabel)
+                   if legion.player is not self and len(legion))
 
     @property
     def can_exit_move_phase(self):
@@ -525,6 +535,14 @@ class Player(Observed):
         for legion in self.legions:
             legion.recruited = False
 
+    def add_legion(self, legion):
+        """Add legion, which is already marked with one of our markers."""
+        old_legion = self.markerid_to_legion.get(legion.markerid)
+        if old_legion is not None:
+            self.game.remove_legion_from_index(old_legion)
+        self.markerid_to_legion[legion.markerid] = legion
+        self.game.add_legion_to_index(legion)
+
     def remove_legion(self, markerid):
         """Remove the legion with markerid."""
         assert type(markerid) == str
@@ -532,6 +550,7 @@ class Player(Observed):
             legion = self.markerid_to_legion[markerid]
             legion.remove_observer(self)
             del self.markerid_to_legion[markerid]
+            self.game.remove_legion_from_index(legion)
             del legion
             self.markerids_left.add(markerid)
 
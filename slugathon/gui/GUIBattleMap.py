@@ -293,8 +293,7 @@ class GUIBattleMap(gtk.EventBox):
                         assert len(chits) == 1
                         chit = chits[0]
                         target = chit.creature
-                        num_dice = striker.number_of_dice(target)
-                        strike_number = striker.strike_number(target)
+                        num_dice, strike_number = striker.strike_values(target)
                         self.strike(striker, target, num_dice, strike_number)
                         return True
         return False
@@ -422,8 +421,7 @@ class GUIBattleMap(gtk.EventBox):
                                                     self.parent_window)
                     def1.addCallback(self.picked_strike_penalty)
                 else:
-                    num_dice = striker.number_of_dice(target)
-                    strike_number = striker.strike_number(target)
+                    num_dice, strike_number = striker.strike_values(target)
                     self.strike(striker, target, num_dice, strike_number)
 
             else:
@@ -57,7 +57,7 @@ class PickEntrySide(gtk.Dialog):
 
         terrain = masterhex.terrain
         # We always orient the map as if for entry side 5.
-        self.battlemap = BattleMap.BattleMap(terrain, 5)
+        self.battlemap = BattleMap.get_battlemap(terrain, 5)
         self.entry_sides = entry_sides
         self.deferred = def1
         self.playername = playername
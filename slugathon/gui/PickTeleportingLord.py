@@ -82,7 +82,7 @@ if __name__ == "__main__":
     creatures1 = [Creature.Creature(name) for name in
                   ["Titan", "Archangel", "Angel", "Ogre", "Troll", "Ranger"]]
     legion = Legion.Legion(player, "Rd01", creatures1, 1)
-    player.markerid_to_legion[legion.markerid] = legion
+    player.add_legion(legion)
 
     def my_callback(creature_name):
         logging.info("Picked %s", creature_name)
@@ -104,7 +104,7 @@ if __name__ == "__main__":
     legion4 = Legion.Legion(player, "Rd04", creatures4, 4)
     legion5 = Legion.Legion(player, "Rd05", creatures5, 4)
     for legion in [legion1, legion2, legion3, legion4, legion5]:
-        player.markerid_to_legion[legion.markerid] = legion
+        player.add_legion(legion)
 
     def my_callback((legion, donor, creature)):
         logging.info("Will summon %s from %s into %s", creature, donor, legion)
@@ -0,0 +1,75 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+"""Games set up for AI tests."""
+
+
+import time
+
+from slugathon.data.creaturedata import starting_creature_names
+from slugathon.game import Creature, Game, Legion
+
+
+def make_game(defender_names=None, attacker_names=None, battle=False):
+    """Return a 2-player game where p1's legion Bu01 has moved into hex 3
+    from side 5 to attack p0's legion Rd01.
+
+    defender_names and attacker_names are lists of creature names for Rd01
+    and Bu01; None means the starting creatures.  If battle, the battle has
+    started.
+    """
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    rd01 = player0.markerid_to_legion["Rd01"]
+    bu01 = player1.markerid_to_legion["Bu01"]
+    for legion, names in [(rd01, defender_names), (bu01, attacker_names)]:
+        if names is not None:
+            legion.creatures = Creature.n2c(names)
+        for creature in legion.creatures:
+            creature.legion = legion
+    rd01.move(3, False, None, 5)
+    bu01.move(3, False, None, 5)
+    if battle:
+        game._init_battle(bu01, rd01)
+    return game
+
+
+def make_battle_game():
+    """Return a game in a battle between starting legions with some
+    rangestrikers added."""
+    return make_game(list(starting_creature_names) + ["Ranger", "Gorgon"],
+                     list(starting_creature_names) + ["Ranger", "Warlock"],
+                     battle=True)
+
+
+def make_scattered_game(rand):
+    """Return a 3-player game with 6 legions per player scattered over the
+    board at random."""
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    game.add_player("p2")
+    hexlabels = sorted(game.board.hexes)
+    for player, color in zip(game.players, ["Red", "Blue", "Green"]):
+        player.assign_color(color)
+        for ii in xrange(1, 7):
+            markerid = "%s%02d" % (player.color_abbrev, ii)
+            names = ["Ogre", "Centaur"]
+            if ii == 1:
+                names.append("Titan")
+            legion = Legion.Legion(player, markerid, Creature.n2c(names),
+                                   rand.choice(hexlabels))
+            player.add_legion(legion)
+    return game
@@ -2,10 +2,18 @@ __copyright__ = "Copyright (c) 2012 David Ripton"
 __license__ = "GNU GPL v2"
 
 
+import itertools
+import random
+import threading
 import time
 
-from slugathon.ai import CleverBot
+from twisted.internet import defer
+
+from slugathon.ai import CleverBot, LegionMovePool
+from slugathon.ai.BattleState import BattleState
+from slugathon.ai.Budget import Budget
 from slugathon.game import Creature, Phase, Game
+from gamesetup import make_game, make_battle_game
 
 
 def test_best7():
@@ -795,6 +803,153 @@ def test_score_legion_move_swamp():
     a_titan.move("F4")
 
 
+def test_find_best_legion_move():
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    player0.pick_marker("Rd02")
+    player0.split_legion("Rd01", "Rd02",
+                         ["Titan", "Centaur", "Ogre", "Gargoyle"],
+                         ["Angel", "Centaur", "Ogre", "Gargoyle"])
+    rd01 = player0.markerid_to_legion["Rd01"]
+    player1.pick_marker("Bu02")
+    player1.split_legion("Bu01", "Bu02",
+                         ["Titan", "Centaur", "Ogre", "Gargoyle"],
+                         ["Angel", "Centaur", "Ogre", "Gargoyle"])
+    bu01 = player1.markerid_to_legion["Bu01"]
+    rd01.move(3, False, None, 5)
+    bu01.move(3, False, None, 5)
+    game._init_battle(bu01, rd01)
+    defender = game.defender_legion
+    for creature in defender.creatures:
+        creature.legion = defender
+    for creature in game.attacker_legion.creatures:
+        creature.legion = game.attacker_legion
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    creatures = defender.sorted_creatures
+    start_hexlabels = [creature.hexlabel for creature in creatures]
+    score_movesets = []
+    for ii, creature in enumerate(creatures):
+        score_moves = []
+        for move in game.find_battle_moves(creature):
+            creature.move(move)
+            score = cleverbot._score_legion_move(game, [creature])
+            score_moves.append((score, move))
+        creature.move(start_hexlabels[ii])
+        score_movesets.append(score_moves)
+    budget = Budget("test", time.time() + 60)
+    legion_move = cleverbot._find_best_legion_move(game, creatures,
+                                                   score_movesets, budget)
+    assert len(legion_move) == len(creatures)
+    assert len(set(legion_move)) == len(creatures)
+    for ii, move in enumerate(legion_move):
+        assert move in set(tup[1] for tup in score_movesets[ii])
+    assert [creature.hexlabel for creature in creatures] == start_hexlabels
+
+    # A lone creature gets its best single move.
+    legion_move = cleverbot._find_best_legion_move(game, creatures[:1],
+                                                   score_movesets[:1],
+                                                   budget)
+    assert legion_move == [max(score_movesets[0])[1]]
+
+    # No legion move if two creatures need the same only hex.
+    legion_move = cleverbot._find_best_legion_move(
+        game, creatures[:2], [[(1, "E5")], [(2, "E5")]], budget)
+    assert legion_move is None
+    assert [creature.hexlabel for creature in creatures] == start_hexlabels
+
+
+def test_find_best_legion_moves_exhaustive():
+    game = make_battle_game()
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    cleverbot.processes = 1
+    creatures = game.defender_legion.sorted_creatures[:4]
+    for seed in xrange(3):
+        rand = random.Random(seed)
+        score_movesets = []
+        for creature in creatures:
+            moves = sorted(game.find_battle_moves(creature))
+            score_moves = []
+            for move in rand.sample(moves, 6):
+                game.try_battle_move(creature, move, False)
+                score = cleverbot._score_legion_move(game, [creature])
+                game.undo_battle_try()
+                score_moves.append((score, move))
+            score_movesets.append(score_moves)
+        best_score = None
+        for legion_move in itertools.product(*[
+                [move for unused, move in pairs]
+                for pairs in score_movesets]):
+            if len(set(legion_move)) < len(legion_move):
+                continue
+            for ii, creature in enumerate(creatures):
+                game.try_battle_move(creature, legion_move[ii], False)
+            score = cleverbot._score_legion_move(game, creatures)
+            game.undo_battle_tries()
+            if best_score is None or score > best_score:
+                best_score = score
+        cleverbot.transpositions.clear()
+        best = cleverbot._find_best_legion_moves(
+            game, creatures, score_movesets, Budget("test", time.time() + 60))
+        assert best[0][0] == best_score
+
+
+def test_find_move_order():
+    now = time.time()
+    game = Game.Game("g1", "p0", now, now, 2, 6)
+    game.add_player("p1")
+    player0 = game.players[0]
+    player1 = game.players[1]
+    player0.assign_starting_tower(200)
+    player1.assign_starting_tower(100)
+    game.sort_players()
+    game.started = True
+    game.assign_color("p1", "Blue")
+    game.assign_color("p0", "Red")
+    game.assign_first_marker("p0", "Rd01")
+    game.assign_first_marker("p1", "Bu01")
+    rd01 = player0.markerid_to_legion["Rd01"]
+    bu01 = player1.markerid_to_legion["Bu01"]
+    rd01.move(3, False, None, 5)
+    bu01.move(3, False, None, 5)
+    game._init_battle(bu01, rd01)
+    defender = game.defender_legion
+    for creature in defender.creatures:
+        creature.legion = defender
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    sort_values = {}
+    for creature in defender.creatures:
+        sort_values[creature.name] = creature.sort_value
+    max_score = (sort_values["Titan"] + sort_values["Angel"] +
+                 sort_values["Ogre"])
+
+    # The slow Ogre can only reach E4 through E5 or F4.
+    creature_moves = [
+        ("Titan", "DEFENDER", "E5"),
+        ("Angel", "DEFENDER", "F4"),
+        ("Ogre", "DEFENDER", "E4"),
+    ]
+    assert cleverbot._score_perm(game, sort_values,
+                                 creature_moves) < max_score
+    ordered_creature_moves = cleverbot._find_move_order(game, creature_moves)
+    assert sorted(ordered_creature_moves) == sorted(creature_moves)
+    assert ordered_creature_moves[-1] != ("Ogre", "DEFENDER", "E4")
+    score = cleverbot._score_perm(game, sort_values, ordered_creature_moves)
+    assert abs(score - max_score) < 0.001
+    for creature in defender.creatures:
+        assert creature.hexlabel == "DEFENDER"
+
+
 def test_score_move_scary_pursuer():
     now = time.time()
     game = Game.Game("g1", "p0", now, now, 2, 6)
@@ -865,3 +1020,188 @@ def test_player_info():
     cleverbot = CleverBot.CleverBot("ai1", 1)
     assert cleverbot.player_info.startswith("BotParams(SQUASH=0.6, ")
     assert cleverbot.player_info.endswith(")")
+
+
+class _Unpicklable(object):
+    """An observer that can't be copied, like a network client."""
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def update(self, observed, action, names):
+        pass
+
+
+def test_copy_game():
+    game = make_game(battle=True)
+    rd01 = game.find_legion("Rd01")
+    observer = _Unpicklable()
+    game.add_observer(observer)
+    rd01.add_observer(observer)
+    game2 = CleverBot.copy_game(game)
+    assert game2 is not game
+    assert game2.board is game.board
+    assert game2.battlemap is game.battlemap
+    assert not game2.observers
+    assert game.observers
+    defender = game.defender_legion
+    defender2 = game2.defender_legion
+    assert defender2 is not defender
+    assert defender2.markerid == defender.markerid
+    assert defender2.player is game2.get_player_by_name(
+        defender.player.name)
+    assert ([creature.hexlabel for creature in defender2.creatures] ==
+            [creature.hexlabel for creature in defender.creatures])
+
+    # Moving creatures in the copy doesn't affect the original.
+    creature2 = defender2.creatures[0]
+    move = sorted(game2.find_battle_moves(creature2))[0]
+    game2.try_battle_move(creature2, move)
+    assert creature2.hexlabel == move
+    assert defender.creatures[0].hexlabel == "DEFENDER"
+
+
+def test_maneuver_signature():
+    game = make_game()
+    rd01 = game.find_legion("Rd01")
+    bu01 = game.find_legion("Bu01")
+    cleverbot = CleverBot.CleverBot("p1", 1)
+
+    # The signature of the predicted battle matches the real battle's.
+    game2 = CleverBot.copy_game(game)
+    game2._init_battle(game2.find_legion("Bu01"), game2.find_legion("Rd01"))
+    signature = cleverbot._maneuver_signature(game2)
+    game._init_battle(bu01, rd01)
+    assert cleverbot._maneuver_signature(game) == signature
+
+    # But not if anything differs.
+    game.defender_legion.creatures[0].hits += 1
+    assert cleverbot._maneuver_signature(game) != signature
+
+
+class _SyncCleverBot(CleverBot.CleverBot):
+    """A CleverBot that runs its searches in the calling thread."""
+    def _run_in_worker(self, find, game):
+        cancelled = threading.Event()
+        return defer.maybeDeferred(find, game, cancelled), cancelled
+
+
+def _ponder_game():
+    """Return (game, bot) where bot, defending Rd01, has pondered its
+    first maneuver."""
+    game = make_game(["Ogre", "Centaur", "Gargoyle"],
+                     ["Ogre", "Ogre", "Centaur"])
+    cleverbot = _SyncCleverBot("p0", 1)
+    cleverbot.processes = 1
+    cleverbot._ponder_first_maneuver(game, game.find_legion("Bu01"),
+                                     game.find_legion("Rd01"))
+    assert cleverbot.pondering is not None
+    # Pondering doesn't use the battle turn's time.
+    assert cleverbot.budgets.decisions == 1
+    assert cleverbot.budgets.turn_time_used == 0
+    game._init_battle(game.find_legion("Bu01"), game.find_legion("Rd01"))
+    return game, cleverbot
+
+
+def test_ponder_and_take():
+    game, cleverbot = _ponder_game()
+    def1 = cleverbot._take_pondered(game.name,
+                                    cleverbot._maneuver_signature(game))
+    assert def1 is not None
+    assert cleverbot.pondering is None
+    results = []
+    def1.addCallback(results.append)
+    assert results[0]
+    assert results[0] == cleverbot._find_best_creature_moves(game)
+
+
+def test_ponder_mismatch():
+    game, cleverbot = _ponder_game()
+    game.defender_legion.creatures[0].hits += 1
+    assert cleverbot._take_pondered(
+        game.name, cleverbot._maneuver_signature(game)) is None
+    assert cleverbot.pondering is None
+    assert cleverbot.planning is None
+
+
+def test_legion_move_pool():
+    game = make_game(battle=True)
+    defender = game.defender_legion
+
+    # Pickled games come back the same, sharing the board and battle map.
+    game2 = LegionMovePool.loads_game(LegionMovePool.dumps_game(game))
+    assert game2.battlemap is game.battlemap
+    assert len(game2.board.hexes) == len(game.board.hexes)
+    assert ([creature.name for creature in game2.defender_legion.creatures]
+            == [creature.name for creature in defender.creatures])
+
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    # 6 ** 5 legion moves is big enough to split up, and small enough to
+    # search all of them.
+    creatures = defender.sorted_creatures[:5]
+    score_movesets = []
+    for creature in creatures:
+        score_moves = []
+        for move in game.find_battle_moves(creature):
+            game.try_battle_move(creature, move, False)
+            score = cleverbot._score_legion_move(game, [creature])
+            game.undo_battle_try()
+            score_moves.append((score, move))
+        score_movesets.append(sorted(score_moves, reverse=True)[:6])
+    pool = LegionMovePool.LegionMovePool(2)
+    try:
+        assert not pool.worthwhile(score_movesets[:1])
+        results = pool.search(cleverbot, game, creatures, score_movesets,
+                              Budget("test", time.time() + 60), None, 3)
+        assert len(results) == 3
+        scores = [result[0] for result in results]
+        assert scores == sorted(scores, reverse=True)
+        for score, legion_move, position in results:
+            assert len(set(legion_move)) == len(creatures)
+            for ii, creature in enumerate(creatures):
+                game.try_battle_move(creature, legion_move[ii], False)
+            assert score == cleverbot._score_legion_move(game, creatures)
+            game.undo_battle_tries()
+        # The merge doesn't depend on which worker finishes first.
+        assert results == pool.search(cleverbot, game, creatures,
+                                      score_movesets,
+                                      Budget("test", time.time() + 60),
+                                      None, 3)
+        # Workers hash positions the same way as this process.
+        state = BattleState.from_game(game)
+        slots = BattleState.game_slots(game, creatures)
+        for score, legion_move, position in results:
+            expected = state.hash_for_slots(slots)
+            for ii, move in enumerate(legion_move):
+                expected ^= state.move_hash(slots[ii], move) ^ state.hash
+            assert position == expected
+        # And find the same best legion move as a search in one process.
+        cleverbot2 = CleverBot.CleverBot("p0", 1)
+        results2 = cleverbot2._search_legion_moves(
+            game, creatures, score_movesets,
+            Budget("test", time.time() + 60), None, 3)
+        assert results[0] == results2[0]
+
+        # A cancelled search returns quickly, and doesn't hold up the next
+        # one.
+        cancelled = threading.Event()
+        cancelled.set()
+        budget = Budget("test", time.time() + 60, cancelled=cancelled)
+        pool.search(cleverbot, game, creatures, score_movesets, budget,
+                    None, 3)
+        budget2 = Budget("test", time.time() + 60)
+        assert results == pool.search(cleverbot, game, creatures,
+                                      score_movesets, budget2, None, 3)
+        assert budget.nodes < budget2.nodes
+    finally:
+        pool.close()
+
+
+def test_battle_turn_key():
+    game = make_game(battle=True)
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    key = cleverbot._battle_turn_key(game)
+    assert cleverbot._battle_turn_key(game) == key
+
+    # Each battle turn gets its own time allowance.
+    game.battle_turn += 1
+    assert cleverbot._battle_turn_key(game) != key
@@ -50,6 +50,37 @@ class TestBattle(object):
         assert self.game.battle_active_player == \
             self.game.defender_legion.player
 
+    def test_creatures_in_battle_hex(self):
+        self.rd01.move(6, False, None, 3)
+        self.bu01.move(6, False, None, 3)
+        self.game._init_battle(self.bu01, self.rd01)
+        game = self.game
+        assert len(game.creatures_in_battle_hex("DEFENDER")) == 4
+        assert len(game.creatures_in_battle_hex("ATTACKER")) == 4
+        assert len(game.creatures_in_battle_hex("ATTACKER", "Ogre")) == 1
+        assert not game.creatures_in_battle_hex("D1")
+        assert not game.is_battle_hex_occupied("D1")
+        titan = self.rd01.sorted_creatures[0]
+        titan.move("D1")
+        assert game.creatures_in_battle_hex("D1") == set([titan])
+        assert game.is_battle_hex_occupied("D1")
+        assert len(game.creatures_in_battle_hex("DEFENDER")) == 3
+        titan.undo_move()
+        assert not game.is_battle_hex_occupied("D1")
+        assert len(game.creatures_in_battle_hex("DEFENDER")) == 4
+        # Setting hexlabel directly also keeps the index current.
+        titan.hexlabel = "E2"
+        assert game.creatures_in_battle_hex("E2") == set([titan])
+        titan.hexlabel = "DEFENDER"
+        assert not game.is_battle_hex_occupied("E2")
+        # Creatures not in the battle are not indexed.
+        creature = self.player0.markerid_to_legion["Rd02"].creatures[0]
+        creature.hexlabel = "E2"
+        assert not game.is_battle_hex_occupied("E2")
+        creature.hexlabel = None
+        game._cleanup_battle()
+        assert not game.is_battle_hex_occupied("DEFENDER")
+
     def test_hex_entry_cost(self):
         titan = Creature.Creature("Titan")
         assert self.game.battle_hex_entry_cost(titan, "Bramble", None) == 2
@@ -283,6 +314,111 @@ class TestBattle(object):
                     "E3", "F3"])
         assert self.game.find_battle_moves(gargoyle, True) == set4
 
+    def test_cached_battle_values(self):
+        self.rd01.move(6, False, None, 3)
+        self.bu01.move(6, False, None, 3)
+        self.rd01.add_creature_by_name("Gorgon")
+        game = self.game
+        game._init_battle(self.bu01, self.rd01)
+        titan1 = self.rd01.sorted_creatures[0]
+        gorgon1 = self.rd01.creatures[-1]
+        assert gorgon1.name == "Gorgon"
+        ogre2 = self.bu01.sorted_creatures[3]
+        assert ogre2.name == "Ogre"
+        titan1.hexlabel = "D2"
+        gorgon1.hexlabel = "D5"
+        ogre2.hexlabel = "E3"
+        assert titan1.engaged_enemies == set()
+        assert not titan1.engaged
+        assert gorgon1.potential_rangestrike_targets == set([ogre2])
+        assert gorgon1.rangestrike_targets == set()
+        game.battle_phase = Phase.STRIKE
+        assert gorgon1.rangestrike_targets == set([ogre2])
+        assert gorgon1.can_strike
+        ogre2.hexlabel = "E2"
+        assert titan1.engaged_enemies == set([ogre2])
+        assert titan1.engaged
+        assert titan1.dead_adjacent_enemies == set()
+        ogre2.hits = ogre2.power
+        assert titan1.engaged_enemies == set()
+        assert titan1.dead_adjacent_enemies == set([ogre2])
+        ogre2.hits = 0
+        assert titan1.engaged_enemies == set([ogre2])
+        titan1.hexlabel = "D5"
+        assert titan1.engaged_enemies == set()
+
+    def test_battle_tries(self):
+        self.rd01.move(6, False, None, 3)
+        self.bu01.move(6, False, None, 3)
+        game = self.game
+        game._init_battle(self.bu01, self.rd01)
+        titan1 = self.rd01.sorted_creatures[0]
+        ogre2 = self.bu01.sorted_creatures[3]
+        assert ogre2.name == "Ogre"
+        titan1.hexlabel = "D2"
+        attackers = game.creatures_in_battle_hex("ATTACKER")
+        attacker_order = list(game._battle_hex_to_creatures["ATTACKER"])
+        assert game.battle_try_depth == 0
+
+        game.try_battle_move(ogre2, "E2")
+        assert game.battle_try_depth == 1
+        assert ogre2.hexlabel == "E2"
+        assert ogre2.moved
+        assert ogre2.previous_hexlabel == "ATTACKER"
+        assert game.creatures_in_battle_hex("E2") == set([ogre2])
+        assert titan1.engaged_enemies == set([ogre2])
+        assert "E2" not in game.find_battle_moves(titan1)
+
+        game.try_battle_strike(titan1, ogre2, 2)
+        assert titan1.struck
+        assert ogre2.hits == 2
+        game.try_battle_kill(ogre2)
+        assert ogre2.dead
+        assert titan1.engaged_enemies == set()
+        assert titan1.dead_adjacent_enemies == set([ogre2])
+        assert game.battle_try_depth == 3
+
+        game.undo_battle_try()
+        assert ogre2.hits == 2
+        assert titan1.engaged_enemies == set([ogre2])
+        game.undo_battle_tries()
+        assert game.battle_try_depth == 0
+        assert ogre2.hexlabel == "ATTACKER"
+        assert not ogre2.moved
+        assert ogre2.previous_hexlabel is None
+        assert ogre2.hits == 0
+        assert not titan1.struck
+        assert titan1.engaged_enemies == set()
+        assert not game.is_battle_hex_occupied("E2")
+        assert game.creatures_in_battle_hex("ATTACKER") == attackers
+        assert game._battle_hex_to_creatures["ATTACKER"] == attacker_order
+
+        game.try_battle_move(titan1, "E2", False)
+        assert titan1.hexlabel == "E2"
+        assert not titan1.moved
+        game.undo_battle_try()
+        assert titan1.hexlabel == "D2"
+
+    def test_strike_values(self):
+        self.rd01.move(6, False, None, 3)
+        self.bu01.move(6, False, None, 3)
+        game = self.game
+        game._init_battle(self.bu01, self.rd01)
+        titan1 = self.rd01.sorted_creatures[0]
+        ogre2 = self.bu01.sorted_creatures[3]
+        assert ogre2.name == "Ogre"
+        titan1.hexlabel = "D2"
+        ogre2.hexlabel = "E2"
+        assert titan1.strike_values(ogre2) == (6, 2)
+        assert ogre2.strike_values(titan1) == (6, 6)
+        assert titan1.number_of_dice(ogre2) == 6
+        assert titan1.strike_number(ogre2) == 2
+        # Titan power depends on score.
+        self.player0.score = 100
+        assert titan1.strike_values(ogre2) == (7, 2)
+        ogre2.hexlabel = "E3"
+        assert titan1.strike_values(ogre2) == (0, 2)
+
     def test_strikes_plain(self):
         self.rd01.move(6, False, None, 3)
         self.bu01.move(6, False, None, 3)
@@ -427,9 +563,9 @@ class TestBattle(object):
     def test_strikes_plain2(self):
         rd02 = Legion.Legion(self.player0, "Rd02", Creature.n2c(["Angel",
                                                                  "Ranger"]), 1)
-        self.player0.markerid_to_legion["Rd02"] = rd02
+        self.player0.add_legion(rd02)
         bu02 = Legion.Legion(self.player0, "Bu02", Creature.n2c(["Troll"]), 1)
-        self.player1.markerid_to_legion["Bu02"] = bu02
+        self.player1.add_legion(bu02)
         troll1 = bu02.creatures[0]
         angel1 = rd02.creatures[0]
         ranger1 = rd02.creatures[1]
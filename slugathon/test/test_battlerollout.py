@@ -0,0 +1,48 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import random
+
+from slugathon.ai import CleverBot
+from slugathon.ai.BattleRollout import BattleRollout, DRAW
+from slugathon.ai.BattleState import BattleState, DEFENDER, ATTACKER
+from gamesetup import make_game
+
+
+def test_rollouts():
+    game = make_game(["Ogre", "Centaur", "Gargoyle"],
+                     ["Ogre", "Centaur", "Gargoyle"])
+    attacker = game.find_legion("Bu01")
+    defender = game.find_legion("Rd01")
+    state = BattleState.for_engagement(game, attacker, defender)
+    rollout = BattleRollout(state, random.Random(0))
+    results = rollout.rollouts(50)
+    assert results.count == 50
+    assert sum(results.wins.itervalues()) == 50
+    assert abs(sum(results.win_fraction(side) for side in
+                   [DEFENDER, ATTACKER, DRAW]) - 1.0) < 0.000001
+    for side in [DEFENDER, ATTACKER]:
+        assert 0 <= results.mean_survivor_points(side) <= 2 * 4 + 4 * 4 + 4 * 3
+    # Playouts don't change the starting state.
+    assert state.hash == BattleState.for_engagement(game, attacker,
+                                                    defender).hash
+
+    # The same random numbers give the same results.
+    results2 = BattleRollout(state, random.Random(0)).rollouts(50)
+    assert results2.wins == results.wins
+    assert results2.survivor_points == results.survivor_points
+
+
+def test_lopsided_rollouts():
+    game = make_game(["Ogre"], ["Colossus", "Hydra", "Giant", "Serpent"])
+    attacker = game.find_legion("Bu01")
+    defender = game.find_legion("Rd01")
+    state = BattleState.for_engagement(game, attacker, defender)
+    results = BattleRollout(state, random.Random(1)).rollouts(20)
+    assert results.win_fraction(ATTACKER) > 0.9
+    assert results.mean_survivor_points(DEFENDER) < 1
+
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    assert cleverbot._should_flee(game, attacker, defender)
+    assert not cleverbot._should_flee(game, defender, attacker)
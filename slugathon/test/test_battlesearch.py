@@ -0,0 +1,125 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import time
+import random
+
+from slugathon.ai.BattleState import BattleState, DEFENDER
+from slugathon.ai.BattleSearch import BattleSearch
+from slugathon.ai.Budget import Budget
+from slugathon.ai.ExpectiBot import ExpectiBot
+from slugathon.game import Phase
+from gamesetup import make_battle_game
+
+
+def _place_randomly(game, rand):
+    hexlabels = sorted(hexlabel for hexlabel in game.battlemap.hexes
+                       if hexlabel not in ("ATTACKER", "DEFENDER"))
+    rand.shuffle(hexlabels)
+    for creature in BattleState.game_creatures(game):
+        creature.hexlabel = hexlabels.pop()
+        creature.hits = rand.choice([0, 0, 0, creature.power - 1,
+                                     creature.power])
+        creature.moved = rand.random() < 0.2
+
+
+def _expectimax(search, state, depth):
+    """Return the value of state with plain expectimax, no pruning."""
+    if depth <= 0 or search._over(state):
+        return search.evaluate(state)
+    if state.battle_phase == Phase.STRIKE:
+        total = 0.0
+        for prob, hits in search._strike_outcomes(state):
+            child = state.copy()
+            for slot, new_hits in hits:
+                child.set_hits(slot, new_hits)
+            search._end_strike_phase(child)
+            total += prob * _expectimax(search, child, depth - 1)
+        return total
+    values = [_expectimax(search, child2, depth - 1) for child2 in
+              search._candidate_moves(state)]
+    if state.active_side == search.side:
+        return max(values)
+    return min(values)
+
+
+def _setup(seed):
+    game = make_battle_game()
+    game.battle_turn = 2
+    rand = random.Random(seed)
+    _place_randomly(game, rand)
+    creatures = BattleState.game_creatures(game)
+    for creature in creatures:
+        creature.moved = False
+        if rand.random() < 0.5:
+            creature.hits = creature.power
+    game.battle_active_legion = game.defender_legion
+    state = BattleState.from_game(game)
+    values = [creature.sort_value for creature in creatures]
+    return game, state, values
+
+
+def test_strike_outcomes():
+    for seed in xrange(5):
+        game, state, values = _setup(seed)
+        search = BattleSearch(state, DEFENDER, values,
+                              Budget("test", time.time() + 60))
+        assert search.low <= search.evaluate(state) <= search.high
+        child = state.copy()
+        child.set_phase(child.battle_turn, Phase.STRIKE, DEFENDER)
+        outcomes = search._strike_outcomes(child)
+        assert abs(sum(prob for prob, hits in outcomes) - 1.0) < 0.000001
+        for prob, hits in outcomes:
+            for slot, new_hits in hits:
+                assert state.hits[slot] <= new_hits <= state.powers[slot]
+
+
+def test_choose_matches_expectimax():
+    depth = 4
+    for seed in xrange(3):
+        game, state, values = _setup(seed)
+        search = BattleSearch(state, DEFENDER, values,
+                              Budget("test", time.time() + 60))
+        if search._over(state):
+            continue
+        slots = [slot for slot in state.slots(DEFENDER)
+                 if not state.dead(slot)]
+        legion_moves = [[state.hexlabel(slot) for slot in slots]]
+        for child in search._candidate_moves(state):
+            legion_moves.append([child.hexlabel(slot) for slot in slots])
+        index = search.choose(slots, legion_moves, depth)
+        assert len(search.table)
+        values = []
+        for legion_move in legion_moves:
+            child = state.copy()
+            for ii, slot in enumerate(slots):
+                if child.hexlabel(slot) != legion_move[ii]:
+                    child.move(slot, legion_move[ii])
+            child.set_phase(child.battle_turn, Phase.STRIKE, DEFENDER)
+            values.append(_expectimax(search, child, depth - 1))
+        assert abs(values[index] - max(values)) < 0.000001
+
+
+def test_expectibot_find_best_legion_move():
+    game, state, values = _setup(0)
+    expectibot = ExpectiBot("p0", 1)
+    legion = game.defender_legion
+    creatures = legion.sorted_living_creatures
+    start_hexlabels = [creature.hexlabel for creature in creatures]
+    score_movesets = []
+    for creature in creatures:
+        score_moves = [(0, creature.hexlabel)]
+        for move in game.find_battle_moves(creature):
+            game.try_battle_move(creature, move, False)
+            score = expectibot._score_legion_move(game, [creature])
+            game.undo_battle_try()
+            score_moves.append((score, move))
+        score_movesets.append(score_moves)
+    legion_move = expectibot._find_best_legion_move(game, creatures,
+                                                    score_movesets,
+                                                    Budget("test",
+                                                           time.time() + 5))
+    assert len(legion_move) == len(creatures)
+    assert len(set(legion_move)) == len(creatures)
+    assert [creature.hexlabel for creature in creatures] == start_hexlabels
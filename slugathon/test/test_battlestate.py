@@ -0,0 +1,160 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import multiprocessing
+import random
+
+from slugathon.ai.BattleState import (BattleState, DEFENDER, ATTACKER,
+                                      zobrist_key)
+from slugathon.game import Phase
+from gamesetup import make_battle_game
+
+
+def _place_randomly(game, rand):
+    hexlabels = sorted(hexlabel for hexlabel in game.battlemap.hexes
+                       if hexlabel not in ("ATTACKER", "DEFENDER"))
+    rand.shuffle(hexlabels)
+    for creature in BattleState.game_creatures(game):
+        creature.hexlabel = hexlabels.pop()
+        creature.hits = rand.choice([0, 0, 0, creature.power - 1,
+                                     creature.power])
+        creature.moved = rand.random() < 0.2
+
+
+def _compare(game, state):
+    creatures = BattleState.game_creatures(game)
+    assert len(state) == len(creatures)
+    for slot, creature in enumerate(creatures):
+        assert state.names[slot] == creature.name
+        assert state.hexlabel(slot) == creature.hexlabel
+        assert state.dead(slot) == creature.dead
+        assert state.offboard(slot) == creature.offboard
+        engaged = set(creatures[slot2] for slot2 in
+                      state.engaged_enemies(slot))
+        assert engaged == set(creature.engaged_enemies)
+        assert state.mobile(slot) == creature.mobile
+        for ignore_mobile_allies in [False, True]:
+            assert (state.find_moves(slot, ignore_mobile_allies) ==
+                    game.find_battle_moves(creature, ignore_mobile_allies))
+        targets = set(creatures[slot2] for slot2 in
+                      state.potential_rangestrike_targets(slot))
+        assert targets == set(creature.potential_rangestrike_targets)
+        for slot2, creature2 in enumerate(creatures):
+            if (state.sides[slot2] != state.sides[slot] and
+               state.onboard(slot) and state.onboard(slot2)):
+                assert (state.strike_values(slot, slot2) ==
+                        creature.strike_values(creature2))
+
+
+def test_from_game():
+    game = make_battle_game()
+    state = BattleState.from_game(game)
+    defender = game.defender_legion
+    attacker = game.attacker_legion
+    assert len(state) == len(defender) + len(attacker)
+    assert state.slots(DEFENDER) == range(len(defender))
+    assert state.slots(ATTACKER) == range(len(defender), len(state))
+    assert state.battle_phase == Phase.MANEUVER
+    assert state.is_occupied("DEFENDER")
+    assert state.is_occupied("ATTACKER")
+    assert not state.is_occupied("D4")
+    _compare(game, state)
+
+
+def test_random_placements():
+    game = make_battle_game()
+    rand = random.Random(12)
+    game.battle_turn = 2
+    for unused in xrange(30):
+        _place_randomly(game, rand)
+        state = BattleState.from_game(game)
+        _compare(game, state)
+
+
+def test_move_and_apply():
+    game = make_battle_game()
+    game.battle_turn = 2
+    defender = game.defender_legion
+    for creature, hexlabel in zip(defender.sorted_creatures,
+                                  ["E5", "D5", "D6", "C5", "E4", "F4"]):
+        creature.hexlabel = hexlabel
+    state = BattleState.from_game(game)
+    state2 = state.copy()
+    attacker_slots = state.slots(ATTACKER)
+    slot = attacker_slots[0]
+    moves = state2.find_moves(slot)
+    assert moves
+    hexlabel = sorted(moves)[0]
+    state2.move(slot, hexlabel)
+    assert state2.moved[slot]
+    assert state2.is_occupied(hexlabel)
+    assert not state2.find_moves(slot)
+    # The original state and game are unchanged.
+    assert not state.moved[slot]
+    assert not state.is_occupied(hexlabel)
+    creature = BattleState.game_creatures(game)[slot]
+    assert creature.hexlabel == "ATTACKER"
+    slot2 = state.slots(DEFENDER)[0]
+    state2.set_hits(slot2, 2)
+    state2.apply_to_game(game)
+    assert creature.hexlabel == hexlabel
+    assert creature.moved
+    assert BattleState.game_creatures(game)[slot2].hits == 2
+    _compare(game, state2)
+
+
+def test_hash():
+    game = make_battle_game()
+    game.battle_turn = 2
+    state = BattleState.from_game(game)
+    assert state.hash == state.copy().hash
+    slot1, slot2 = [slot for slot in state.slots(ATTACKER)
+                    if state.names[slot] == "Ogre"]
+    hash1 = state.move_hash(slot1, "A1")
+    hash2 = state.move_hash(slot2, "A2")
+    state2 = state.copy()
+    state2.place(slot1, "A1")
+    assert state2.hash == hash1
+    state2.place(slot2, "A2")
+    assert state2.hash == hash1 ^ hash2 ^ state.hash
+    assert state2.hash == state2._compute_hash()
+    # Swapping identical creatures gives the same position.
+    state3 = state.copy()
+    state3.place(slot1, "A2")
+    state3.place(slot2, "A1")
+    assert state3.hash == state2.hash
+    state3.move(slot1, "A3")
+    assert state3.hash != state2.hash
+    state3.set_hits(slot2, 1)
+    state3.set_struck(slot2)
+    assert state3.hash == state3._compute_hash()
+    state3.place(slot1, "ATTACKER")
+    state3.place(slot2, "ATTACKER")
+    assert state3.hash != state.hash
+    assert (state.hash_for_slots([slot1]) !=
+            state.hash_for_slots([slot1, slot2]))
+    assert state.hash_for_slots([slot1]) == state.hash_for_slots([slot1])
+
+
+def test_zobrist_keys_agree_across_processes():
+    features = [("Ogre", ATTACKER, 6, ii, 0, 0, 0) for ii in xrange(20)]
+    pool = multiprocessing.Pool(1)
+    try:
+        # The worker computes these keys before this process does.
+        keys = pool.map(zobrist_key, features)
+    finally:
+        pool.terminate()
+    assert keys == [zobrist_key(feature) for feature in features]
+    assert len(set(keys)) == len(keys)
+
+
+def test_for_engagement():
+    game = make_battle_game()
+    state = BattleState.for_engagement(game, game.attacker_legion,
+                                       game.defender_legion)
+    assert state.hash == BattleState.from_game(game).hash
+    assert state.battle_turn == 1
+    assert state.battle_phase == Phase.MANEUVER
+    assert state.active_side == DEFENDER
+    _compare(game, state)
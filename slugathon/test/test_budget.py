@@ -0,0 +1,116 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import threading
+
+from slugathon.ai import Budget
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_budget():
+    clock = FakeClock()
+    budget = Budget.Budget("decision", clock.now + 10, clock=clock)
+    assert budget.remaining == 10
+    assert not budget.time_up()
+    child = budget.slice("child", 0.5)
+    assert child.finish_time == clock.now + 5
+    child.add_nodes(3)
+    assert child.nodes == 3
+    assert budget.nodes == 3
+    clock.now += 5
+    assert child.time_up()
+    assert child.expired
+    assert not budget.time_up()
+    assert budget.elapsed == 5
+    clock.now += 6
+    assert budget.time_up()
+    assert budget.remaining == 0
+    # A slice of an expired budget is expired too.
+    assert budget.slice("late").time_up()
+
+
+def test_budget_manager():
+    clock = FakeClock()
+    manager = Budget.BudgetManager(10, clock)
+    budget = manager.decision("move", 1)
+    assert (budget.finish_time - clock.now ==
+            Budget.SAFETY_FRACTION * 10)
+    child = budget.slice("search")
+    clock.now += 9
+    assert child.time_up()
+    manager.finish(budget)
+    assert manager.decisions == 1
+    assert manager.limits_hit["search"] == 1
+    assert manager.turn_time_used == 9
+
+    # Overrunning the budget shrinks later budgets.
+    budget = manager.decision("move", 1)
+    clock.now += 20
+    manager.finish(budget)
+    assert manager.scale == Budget.SHRINK_FACTOR
+    budget = manager.decision("move", 1)
+    assert (budget.finish_time - clock.now ==
+            Budget.SHRINK_FACTOR * Budget.SAFETY_FRACTION * 10)
+    clock.now += 15
+    manager.finish(budget)
+
+    # The turn's time is used up, so only the minimum is left.
+    scale = Budget.SHRINK_FACTOR ** 2
+    assert manager.scale == scale
+    budget = manager.decision("move", 1)
+    assert (budget.finish_time - clock.now ==
+            Budget.MIN_FRACTION * 10)
+    manager.finish(budget)
+
+    # A new turn gets its time back, and finishing in time grows the
+    # scale again.
+    scale *= Budget.GROW_FACTOR
+    assert manager.scale == scale
+    budget = manager.decision("move", 2)
+    assert abs(budget.finish_time - clock.now -
+               scale * Budget.SAFETY_FRACTION * 10) < 0.000001
+
+
+def test_budget_manager_cancelled():
+    clock = FakeClock()
+    manager = Budget.BudgetManager(10, clock)
+    cancelled = threading.Event()
+    budget = manager.decision("move", 1, cancelled)
+    child = budget.slice("search")
+    assert not child.time_up()
+    # Each decision has its own Event.
+    other_budget = manager.decision("move", 1, threading.Event())
+    cancelled.set()
+    assert child.time_up()
+    assert budget.time_up()
+    assert not other_budget.time_up()
+    manager.finish(budget)
+    assert not manager.limits_hit
+
+
+def test_budget_manager_uncharged():
+    clock = FakeClock()
+    manager = Budget.BudgetManager(10, clock)
+    budget = manager.decision("move", 1)
+    clock.now += 39.5
+    manager.finish(budget)
+
+    # Pondering isn't limited by the turn's time, and doesn't use it.
+    budget = manager.decision("ponder", 2, charge=False)
+    assert (budget.finish_time - clock.now ==
+            manager.scale * Budget.SAFETY_FRACTION * 10)
+    clock.now += 5
+    manager.finish(budget)
+    assert manager.turn == 1
+    assert manager.turn_time_used == 39.5
+    budget = manager.decision("move", 1)
+    assert (budget.finish_time - clock.now ==
+            Budget.MIN_FRACTION * 10)
@@ -0,0 +1,114 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import tempfile
+
+from slugathon.ai import CleverBot
+from slugathon.ai.EngagementOdds import (EngagementOdds, Odds, ALL_SIDES,
+                                         build_odds, write_odds,
+                                         engagement_key, open_odds,
+                                         common_compositions)
+from slugathon.game import Game
+from gamesetup import make_game
+
+
+titan_legion = ("Centaur", "Gargoyle", "Ogre", "Titan")
+angel_legion = ("Angel", "Gargoyle", "Gargoyle", "Ogre")
+
+
+def test_common_compositions():
+    compositions = common_compositions()
+    assert len(compositions) == 14
+    assert titan_legion in compositions
+    assert angel_legion in compositions
+    for names in compositions:
+        assert len(names) == 4
+        assert list(names) == sorted(names)
+
+
+def test_build_and_lookup():
+    records = build_odds([titan_legion, angel_legion], ["Plains", "Tower"],
+                         rollouts=4, seed=1)
+    # 4 matchups, with 3 sides plus ALL_SIDES in Plains and 1 side plus
+    # ALL_SIDES in the Tower
+    assert len(records) == 4 * 4 + 4 * 2
+    with tempfile.NamedTemporaryFile(prefix="slugathon",
+                                     delete=True) as tmp_file:
+        path = tmp_file.name
+        write_odds(path, records)
+        odds = EngagementOdds(path)
+        assert len(odds) == len(records)
+        for entry_side in [1, 3, 5, ALL_SIDES]:
+            result = odds.lookup("Plains", entry_side, titan_legion,
+                                 angel_legion)
+            assert result is not None
+            assert 0 <= result.attacker_wins <= 1
+            assert 0 <= result.defender_wins <= 1
+            assert result.attacker_wins + result.defender_wins <= 1.00001
+            assert result.attacker_points >= 0
+            assert result.defender_points >= 0
+        # Creature order doesn't matter.
+        assert (odds.lookup("Plains", 1, reversed(titan_legion),
+                            angel_legion) ==
+                odds.lookup("Plains", 1, titan_legion, angel_legion))
+        assert odds.lookup("Tower", 5, angel_legion, angel_legion)
+        assert odds.lookup("Tower", 1, angel_legion, angel_legion) is None
+        assert odds.lookup("Brush", 1, angel_legion, angel_legion) is None
+        assert odds.lookup("Plains", 1, ["Titan"], angel_legion) is None
+        odds.close()
+
+
+def test_open_odds_bad_file():
+    with tempfile.NamedTemporaryFile(prefix="slugathon",
+                                     delete=True) as tmp_file:
+        tmp_file.write("not an odds table")
+        tmp_file.flush()
+        assert open_odds(tmp_file.name) is None
+
+
+def test_cleverbot_uses_odds():
+    game = make_game(angel_legion, titan_legion)
+    attacker = game.find_legion("Bu01")
+    defender = game.find_legion("Rd01")
+    mterrain = game.board.hexes[3].terrain
+    key = engagement_key(mterrain, 5, titan_legion, angel_legion)
+    with tempfile.NamedTemporaryFile(prefix="slugathon",
+                                     delete=True) as tmp_file:
+        path = tmp_file.name
+        # The defender can't win.
+        write_odds(path, {key: Odds(1.0, 0.0, 20.0, 0.0)})
+        cleverbot = CleverBot.CleverBot("p0", 1, odds=EngagementOdds(path))
+        assert cleverbot._lookup_odds(attacker, defender, 3, 5) == Odds(
+            1.0, 0.0, 20.0, 0.0)
+        assert cleverbot._lookup_odds(attacker, defender, 3,
+                                      ALL_SIDES) is None
+        assert cleverbot._should_flee(game, attacker, defender)
+
+        # The defender always wins.
+        write_odds(path, {key: Odds(0.0, 1.0, 0.0, 20.0)})
+        cleverbot = CleverBot.CleverBot("p0", 1, odds=EngagementOdds(path))
+        assert not cleverbot._should_flee(game, attacker, defender)
+
+
+def test_cleverbot_odds_special_cases():
+    game = make_game(angel_legion, titan_legion)
+    attacker = game.find_legion("Bu01")
+    defender = game.find_legion("Rd01")
+    mterrain = game.board.hexes[3].terrain
+    key = engagement_key(mterrain, ALL_SIDES, titan_legion, angel_legion)
+    with tempfile.NamedTemporaryFile(prefix="slugathon",
+                                     delete=True) as tmp_file:
+        path = tmp_file.name
+        write_odds(path, {key: Odds(0.5, 0.5, 10.0, 10.0)})
+        cleverbot = CleverBot.CleverBot("p0", 1, odds=EngagementOdds(path))
+        # A titan teleport's entry side isn't known yet.
+        assert cleverbot._lookup_odds(attacker, defender, 3,
+                                      Game.TELEPORT) == Odds(
+            0.5, 0.5, 10.0, 10.0)
+        # The table doesn't cover titans that have grown.
+        attacker.player.score = 200
+        assert cleverbot._lookup_odds(attacker, defender, 3,
+                                      Game.TELEPORT) is None
+        assert cleverbot._lookup_odds(attacker, defender, 3,
+                                      ALL_SIDES) is None
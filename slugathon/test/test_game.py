@@ -4,8 +4,64 @@ __license__ = "GNU GPL v2"
 
 import time
 import logging
+import random
 
 from slugathon.game import Game
+from slugathon.game.Game import ARCHES_AND_ARROWS, ARROWS_ONLY, opposite
+
+
+def _find_normal_moves_recursive(legion, masterhex, roll, block=None,
+                                 came_from=None):
+    """The original recursive version of Game.find_normal_moves."""
+    if block is None:
+        block = masterhex.find_block()
+        if block is None:
+            block = ARCHES_AND_ARROWS
+    moves = set()
+    hexlabel = masterhex.label
+    player = legion.player
+    if player.enemy_legions(hexlabel):
+        if not player.friendly_legions(hexlabel):
+            moves.add((hexlabel, masterhex.find_entry_side(came_from)))
+    elif roll == 0:
+        allies = set(player.friendly_legions(hexlabel))
+        allies.discard(legion)
+        if not allies:
+            moves.add((hexlabel, masterhex.find_entry_side(came_from)))
+    elif block >= 0:
+        moves.update(_find_normal_moves_recursive(
+            legion, masterhex.neighbors[block], roll - 1, ARROWS_ONLY,
+            opposite(block)))
+    else:
+        if block == ARCHES_AND_ARROWS:
+            gates = ("ARCH", "ARROW", "ARROWS")
+        else:
+            gates = ("ARROW", "ARROWS")
+        for direction, gate in enumerate(masterhex.exits):
+            if gate in gates and direction != came_from:
+                moves.update(_find_normal_moves_recursive(
+                    legion, masterhex.neighbors[direction], roll - 1,
+                    ARROWS_ONLY, opposite(direction)))
+    return moves
+
+
+def _find_nearby_empty_hexes_recursive(game, masterhex, roll,
+                                       came_from=None):
+    """The original recursive version of Game.find_nearby_empty_hexes."""
+    hexlabel = masterhex.label
+    moves = set()
+    if not game.all_legions(hexlabel):
+        moves.add((hexlabel, Game.TELEPORT))
+    if roll > 0:
+        for direction, gate in enumerate(masterhex.exits):
+            if direction != came_from:
+                neighbor = masterhex.neighbors[direction]
+                if neighbor and (
+                        gate != "NONE" or
+                        neighbor.exits[opposite(direction)] != "NONE"):
+                    moves.update(_find_nearby_empty_hexes_recursive(
+                        game, neighbor, roll - 1, opposite(direction)))
+    return moves
 
 
 class TestGame(object):
@@ -62,6 +118,65 @@ class TestGame(object):
         moves = self.game.find_normal_moves(legion, masterhex, 6)
         assert moves == set([(15, 1), (11, 5), (103, 5)])
 
+    def test_legion_index(self):
+        game = self.game
+        player0 = game.players[0]
+        player1 = game.players[1]
+
+        def check():
+            for hexlabel in game.board.hexes:
+                legions = set(legion for player in game.players
+                              for legion in player.legions
+                              if legion.hexlabel == hexlabel)
+                assert game.legions_in_hex(hexlabel) == legions
+                assert player0.friendly_legions(hexlabel) == set(
+                    legion for legion in legions if legion.player is player0)
+                assert player0.enemy_legions(hexlabel) == set(
+                    legion for legion in legions if legion.player is player1)
+
+        check()
+        rd01 = player0.markerid_to_legion["Rd01"]
+        rd02 = player0.markerid_to_legion["Rd02"]
+        bu01 = player1.markerid_to_legion["Bu01"]
+        rd02.move(6, False, None, 5)
+        check()
+        assert game.all_legions(6) == set([rd02])
+        bu01.move(6, False, None, 1)
+        check()
+        assert game.engagement_hexlabels == set([6])
+        assert rd02.engaged and bu01.engaged and not rd01.engaged
+        bu01.undo_move()
+        check()
+        assert not game.engagement_hexlabels
+        player0.undo_split("Rd01", "Rd02")
+        check()
+        assert game.legions_in_hex(6) == set()
+        player1.remove_legion("Bu01")
+        check()
+        assert not player0.enemy_legions()
+
+    def test_find_normal_moves_matches_recursive(self):
+        game = self.game
+        player = game.players[0]
+        legion1 = player.markerid_to_legion["Rd01"]
+        legion2 = player.markerid_to_legion["Rd02"]
+        legion3 = game.players[1].markerid_to_legion["Bu01"]
+        hexlabels = sorted(game.board.hexes)
+        rand = random.Random(0)
+        try:
+            for hexlabel in hexlabels:
+                legion1.hexlabel = hexlabel
+                masterhex = game.board.hexes[hexlabel]
+                for roll in xrange(1, 6 + 1):
+                    legion2.hexlabel = rand.choice(hexlabels)
+                    legion3.hexlabel = rand.choice(hexlabels)
+                    assert (game.find_normal_moves(legion1, masterhex, roll)
+                            == _find_normal_moves_recursive(legion1,
+                                                            masterhex, roll))
+        finally:
+            for legion in [legion1, legion2, legion3]:
+                legion.hexlabel = legion.previous_hexlabel
+
     def test_find_normal_moves2(self):
         game = self.game
         player = self.game.players[0]
@@ -127,6 +242,51 @@ class TestGame(object):
                                  113, 114, 115, 300, 400, 500, 600, 1000, 2000,
                                  3000, 4000, 6000])
 
+    def test_find_tower_teleport_hexlabels(self):
+        board = self.game.board
+        tower_hexlabels = set(board.get_tower_labels())
+        for hexlabel in tower_hexlabels:
+            hexlabels = Game.find_tower_teleport_hexlabels(
+                board.hexes[hexlabel])
+            # A legion can't teleport to the tower it's leaving.
+            assert hexlabel not in hexlabels
+            assert tower_hexlabels - set([hexlabel]) <= hexlabels
+
+    def test_find_tower_teleport_moves_matches_recursive(self):
+        game = self.game
+        player = game.players[0]
+        legion1 = player.markerid_to_legion["Rd01"]
+        legion2 = player.markerid_to_legion["Rd02"]
+        legion3 = game.players[1].markerid_to_legion["Bu01"]
+        hexlabels = sorted(game.board.hexes)
+        tower_hexlabels = game.board.get_tower_labels()
+        rand = random.Random(0)
+        try:
+            for hexlabel in hexlabels:
+                masterhex = game.board.hexes[hexlabel]
+                for roll in xrange(0, 4):
+                    assert (game.find_nearby_empty_hexes(legion1, masterhex,
+                                                         roll) ==
+                            _find_nearby_empty_hexes_recursive(
+                                game, masterhex, roll))
+            for hexlabel in tower_hexlabels:
+                legion1.hexlabel = hexlabel
+                masterhex = game.board.hexes[hexlabel]
+                for unused in xrange(5):
+                    legion2.hexlabel = rand.choice(tower_hexlabels + hexlabels)
+                    legion3.hexlabel = rand.choice(tower_hexlabels + hexlabels)
+                    expected = _find_nearby_empty_hexes_recursive(
+                        game, masterhex, 6)
+                    for hexlabel2 in tower_hexlabels:
+                        if (hexlabel2 != hexlabel and
+                                not game.all_legions(hexlabel2)):
+                            expected.add((hexlabel2, Game.TELEPORT))
+                    assert (game.find_tower_teleport_moves(legion1, masterhex)
+                            == expected)
+        finally:
+            for legion in [legion1, legion2, legion3]:
+                legion.hexlabel = legion.previous_hexlabel
+
     def test_find_all_moves(self):
         game = self.game
         player = game.players[0]
@@ -0,0 +1,104 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+from slugathon.ai import hitodds
+
+
+EPSILON = 0.000001
+
+
+def test_hit_distribution():
+    assert hitodds.hit_distribution(0, 4) == (1.0,)
+    distribution = hitodds.hit_distribution(2, 4)
+    assert len(distribution) == 3
+    assert abs(distribution[0] - 0.25) < EPSILON
+    assert abs(distribution[1] - 0.5) < EPSILON
+    assert abs(distribution[2] - 0.25) < EPSILON
+    distribution = hitodds.hit_distribution(3, 6)
+    assert abs(distribution[3] - 1 / 216.) < EPSILON
+    assert abs(sum(distribution) - 1.0) < EPSILON
+    assert hitodds.hit_distribution(3, 6) is distribution
+    # Strike numbers are clamped to 1..6
+    assert hitodds.hit_distribution(2, 1) == (0.0, 0.0, 1.0)
+    assert hitodds.hit_distribution(2, 0) == (0.0, 0.0, 1.0)
+    assert hitodds.hit_distribution(4, 7) == hitodds.hit_distribution(4, 6)
+
+
+def test_mean_hits():
+    assert abs(hitodds.mean_hits(6, 4) - 3.0) < EPSILON
+    assert abs(hitodds.mean_hits(9, 5) - 3.0) < EPSILON
+    assert hitodds.mean_hits(0, 2) == 0
+
+
+def test_kill_probability():
+    assert hitodds.kill_probability(2, 4, 0) == 1.0
+    assert abs(hitodds.kill_probability(2, 4, 1) - 0.75) < EPSILON
+    assert abs(hitodds.kill_probability(2, 4, 2) - 0.25) < EPSILON
+    assert hitodds.kill_probability(2, 4, 3) == 0.0
+    # Mean hits 3, but only about a third of the time 4 or more.
+    assert abs(hitodds.kill_probability(6, 4, 4) - 22 / 64.) < EPSILON
+
+
+def test_carry_probability():
+    assert abs(hitodds.carry_probability(2, 4, 1) - 0.25) < EPSILON
+    assert hitodds.carry_probability(2, 4, 2) == 0.0
+    assert abs(hitodds.carry_probability(2, 4, 0) - 0.75) < EPSILON
+
+
+def test_mean_damage():
+    assert abs(hitodds.mean_damage(2, 4, 1) - 0.75) < EPSILON
+    assert abs(hitodds.mean_damage(2, 4, 2) - 1.0) < EPSILON
+    assert abs(hitodds.mean_damage(2, 4, 5) - 1.0) < EPSILON
+    assert hitodds.mean_damage(2, 4, 0) == 0.0
+    assert abs(hitodds.mean_carries(2, 4, 1) - 0.25) < EPSILON
+
+
+def test_add_distributions():
+    distribution = hitodds.add_distributions(hitodds.hit_distribution(1, 4),
+                                             hitodds.hit_distribution(1, 4))
+    expected = hitodds.hit_distribution(2, 4)
+    assert len(distribution) == len(expected)
+    for odds, expected_odds in zip(distribution, expected):
+        assert abs(odds - expected_odds) < EPSILON
+
+    distribution = hitodds.add_distributions(hitodds.hit_distribution(3, 4),
+                                             hitodds.hit_distribution(3, 3),
+                                             2)
+    assert len(distribution) == 3
+    assert abs(sum(distribution) - 1.0) < EPSILON
+    full = hitodds.add_distributions(hitodds.hit_distribution(3, 4),
+                                     hitodds.hit_distribution(3, 3))
+    assert abs(hitodds.probability_at_least(distribution, 2) -
+               hitodds.probability_at_least(full, 2)) < EPSILON
+    assert hitodds.probability_at_least(distribution, 0) == 1.0
+
+
+def test_combined_distribution():
+    strikes = [(3, 4), (3, 3), (2, 5)]
+    full = (1.0,)
+    for dice, strike_number in strikes:
+        full = hitodds.add_distributions(
+            full, hitodds.hit_distribution(dice, strike_number))
+    distribution = hitodds.combined_distribution(strikes, 4)
+    assert len(distribution) == 5
+    assert abs(sum(distribution) - 1.0) < EPSILON
+    # Cached, and independent of the order of the strikes.
+    assert hitodds.combined_distribution(list(reversed(strikes)),
+                                         4) is distribution
+    for hits_left in xrange(10):
+        assert abs(hitodds.combined_kill_probability(strikes, hits_left) -
+                   hitodds.probability_at_least(full, hits_left)) < EPSILON
+    assert (hitodds.combined_kill_probability([(3, 4)], 2) ==
+            hitodds.kill_probability(3, 4, 2))
+    assert hitodds.combined_kill_probability([], 1) == 0.0
+    assert hitodds.combined_kill_probability([], 0) == 1.0
+
+
+def test_likely():
+    assert hitodds.likely(0.5)
+    assert hitodds.likely(0.5 - 1e-12)
+    assert hitodds.likely(1.0)
+    assert not hitodds.likely(0.49)
+    assert hitodds.likely(hitodds.kill_probability(1, 4, 1))
+    assert not hitodds.likely(hitodds.kill_probability(6, 4, 4))
@@ -187,6 +187,27 @@ def test_range():
     assert map1.range("A1", "ATTACKER", True) == 7
     assert map1.range("A1", "DEFENDER", True) == 2
     assert map1.range("DEFENDER", "A1", True) == 2
+    assert map1.range("A1", "G1") == maxint
+    assert map1.range("ATTACKER", "DEFENDER", True) == maxint
+
+
+def test_range_symmetric():
+    for map_ in [map1, map2, map3, map4, map5]:
+        for hexlabel1 in BattleMap.all_labels:
+            for hexlabel2 in BattleMap.all_labels:
+                for allow_entrance in [False, True]:
+                    assert (map_.range(hexlabel1, hexlabel2, allow_entrance)
+                            == map_.range(hexlabel2, hexlabel1,
+                                          allow_entrance))
+
+
+def test_get_battlemap():
+    map6 = BattleMap.get_battlemap("Mountains", 1)
+    assert map6.mterrain == "Mountains"
+    assert map6.entry_side == 1
+    assert BattleMap.get_battlemap("Mountains", 1) is map6
+    assert BattleMap.get_battlemap("Mountains", 3) is not map6
+    assert BattleMap.get_battlemap("Tower", 1) is not map6
 
 
 def test_opposite_border():
@@ -265,6 +286,40 @@ def test_is_los_blocked():
     assert not map5.is_los_blocked("E2", "E2", None)
 
 
+class OccupiedHexes(object):
+    def __init__(self, hexlabels):
+        self.hexlabels = set(hexlabels)
+
+    def is_battle_hex_occupied(self, hexlabel):
+        return hexlabel in self.hexlabels
+
+
+def test_is_los_blocked_by_creatures():
+    # Mountains
+    assert not map1.is_los_blocked("D5", "F2", OccupiedHexes([]))
+    assert map1.is_los_blocked("D5", "F2", OccupiedHexes(["E4"]))
+    assert map1.is_los_blocked("D5", "F2", OccupiedHexes(["E3"]))
+    assert not map1.is_los_blocked("D5", "F2", OccupiedHexes(["D5", "F2"]))
+    assert map1.is_los_blocked("D5", "E3", OccupiedHexes(["E4"]))
+    assert not map1.is_los_blocked("D5", "E3", OccupiedHexes(["E5"]))
+    # The creature in C3 is below the line of sight.
+    assert not map1.is_los_blocked("B2", "D4", OccupiedHexes(["C3"]))
+    # Asking again gives the same answers.
+    assert map1.is_los_blocked("D5", "F2", OccupiedHexes(["E3"]))
+    assert not map1.is_los_blocked("D5", "F2", None)
+
+
+def test_count_bramble_hexes():
+    # Brush
+    assert map3.count_bramble_hexes("C4", "C4", None) == 0
+    assert map3.count_bramble_hexes("C4", "D6", None) == 0
+    assert map3.count_bramble_hexes("B3", "E4", None) == 1
+    assert map3.count_bramble_hexes("B3", "E5", None) == 2
+    assert map3.count_bramble_hexes("B3", "E5", OccupiedHexes(["E4"])) == 2
+    # Blocked by a creature
+    assert map3.count_bramble_hexes("B3", "E5", OccupiedHexes(["D5"])) == 0
+
+
 def test_battlehex_repr():
     assert repr(hex1) == "BattleHex A2 (5, 2)"
 
@@ -0,0 +1,94 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import random
+
+from slugathon.ai.ThreatMap import ThreatMap
+from slugathon.game import Action
+from gamesetup import make_scattered_game
+
+
+def _brute_force_rolls(game, mover, hexlabel, target):
+    """Return the set of rolls with which mover could reach target if
+    target were in hexlabel, the slow way."""
+    previous_hexlabel = target.hexlabel
+    target.hexlabel = hexlabel
+    try:
+        rolls = set()
+        for roll in xrange(1, 6 + 1):
+            moves = game.find_normal_moves(mover,
+                                           game.board.hexes[mover.hexlabel],
+                                           roll).union(
+                game.find_titan_teleport_moves(mover))
+            if hexlabel in set(move[0] for move in moves):
+                rolls.add(roll)
+        return rolls
+    finally:
+        target.hexlabel = previous_hexlabel
+
+
+def _check(game, threat_map, rand, count):
+    legions = sorted(game.all_legions())
+    hexlabels = sorted(game.board.hexes)
+    for unused in xrange(count):
+        mover = rand.choice(legions)
+        target = rand.choice(list(mover.player.enemy_legions()))
+        if rand.random() < 0.3:
+            hexlabel = target.hexlabel
+        else:
+            hexlabel = rand.choice(hexlabels)
+        assert (threat_map.rolls(mover, hexlabel, target) ==
+                _brute_force_rolls(game, mover, hexlabel, target))
+
+
+def test_rolls_match_find_normal_moves():
+    for seed in xrange(3):
+        rand = random.Random(seed)
+        game = make_scattered_game(rand)
+        threat_map = ThreatMap(game)
+        _check(game, threat_map, rand, 300)
+        assert threat_map.searches
+
+
+def test_titan_teleport():
+    rand = random.Random(0)
+    game = make_scattered_game(rand)
+    player = game.players[0]
+    player.score = 400
+    threat_map = ThreatMap(game)
+    titan_legion = player.markerid_to_legion["Rd01"]
+    other_legion = player.markerid_to_legion["Rd02"]
+    enemy = game.players[1].markerid_to_legion["Bu02"]
+    for hexlabel in game.board.hexes:
+        rolls = threat_map.rolls(titan_legion, hexlabel, enemy)
+        if player.friendly_legions(hexlabel):
+            assert not rolls
+        else:
+            assert rolls == set(xrange(1, 7))
+        assert (threat_map.rolls(other_legion, hexlabel, enemy) ==
+                _brute_force_rolls(game, other_legion, hexlabel, enemy))
+
+
+def test_sync():
+    rand = random.Random(1)
+    game = make_scattered_game(rand)
+    threat_map = ThreatMap(game)
+    _check(game, threat_map, rand, 100)
+    hexlabels = sorted(game.board.hexes)
+    for unused in xrange(10):
+        # Move a legion, and tell the ThreatMap with an action.
+        legion = rand.choice(sorted(game.all_legions()))
+        previous_hexlabel = legion.hexlabel
+        legion.hexlabel = rand.choice(hexlabels)
+        game.notify(Action.MoveLegion(game.name, legion.player.name,
+                                      legion.markerid, legion.hexlabel, 1,
+                                      False, None, previous_hexlabel))
+        _check(game, threat_map, rand, 50)
+        # Remove a legion.
+        legion = rand.choice(sorted(game.all_legions()))
+        legion.player.remove_legion(legion.markerid)
+        threat_map.sync()
+        _check(game, threat_map, rand, 50)
+    threat_map.close()
+    assert threat_map not in game.observers
@@ -0,0 +1,45 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+from slugathon.ai.TranspositionTable import TranspositionTable
+
+
+def test_get_put():
+    table = TranspositionTable()
+    assert table.get(1) is None
+    assert table.get(1, 0) == 0
+    table.put(1, 2.5)
+    assert 1 in table
+    assert table.get(1) == 2.5
+    table.put(1, 3.5)
+    assert table.get(1) == 3.5
+    assert len(table) == 1
+    assert table.hits == 2
+    assert table.misses == 2
+    table.clear()
+    assert len(table) == 0
+
+
+def test_lru():
+    table = TranspositionTable(3)
+    for key in xrange(3):
+        table.put(key, key)
+    table.get(0)
+    table.put(3, 3)
+    assert len(table) == 3
+    assert 0 in table
+    assert 1 not in table
+    assert 2 in table
+    assert 3 in table
+    table.put(2, 4)
+    table.put(4, 4)
+    table.put(5, 5)
+    assert 0 not in table
+    assert 3 not in table
+    assert 2 in table
+    assert table.get(2) == 4
+    table.clear()
+    table.put(6, 6)
+    assert len(table) == 1
+    assert table.get(6) == 6
@@ -0,0 +1,71 @@
+__copyright__ = "Copyright (c) 2012 David Ripton"
+__license__ = "GNU GPL v2"
+
+
+import pytest
+
+from slugathon.ai import CleverBot
+from slugathon.game import Phase
+from gamesetup import make_battle_game
+
+numpy = pytest.importorskip("numpy")
+
+from slugathon.ai.VectorScorer import VectorScorer
+
+
+def _compare_scores(game, cleverbot, creatures, movesets):
+    hex_scores = []
+    for ii, creature in enumerate(creatures):
+        hexlabel = creature.hexlabel
+        hex_score = {}
+        for move in movesets[ii]:
+            creature.hexlabel = move
+            hex_score[move] = cleverbot._score_hex(game, creature)
+        creature.hexlabel = hexlabel
+        hex_scores.append(hex_score)
+    scorer = VectorScorer(game, creatures, movesets, cleverbot.bp,
+                          hex_scores)
+    legion_moves = list(cleverbot._gen_legion_moves(
+        [set(moveset) for moveset in movesets]))
+    assert legion_moves
+    scores = scorer.score(legion_moves)
+    start_hexlabels = [creature.hexlabel for creature in creatures]
+    for ii, legion_move in enumerate(legion_moves):
+        for jj, creature in enumerate(creatures):
+            creature.hexlabel = legion_move[jj]
+        score = cleverbot._score_legion_move(game, creatures)
+        for jj, creature in enumerate(creatures):
+            creature.hexlabel = start_hexlabels[jj]
+        assert abs(scores[ii] - score) < 0.000001
+
+
+def test_score_maneuver():
+    game = make_battle_game()
+    cleverbot = CleverBot.CleverBot("p1", 1)
+    attacker = game.attacker_legion
+    defender = game.defender_legion
+    for creature, hexlabel in zip(defender.sorted_creatures,
+                                  ["E5", "D5", "D6", "C5", "E4", "F4"]):
+        creature.hexlabel = hexlabel
+    creatures = attacker.sorted_living_creatures[:4]
+    movesets = [["A1", "A2", "B1", "C2"], ["B2", "B3", "C3", "D4"],
+                ["C1", "D2", "D3", "C4"], ["A3", "B4", "D1", "E3"]]
+    game.battle_active_legion = attacker
+    assert game.battle_phase == Phase.MANEUVER
+    _compare_scores(game, cleverbot, creatures, movesets)
+
+
+def test_score_strike_phase():
+    game = make_battle_game()
+    cleverbot = CleverBot.CleverBot("p0", 1)
+    attacker = game.attacker_legion
+    defender = game.defender_legion
+    for creature, hexlabel in zip(attacker.sorted_creatures,
+                                  ["A1", "B1", "C2", "A3", "B3", "D1"]):
+        creature.hexlabel = hexlabel
+    attacker.sorted_creatures[4].hits = 5
+    creatures = defender.sorted_living_creatures[:4]
+    movesets = [["E5", "F4", "D4"], ["D5", "C4", "E4", "F3"],
+                ["D6", "C3", "E3"], ["C5", "D3", "E2", "F2"]]
+    game.battle_phase = Phase.STRIKE
+    _compare_scores(game, cleverbot, creatures, movesets)